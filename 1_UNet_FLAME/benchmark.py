@@ -0,0 +1,453 @@
+# benchmark.py
+# 离板性能基准: 用 Mock 推理后端驱动 rknnPoolExecutor + func_unet.myFunc,
+# 在 x86 / CI 上测量线程池吞吐和后处理耗时。--min_fps 可用于 CI 回归门禁。
+import argparse
+import functools
+import gc
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from rknnpool import rknnPoolExecutor, rknnPipelineExecutor, DROP_OLDEST
+from scene_gate import SceneGate, GatedPool
+from capture_thread import CaptureThread
+from frame_transport import FrameSender, ParallelFrameSender, JPEG
+from rknn_backend import MockBackend
+from func_unet import myFunc, PIPELINE_STAGES
+from func_unet import IMG_SIZE, INPUT_ARENA, OUTPUT_ARENA, preprocess_frame_for_unet
+import func_unet
+
+parser = argparse.ArgumentParser(description="Off-board benchmark for the UNet pipeline.")
+parser.add_argument("--frames", type=int, default=300, help="Frames to push through the pool")
+parser.add_argument("--tpes", type=int, default=3, help="Number of pool threads / contexts")
+parser.add_argument("--latency", type=float, default=0.03, help="Mock inference latency (s)")
+parser.add_argument("--width", type=int, default=1920)
+parser.add_argument("--height", type=int, default=1080)
+parser.add_argument("--pipeline", action="store_true", help="Benchmark rknnPipelineExecutor")
+parser.add_argument(
+    "--process_stages", type=str, default="", help="Pipeline stages to run in worker processes"
+)
+parser.add_argument(
+    "--tiled",
+    action="store_true",
+    help="Segment overlapping tiles at native resolution instead of squashing the frame",
+)
+parser.add_argument("--tile_size", type=int, default=256, help="Tile size (model input size)")
+parser.add_argument("--tile_overlap", type=int, default=32, help="Overlap between tiles in pixels")
+parser.add_argument(
+    "--max_tiles", type=int, default=24, help="Max tiles per frame; larger frames are downscaled first"
+)
+parser.add_argument("--tile_batch", type=int, default=1, help="Tiles per inference (model batch size)")
+parser.add_argument(
+    "--encode_workers", type=int, default=2, help="Threads for the parallel JPEG encode benchmark"
+)
+parser.add_argument("--warmup_runs", type=int, default=1, help="Warm-up runs per context")
+parser.add_argument(
+    "--max_frame_copies", type=float, default=1.0,
+    help="Exit with 1 if myFunc writes more than this many full-size frames per frame (render copy = 1)",
+)
+parser.add_argument(
+    "--max_frame_allocs", type=float, default=0.0,
+    help="Exit with 1 if myFunc allocates more than this many full-size frames per frame in steady state",
+)
+parser.add_argument("--min_fps", type=float, default=0.0, help="Exit with 1 if pool FPS is lower")
+args = parser.parse_args()
+
+func_unet.TILED_MODE = args.tiled
+func_unet.TILE_SIZE = args.tile_size
+func_unet.TILE_OVERLAP = args.tile_overlap
+func_unet.MAX_TILES = args.max_tiles
+func_unet.TILE_BATCH = args.tile_batch
+
+
+def synthetic_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+
+
+def alloc_profile(fn, *a, repeats=200):
+    # 每次调用的耗时、临时内存峰值 (tracemalloc) 和期间触发的 0 代 GC 次数
+    fn(*a)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(*a)
+    elapsed = (time.perf_counter() - start) / repeats
+    collections = gc.get_stats()[0]["collections"]
+    tracemalloc.start()
+    peak = 0
+    for _ in range(repeats):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(*a)
+        peak += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return elapsed, peak / repeats, gc.get_stats()[0]["collections"] - collections
+
+
+def print_alloc(name, profile):
+    elapsed, peak, collections = profile
+    print(f"  {name:8s}: {elapsed * 1000:6.2f} ms, peak {peak / 1024:8.1f} KiB/frame, gen0 GC {collections}")
+
+
+def bench_preprocess(frame):
+    # 原有的 resize + cvtColor + astype + expand_dims 与写入复用缓冲区的版本对比
+    def copying(img):
+        img = cv2.resize(img, IMG_SIZE)
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return np.expand_dims(img.astype(np.uint8), axis=0)
+
+    def arena(img):
+        INPUT_ARENA.release(preprocess_frame_for_unet(img, IMG_SIZE))
+
+    print_alloc("copying", alloc_profile(copying, frame))
+    print_alloc("arena", alloc_profile(arena, frame))
+
+
+class _CopyCounter():
+    """
+    代替 func_unet 中的 np / cv2 模块, 统计写入不小于 nbytes 的调用:
+    np.copyto 的目标, cv2 函数的 dst 参数, 没有 dst 时为返回的数组 (例如整帧 resize)。
+    """
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+        self.copies = 0
+
+    def wrap(self, module):
+        counter = self
+
+        class Proxy():
+            def __getattr__(self, name):
+                attr = getattr(module, name)
+                if not callable(attr) or isinstance(attr, type):
+                    return attr
+
+                def call(*a, **kw):
+                    out = attr(*a, **kw)
+                    dst = a[0] if name == "copyto" else kw.get("dst", out)
+                    if isinstance(dst, np.ndarray) and dst.nbytes >= counter.nbytes:
+                        counter.copies += 1
+                    return out
+
+                return call
+
+        return Proxy()
+
+
+def bench_frame_copies(frame, repeats=20):
+    # 稳态下 myFunc 每帧的整帧拷贝次数和新分配的整帧缓冲区个数 (都与分辨率无关)。
+    # 拷贝: func_unet 中写入不小于一整帧的 np / cv2 调用, 见 _CopyCounter;
+    # 分配: OUTPUT_ARENA 新分配的输出帧, 加上调用结束后仍存活、不小于一整帧的内存块 (例如没有走 arena 的输出拷贝)。
+    # 输入帧只读、渲染写入 OUTPUT_ARENA 复用的输出帧, 预热之后应为 1 次拷贝、0 次分配;
+    # 峰值 (模型分辨率的张量和火焰区域内的混合) 只作参考输出, 不参与判断。
+    # 只测主进程内的 myFunc: --process_stages 模式下渲染结果从共享内存拷出, 每帧固定多一次拷贝和分配
+    backend = MockBackend(preset="unet")
+    backend.load(None)
+
+    def large_blocks():
+        return sum(1 for t in tracemalloc.take_snapshot().traces if t.size >= frame.nbytes)
+
+    frames = [frame.copy() for _ in range(repeats + 1)]
+    OUTPUT_ARENA.release(myFunc(backend, frames[0]))
+    counter = _CopyCounter(frame.nbytes)
+    modules = func_unet.np, func_unet.cv2
+    func_unet.np, func_unet.cv2 = counter.wrap(np), counter.wrap(cv2)
+    tracemalloc.start()
+    allocs = 0
+    peak = 0
+    try:
+        for img in frames[1:]:
+            allocated = OUTPUT_ARENA.stats()["allocated"]
+            before = large_blocks()
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            out = myFunc(backend, img)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+            allocs += OUTPUT_ARENA.stats()["allocated"] - allocated + large_blocks() - before
+            OUTPUT_ARENA.release(out)
+            del out
+    finally:
+        tracemalloc.stop()
+        func_unet.np, func_unet.cv2 = modules
+    return counter.copies / repeats, allocs / repeats, peak
+
+
+def bench_postprocess(frame, repeats=50):
+    # 零延迟后端: 只统计 myFunc 中预处理 + 后处理 + 可视化的 CPU 耗时
+    backend = MockBackend(preset="unet")
+    backend.load(None)
+    myFunc(backend, frame.copy())
+    start = time.perf_counter()
+    for _ in range(repeats):
+        myFunc(backend, frame.copy())
+    return (time.perf_counter() - start) / repeats
+
+
+def bench_regions(frame, repeats=200):
+    # 从 Mock 输出的模型分辨率掩码中提取火焰区域, 对比记录大小与整张掩码的大小
+    backend = MockBackend(preset="unet")
+    backend.load(None)
+    mask = func_unet.postprocess_unet_output(
+        backend.outputs[0], frame.shape, binary=True, upscale=False
+    )
+    start = time.perf_counter()
+    for _ in range(repeats):
+        regions, vertices = func_unet.extract_fire_regions(mask, frame.shape)
+    elapsed = (time.perf_counter() - start) / repeats
+    return elapsed, len(regions), regions.nbytes + vertices.nbytes, frame.shape[0] * frame.shape[1]
+
+
+def check_noise_regions(frame):
+    # 只有孤立噪点 (都小于 MIN_REGION_PIXELS) 的掩码应返回空结果, 而不是抛出异常
+    mask = np.zeros((IMG_SIZE[1], IMG_SIZE[0]), dtype=np.uint8)
+    mask[::8, ::8] = 255
+    regions, vertices = func_unet.extract_fire_regions(mask, frame.shape)
+    return len(regions) == 0 and vertices.shape == (0, 2)
+
+
+class _NullSocket():
+    # 只计时编码, 不经过 ZMQ
+    def send_multipart(self, parts, flags=0, copy=True, track=False):
+        pass
+
+
+def bench_encode(frame, repeats=60):
+    # 主循环中串行编码 vs 编码阶段 (ParallelFrameSender) 的输出帧率
+    results = {}
+    for workers in (0, args.encode_workers):
+        sender = FrameSender(_NullSocket(), JPEG, 95)
+        if workers:
+            sender = ParallelFrameSender(sender, workers)
+        start = time.perf_counter()
+        for i in range(repeats):
+            sender.send(frame, i)
+        sender.close()
+        results[workers] = repeats / (time.perf_counter() - start)
+    return results
+
+
+def check_gate_drops(frames=150, scene=2):
+    # 场景门控 + 会丢帧的池 (1 个实例, maxInflight=2, drop_oldest, 取结果的节奏不规则):
+    # 输出必须按帧顺序, 复用帧只能用到它之前最近一次输出的推理结果。帧号写在左上角像素里
+    def index(img):
+        return int(img[0, 0, 0]) | int(img[0, 0, 1]) << 8
+
+    def infer(rknn_lite, job):
+        img, seq, timestamp = job
+        time.sleep(0.002 * (seq % 3 + 1))
+        return "infer", index(img)
+
+    pool = GatedPool(
+        rknnPoolExecutor(
+            rknnModel="mock", TPEs=1, func=infer, maxInflight=2, dropPolicy=DROP_OLDEST,
+            backend=functools.partial(MockBackend, preset="unet"), withMeta=True,
+        ),
+        SceneGate(),
+        lambda img, last: ("reuse", index(img), last[1]),
+    )
+    base = synthetic_frame()[:180, :320]
+    outputs = []
+    for i in range(frames):
+        img = np.roll(base, 40 * (i // scene), axis=1)
+        img[0, 0, :2] = (i & 0xFF, i >> 8)
+        pool.put(img)
+        for _ in range((0, 2, 1, 0, 1)[i % 5]):
+            result, flag = pool.get()
+            if flag:
+                outputs.append(result)
+    while True:
+        result, flag = pool.get()
+        if not flag:
+            break
+        outputs.append(result)
+    stats = pool.stats()
+    pool.release()
+    last = None
+    for prev, out in zip([None] + outputs, outputs):
+        if prev is not None and out[1] <= prev[1]:
+            return False, stats
+        if out[0] == "infer":
+            last = out[1]
+        elif out[2] != last:
+            return False, stats
+    return True, stats
+
+
+class _FrameSource():
+    # 模拟实时相机: read() 立即返回一帧, 由 CaptureThread 按帧率节流
+    def __init__(self, frame, count):
+        self.frame = frame
+        self.left = count
+
+    def read(self):
+        if self.left <= 0:
+            return False, None
+        self.left -= 1
+        return True, self.frame.copy()
+
+
+def bench_admission(frame, frames=120):
+    # 采集线程以 2 倍于推理能力的帧率提交 (与生产者相同的 maxInflight = 2 * TPEs, drop_oldest):
+    # 准入控制必须丢帧, 且从采集到取出结果的延迟保持有界
+    pool = rknnPoolExecutor(
+        rknnModel="mock",
+        TPEs=args.tpes,
+        func=lambda rknn_lite, job: (rknn_lite.inference([job[0]]), job[2])[1],
+        maxInflight=args.tpes * 2,
+        dropPolicy=DROP_OLDEST,
+        backend=functools.partial(MockBackend, preset="unet", latency=args.latency),
+        withMeta=True,
+    )
+    source = _FrameSource(frame[:64, :64], frames)
+    capture = CaptureThread(source, pool, 2 * args.tpes / args.latency).start()
+    latencies = []
+    while True:
+        timestamp, flag = capture.get()
+        if not flag:
+            break
+        latencies.append(time.time() - timestamp)
+    stats = pool.stats()
+    pool.release()
+    return stats["dropped"], len(latencies), max(latencies)
+
+
+class _IdentityBackend():
+    # 方块推理的恒等模型: 输出 logits 为输入 R 通道的线性变换, 拼接后应与整帧直接变换的结果一致
+    quantized_outputs = False
+
+    def inference(self, inputs, data_format=None):
+        return [(inputs[0][..., 0].astype(np.float32) - 128) / 32]
+
+
+def check_tile_stitching(shapes=((1080, 1920), (300, 200), (700, 1000)), batches=(1, 3)):
+    # 分块 -> 恒等推理 -> 加权拼接后, 掩码与整帧 (按相同的缩放) 直接转换的结果相差不超过 1 个灰度级,
+    # 即重叠区的加权平均没有接缝; 返回不满足的 (形状, TILE_BATCH) 列表
+    saved = func_unet.TILE_BATCH
+    failures = []
+    try:
+        for shape in shapes:
+            frame = np.random.default_rng(0).integers(0, 256, shape + (3,), dtype=np.uint8)
+            scale, (sh, sw), _, _ = func_unet.tile_layout(frame.shape)
+            red = cv2.resize(frame, (sw, sh), interpolation=cv2.INTER_AREA) if scale != 1.0 else frame
+            logits = (red[..., 2].astype(np.float32) - 128) / 32
+            if (sh, sw) != shape:
+                logits = cv2.resize(logits, (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
+            expected = func_unet.segmentation_to_mask(logits)
+            for batch in batches:
+                func_unet.TILE_BATCH = batch
+                layout, tiles = func_unet.preprocess_tiles(frame)
+                tiles = func_unet.infer_tiles(_IdentityBackend(), tiles, len(layout[3]))
+                mask = func_unet.stitch_tiles(tiles, layout, frame.shape)
+                if np.abs(mask.astype(np.int16) - expected).max() > 1:
+                    failures.append((shape, batch))
+    finally:
+        func_unet.TILE_BATCH = saved
+    return failures
+
+
+def bench_pool(frame):
+    backend = functools.partial(MockBackend, preset="unet", latency=args.latency)
+    if args.pipeline:
+        pool = rknnPipelineExecutor(
+            rknnModel="mock",
+            TPEs=args.tpes,
+            stages=PIPELINE_STAGES,
+            backend=backend,
+            processStages=[st for st in args.process_stages.split(",") if st],
+            warmupFrame=frame,
+            warmupRuns=args.warmup_runs,
+        )
+    else:
+        pool = rknnPoolExecutor(
+            rknnModel="mock",
+            TPEs=args.tpes,
+            func=myFunc,
+            backend=backend,
+            warmupFrame=frame,
+            warmupRuns=args.warmup_runs,
+        )
+    for _ in range(args.tpes + 1):
+        pool.put(frame.copy())
+    start = time.perf_counter()
+    for _ in range(args.frames):
+        pool.put(frame.copy())
+        pool.get()
+    elapsed = time.perf_counter() - start
+    while pool.get()[1]:
+        pass
+    stats = pool.stats()
+    pool.release()
+    return args.frames / elapsed, stats
+
+
+frame = synthetic_frame()
+print("Preprocess allocation:")
+bench_preprocess(frame)
+# 分块模式拼接 logits 需要整帧大小的累加缓冲区, 不做这项检查
+if not args.tiled:
+    frame_copies, frame_allocs, peak = bench_frame_copies(frame)
+    print(
+        f"Full-frame copies per frame:\t{frame_copies:.2f} (max {args.max_frame_copies}), "
+        f"allocations {frame_allocs:.2f} (max {args.max_frame_allocs}), peak {peak / 1024:.1f} KiB"
+    )
+    if frame_copies > args.max_frame_copies or frame_allocs > args.max_frame_allocs:
+        print("FAIL: myFunc copies or allocates full-size frames beyond the render copy")
+        exit(1)
+    if args.process_stages:
+        print("  (process stages: +1 copy and allocation per frame to detach the result from shared memory)")
+stitch_failures = check_tile_stitching()
+print(f"Tile stitching (identity model):\t{'exact' if not stitch_failures else stitch_failures}")
+if stitch_failures:
+    print("FAIL: stitched tiles do not reproduce the identity model's output")
+    exit(1)
+cpu_ms = bench_postprocess(frame) * 1000
+print(f"myFunc CPU time per frame:\t{cpu_ms:.2f} ms")
+region_s, region_count, region_bytes, mask_bytes = bench_regions(frame)
+print(
+    f"Fire regions per frame:\t\t{region_s * 1000:.2f} ms, {region_count} regions, "
+    f"{region_bytes} B (full-res mask {mask_bytes} B)"
+)
+if not check_noise_regions(frame):
+    print("FAIL: extract_fire_regions returns regions for a noise-only mask")
+    exit(1)
+encode_fps = bench_encode(frame)
+print(
+    f"JPEG encode:\t\t\t{encode_fps[0]:.1f} FPS inline, "
+    f"{encode_fps[args.encode_workers]:.1f} FPS with {args.encode_workers} encode threads"
+)
+ok, gate_stats = check_gate_drops()
+print(
+    f"Scene gate with drop_oldest:\t{gate_stats['gate']['skipped']} reused, "
+    f"{gate_stats['dropped']} dropped, {gate_stats['gate']['poolSkipped']} skipped"
+)
+if not ok:
+    print("FAIL: GatedPool emits frames out of order or reuses a later result")
+    exit(1)
+dropped, admitted, max_latency = bench_admission(frame)
+# 在途帧最多 2 * TPEs, 即最多排队两轮推理, 加上正在进行的一轮
+latency_bound = 3 * args.latency * 1.5
+print(
+    f"Admission (capture at 2x capacity):\t{dropped} dropped, {admitted} processed, "
+    f"max latency {max_latency * 1000:.0f} ms (bound {latency_bound * 1000:.0f} ms)"
+)
+if not dropped or max_latency > latency_bound:
+    print("FAIL: admission control does not bound latency when capture outruns inference")
+    exit(1)
+fps, stats = bench_pool(frame)
+print(f"Pool startup:\t\t\t{stats['startup']['total'] * 1000:.1f} ms (parallel load + warm-up)")
+print(f"Pool throughput:\t\t{fps:.2f} FPS (TPEs={args.tpes}, latency={args.latency}s)")
+megapixels = args.width * args.height / 1e6
+print(f"Pixel throughput:\t\t{fps * megapixels:.1f} MP/s ({1000 / max(fps * megapixels, 1e-9):.1f} ms/MP)")
+if args.tiled:
+    layout = func_unet.tile_layout((args.height, args.width))
+    print(f"  tiles per frame: {len(layout[3])}, scale {layout[0]:.2f}")
+for u in stats["utilization"]:
+    print(f"  context {u['index']} core{u['core']}: {u['tasks']} tasks, busy {u['busy']:.0%}")
+for st in stats.get("stages", []):
+    print(f"  stage {st['name']}: occupancy {st['occupancy']:.0%}, avg {st['avgMs']:.1f} ms")
+
+if fps < args.min_fps:
+    print(f"FAIL: {fps:.2f} FPS < --min_fps {args.min_fps}")
+    exit(1)
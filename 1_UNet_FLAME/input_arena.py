@@ -0,0 +1,60 @@
+# input_arena.py
+# 预分配的模型输入缓冲区: 前处理把缩放 / 填充 / BGR->RGB 之后的 NHWC 张量直接写进复用的缓冲区,
+# 推理结束后归还。稳态下每帧不再分配新的输入数组, 也不会产生需要回收的临时对象。
+# 同样的机制也用于渲染输出帧, 由消费者在发送 / 显示完成后归还。
+import threading
+import weakref
+from collections import defaultdict, deque
+
+import numpy as np
+
+
+class InputArena():
+    """
+    按 key 缓存空闲缓冲区, key 由调用方决定 (通常是输入尺寸 + 目标尺寸),
+    同一 key 的缓冲区布局相同, 填充区域只在分配时写一次, 之后只覆盖图像区域。
+    缓冲区数量随同时处于前处理和推理之间的帧数增长, 每个 key 最多保留 maxFree 个空闲缓冲区。
+    """
+
+    def __init__(self, maxFree=8):
+        self.maxFree = maxFree
+        self.free = defaultdict(deque)
+        # id -> 缓冲区 / key; 用来识别不属于本 arena 的数组 (例如经共享内存拷贝过的输入)
+        self.owned = weakref.WeakValueDictionary()
+        self.keys = {}
+        self.allocated = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, key, shape, fill=0):
+        """取一个空闲缓冲区, 没有则新分配并用 fill 填满 (例如 letterbox 的边框颜色)。"""
+        with self.lock:
+            free = self.free[key]
+            if free:
+                self.reused += 1
+                return free.pop()
+            self.allocated += 1
+        buf = np.empty(shape, dtype=np.uint8)
+        buf[...] = fill
+        with self.lock:
+            self.owned[id(buf)] = buf
+            self.keys[id(buf)] = key
+        weakref.finalize(buf, self.keys.pop, id(buf), None)
+        return buf
+
+    def release(self, buf):
+        """归还缓冲区; 不是本 arena 分配的数组直接忽略。"""
+        with self.lock:
+            if self.owned.get(id(buf)) is not buf:
+                return
+            free = self.free[self.keys[id(buf)]]
+            if len(free) < self.maxFree and not any(b is buf for b in free):
+                free.append(buf)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "allocated": self.allocated,
+                "reused": self.reused,
+                "free": sum(len(f) for f in self.free.values()),
+            }
@@ -0,0 +1,139 @@
+# metadata_channel.py
+# 检测 / 分割结果的元数据通道: 与视频流分开, 在单独的 PUB 端口 (METADATA_PORT) 上每帧发布一条小消息。
+# 视频被码率控制降级、被高水位丢弃时元数据照常全速发布, 告警和控制面板不需要重新做视觉处理。
+# 消息为 multipart: [主题, 帧头, 记录数组 (, 多边形顶点)], 记录是定长的小端二进制结构,
+# 帧头中的 frame_id / timestamp 与同一帧视频的帧头 (frame_transport) 相同, 订阅端据此把两者对应起来。
+# 坐标均为原图像素, 视频被缩放发送时按帧头中的原图尺寸换算。
+# 只依赖 numpy, UI 进程可以安全导入。
+import struct
+
+import numpy as np
+
+METADATA_PORT = 5456
+# 订阅端可以按主题前缀过滤, 例如只订阅 TOPIC_REGIONS
+TOPIC_DETECTIONS = b"det"
+TOPIC_REGIONS = b"fire"
+# 帧号, 时间戳, 原图高 / 宽, 记录数
+META_HEADER = struct.Struct("<qdIIi")
+# YOLO 检测框 (func.DETECTION_DTYPE 去掉逐条的 frame_id / timestamp): 24 字节 / 条
+DETECTION_WIRE_DTYPE = np.dtype([
+    ("box", "<f4", (4,)),
+    ("class", "<i4"),
+    ("score", "<f4"),
+])
+# UNet 火焰区域 (func_unet.FIRE_REGION_DTYPE 去掉逐条的 frame_id / timestamp): 40 字节 / 条,
+# 多边形顶点为单独一段 (N, 2) 的 <f4 数组
+REGION_WIRE_DTYPE = np.dtype([
+    ("bbox", "<f4", (4,)),
+    ("centroid", "<f4", (2,)),
+    ("area", "<f4"),
+    ("pixels", "<i4"),
+    ("vertex_start", "<i4"),
+    ("vertex_count", "<i4"),
+])
+
+
+def _toWire(records, dtype):
+    wire = np.zeros(0 if records is None else len(records), dtype=dtype)
+    if len(wire):
+        for name in dtype.names:
+            wire[name] = records[name]
+    return wire
+
+
+class MetadataPublisher():
+    """在 socket (PUB, 由调用方创建并绑定到 METADATA_PORT) 上发布每帧的检测 / 分割结果。"""
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.published = 0
+        self.bytes = 0
+
+    def _publish(self, topic, frameId, timestamp, frameShape, records, extra=()):
+        header = META_HEADER.pack(frameId, timestamp, frameShape[0], frameShape[1], len(records))
+        parts = [topic, header, records.tobytes()] + list(extra)
+        self.socket.send_multipart(parts)
+        self.published += 1
+        self.bytes += sum(len(p) for p in parts)
+
+    def publishDetections(self, dets, frameId, timestamp, frameShape):
+        """dets: func.to_detections 的结果, None 表示这一帧没有结果 (按 0 条发布)。"""
+        self._publish(TOPIC_DETECTIONS, frameId, timestamp, frameShape,
+                      _toWire(dets, DETECTION_WIRE_DTYPE))
+
+    def publishRegions(self, regions, vertices, frameId, timestamp, frameShape):
+        """regions / vertices: func_unet.extract_fire_regions 的结果, None 表示这一帧没有结果。"""
+        if vertices is None:
+            vertices = np.zeros((0, 2), dtype=np.float32)
+        self._publish(TOPIC_REGIONS, frameId, timestamp, frameShape,
+                      _toWire(regions, REGION_WIRE_DTYPE),
+                      [np.ascontiguousarray(vertices, dtype="<f4").tobytes()])
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "bytesPerFrame": self.bytes / self.published if self.published else 0.0,
+        }
+
+
+def unpackMetadata(parts):
+    """
+    把 recv_multipart 收到的消息解析为 dict(topic, frame_id, timestamp, frame_shape, records, vertices),
+    records 为 DETECTION_WIRE_DTYPE / REGION_WIRE_DTYPE 记录数组, vertices 只有火焰区域才有 (否则为 None)。
+    """
+    parts = [bytes(p) for p in parts]
+    topic, header, body = parts[:3]
+    frameId, timestamp, h, w, count = META_HEADER.unpack(header)
+    dtype = REGION_WIRE_DTYPE if topic == TOPIC_REGIONS else DETECTION_WIRE_DTYPE
+    records = np.frombuffer(body, dtype=dtype, count=count)
+    vertices = None
+    if topic == TOPIC_REGIONS:
+        vertices = np.frombuffer(parts[3], dtype="<f4").reshape(-1, 2)
+    return {
+        "topic": topic,
+        "frame_id": frameId,
+        "timestamp": timestamp,
+        "frame_shape": (h, w),
+        "records": records,
+        "vertices": vertices,
+    }
+
+
+def recvMetadata(socket, flags=0):
+    return unpackMetadata(socket.recv_multipart(flags=flags))
+
+
+def regionPolygon(meta, index):
+    """第 index 个火焰区域的多边形顶点 (K, 2), 原图像素坐标。"""
+    region = meta["records"][index]
+    start = int(region["vertex_start"])
+    return meta["vertices"][start:start + int(region["vertex_count"])]
+
+
+if __name__ == "__main__":
+    # 调试用: 订阅本机生产者的元数据并逐帧打印
+    import time
+    import zmq
+
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.connect(f"tcp://localhost:{METADATA_PORT}")
+    socket.setsockopt(zmq.SUBSCRIBE, b"")
+    print(f"Listening for metadata on tcp://localhost:{METADATA_PORT} ...")
+    try:
+        while True:
+            meta = recvMetadata(socket)
+            age = (time.time() - meta["timestamp"]) * 1000
+            line = f"[{meta['topic'].decode()}] frame {meta['frame_id']}, {len(meta['records'])} records, age {age:.1f} ms"
+            if len(meta["records"]):
+                top = meta["records"][0]
+                if meta["topic"] == TOPIC_REGIONS:
+                    line += f", largest area {top['area']:.0f} px at ({top['centroid'][0]:.0f}, {top['centroid'][1]:.0f})"
+                else:
+                    line += f", first class {top['class']} score {top['score']:.2f}"
+            print(line)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        socket.close()
+        context.term()
@@ -3,22 +3,21 @@ import cv2
 import time
 import os
 import argparse
+import functools
 import zmq
 import numpy as np
 
 # 确保rknnpool.py在Python路径中，或者与此脚本在同一目录
-from rknnpool import rknnPoolExecutor
-from func_unet import myFunc  # 从 func_unet.py 导入我们修改过的 myFunc
-
-# --- ZMQ 初始化 ---
-print("Initializing ZeroMQ Publisher...")
-context = zmq.Context()
-socket = context.socket(zmq.PUB)
-# 绑定到一个 TCP 端口。'5555' 是一个例子，你可以换成别的
-# 使用 '*' 表示允许任何 IP 连接
-socket.bind("tcp://*:5454")
-print("ZMQ Publisher is ready on tcp://*:5454")
-# --- 结束 ZMQ 初始化 ---
+from rknnpool import rknnPoolExecutor, rknnPipelineExecutor
+from rknn_backend import MockBackend
+# regionFunc 与 myFunc 相同, 但同时返回掩码 (供场景门控复用) 和矢量化的火焰区域
+from func_unet import regionFunc, reuse_mask, REGION_STAGES, OUTPUT_ARENA
+import func_unet
+from scene_gate import SceneGate, GatedPool
+from capture_thread import CaptureThread
+from frame_transport import FrameSender, ParallelFrameSender, ENCODINGS, configureLatency
+from rate_control import RateController, FEEDBACK_PORT
+from metadata_channel import MetadataPublisher, METADATA_PORT
 
 current_directory = os.getcwd()
 print("Current Directory:", current_directory)
@@ -56,6 +55,132 @@ parser.add_argument(
     default=3,
     help="Number of Thread Pool Executors (inference threads)",
 )
+parser.add_argument(
+    "--max_inflight",
+    type=int,
+    default=0,
+    help="Max frames submitted but not yet processed (0 = 2 * tpes)",
+)
+parser.add_argument(
+    "--drop_policy",
+    type=str,
+    default="drop_oldest",
+    choices=["drop_oldest", "drop_newest", "block"],
+    help="What to do with new frames when max_inflight is reached",
+)
+parser.add_argument(
+    "--realtime",
+    type=int,
+    default=1,
+    help="Read video files at their own FPS like a live camera (1), or as fast as possible (0; "
+    "use --drop_policy block to process every frame)",
+)
+parser.add_argument(
+    "--deadline_ms",
+    type=float,
+    default=0,
+    help="Skip frames not processed within this many ms of capture (0 = never skip)",
+)
+parser.add_argument(
+    "--unordered",
+    action="store_true",
+    help="Always output the newest finished frame instead of keeping capture order",
+)
+parser.add_argument(
+    "--pipeline",
+    action="store_true",
+    help="Run preprocess / infer / postprocess / render as separate pipeline stages",
+)
+parser.add_argument(
+    "--process_stages",
+    type=str,
+    default="",
+    help="Comma separated pipeline stages to run in worker processes, "
+    "e.g. preprocess,postprocess,render (requires --pipeline). Each call adds a "
+    "shared-memory copy and a process round trip; only worth it when these stages "
+    "are near 100%% occupancy in threaded mode and spare CPU cores are available",
+)
+parser.add_argument(
+    "--backend",
+    type=str,
+    default="rknnlite",
+    choices=["rknnlite", "onnx", "mock"],
+    help="Inference backend (onnx/mock allow running off-board)",
+)
+parser.add_argument(
+    "--mock_latency",
+    type=float,
+    default=0.03,
+    help="Simulated inference latency in seconds for the mock backend",
+)
+parser.add_argument(
+    "--warmup_runs",
+    type=int,
+    default=2,
+    help="Warm-up inferences per context on a synthetic frame before reading video",
+)
+parser.add_argument(
+    "--tiled",
+    action="store_true",
+    help="Segment overlapping tiles at native resolution instead of squashing the frame",
+)
+parser.add_argument("--tile_size", type=int, default=256, help="Tile size (model input size)")
+parser.add_argument("--tile_overlap", type=int, default=32, help="Overlap between tiles in pixels")
+parser.add_argument(
+    "--max_tiles", type=int, default=24, help="Max tiles per frame; larger frames are downscaled first"
+)
+parser.add_argument("--tile_batch", type=int, default=1, help="Tiles per inference (model batch size)")
+parser.add_argument(
+    "--scene_gate",
+    action="store_true",
+    help="Skip inference on frames that barely changed and reuse the previous mask",
+)
+parser.add_argument(
+    "--gate_threshold",
+    type=float,
+    default=12,
+    help="Max per-block brightness change (0-255) still treated as the same scene",
+)
+parser.add_argument(
+    "--gate_refresh",
+    type=int,
+    default=15,
+    help="Force an inference after this many consecutive reused frames",
+)
+parser.add_argument(
+    "--transport",
+    type=str,
+    default="raw",
+    choices=ENCODINGS,
+    help="raw: zero-copy pixels for a consumer on the same board; jpeg: for remote links",
+)
+parser.add_argument(
+    "--latency_mode",
+    type=int,
+    default=1,
+    help="1: cap the ZMQ send queue so a slow consumer drops frames instead of queueing them",
+)
+parser.add_argument(
+    "--rate_control",
+    action="store_true",
+    help="Adapt JPEG quality and output scale to the link using subscriber feedback",
+)
+parser.add_argument(
+    "--target_kbps", type=float, default=4000, help="Bitrate target for --rate_control (0: off)"
+)
+parser.add_argument(
+    "--target_latency_ms",
+    type=float,
+    default=200,
+    help="Frame age target reported by the subscriber for --rate_control (0: off)",
+)
+parser.add_argument(
+    "--encode_workers",
+    type=int,
+    default=2,
+    help="Threads encoding output frames off the main loop (0: encode inline)",
+)
+parser.add_argument("--jpeg_quality", type=int, default=95, help="JPEG quality for --transport jpeg")
 parser.add_argument(
     "--show", type=int, default=0, help="Show output frames (1 to show, 0 to not show)"
 )
@@ -63,6 +188,42 @@ parser.add_argument(
 args = parser.parse_args()
 print("Arguments:", vars(args))
 
+# --- ZMQ 初始化 ---
+print("Initializing ZeroMQ Publisher...")
+context = zmq.Context()
+socket = context.socket(zmq.PUB)
+if args.latency_mode:
+    # 发送队列只保留 LATENCY_HWM 帧 (须在 bind 之前设置)
+    configureLatency(socket)
+# 绑定到一个 TCP 端口。'5555' 是一个例子，你可以换成别的
+# 使用 '*' 表示允许任何 IP 连接
+socket.bind("tcp://*:5454")
+print("ZMQ Publisher is ready on tcp://*:5454")
+# --- 结束 ZMQ 初始化 ---
+
+# 输出帧发送完成 (raw) 或编码完成 (jpeg) 后归还给渲染阶段复用
+sender = FrameSender(socket, args.transport, args.jpeg_quality, release=OUTPUT_ARENA.release)
+if args.encode_workers > 0:
+    # 编码阶段: 缩放 / JPEG 编码在线程池中与采集和推理重叠, 仍按帧顺序发送
+    sender = ParallelFrameSender(sender, args.encode_workers)
+# 元数据通道: 每帧的火焰区域在单独的端口上发布, 不受视频高水位 / 码率控制影响
+meta_socket = context.socket(zmq.PUB)
+meta_socket.bind(f"tcp://*:{METADATA_PORT}")
+publisher = MetadataPublisher(meta_socket)
+print(f"Metadata publisher is ready on tcp://*:{METADATA_PORT}")
+controller = None
+if args.rate_control:
+    # 回传通道: 订阅端定期发来帧龄 / 丢帧率
+    feedback_socket = context.socket(zmq.SUB)
+    feedback_socket.setsockopt_string(zmq.SUBSCRIBE, "")
+    feedback_socket.bind(f"tcp://*:{FEEDBACK_PORT}")
+    controller = RateController(
+        args.target_kbps or None,
+        args.target_latency_ms or None,
+        maxQuality=args.jpeg_quality,
+        feedbackSocket=feedback_socket,
+    )
+
 input_video_path = os.path.join(base_dir, args.video_path)
 model_rknn_path = os.path.join(base_dir, args.model_path)
 output_video_path = os.path.join(base_dir, args.output_path)
@@ -87,16 +248,60 @@ frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))  # 获取视频帧的高
 fps = cap.get(cv2.CAP_PROP_FPS)  # 获取视频的帧率
 print(f"输入视频属性: Width={frame_width}, Height={frame_height}, FPS={fps:.2f}")
 
+# 分块模式的配置要在创建处理池 (以及 fork 阶段子进程) 之前设置
+func_unet.TILED_MODE = args.tiled
+func_unet.TILE_SIZE = args.tile_size
+func_unet.TILE_OVERLAP = args.tile_overlap
+func_unet.MAX_TILES = args.max_tiles
+func_unet.TILE_BATCH = args.tile_batch
+if args.tiled:
+    layout = func_unet.tile_layout((frame_height, frame_width))
+    print(f"分块模式: {len(layout[3])} 个方块, 缩放 {layout[0]:.2f}")
+
 # 初始化 rknnPoolExecutor
 # TPEs 数量，增加可以提高帧率，但取决于NPU核心数和系统负载
 TPEs = args.tpes
+# 在途帧上限，超过后按 drop_policy 丢帧，保证延迟有界
+max_inflight = args.max_inflight if args.max_inflight > 0 else TPEs * 2
+# mock 后端需要知道模型的输出形状和模拟耗时
+backend = args.backend
+if backend == "mock":
+    backend = functools.partial(MockBackend, preset="unet", latency=args.mock_latency)
+# 预热用的合成帧: 与输入视频同尺寸, 让首帧之前就完成运行时的延迟初始化
+warmup_frame = np.zeros((frame_height, frame_width, 3), dtype=np.uint8)
 print(f"Initializing RKNN Pool with TPEs: {TPEs}")
-pool = rknnPoolExecutor(
-    rknnModel=model_rknn_path,  # 传递模型路径
-    TPEs=TPEs,
-    func=myFunc,  # 我们在 func_unet.py 中定义的回调函数
-)
-print("RKNN Pool initialized.")
+# asyncInit: 在后台并行加载和预热各实例, 读取视频前再用 waitReady() 等待
+if args.pipeline:
+    # 流水线模式: NPU 推理与 CPU 前后处理在不同线程中重叠执行
+    pool = rknnPipelineExecutor(
+        rknnModel=model_rknn_path,
+        TPEs=TPEs,
+        stages=REGION_STAGES,
+        workers={"render": 2},  # 全帧叠加渲染是 CPU 上最重的阶段
+        dropPolicy=args.drop_policy,
+        backend=backend,
+        # 在子进程中运行的阶段不受 GIL 限制, 帧通过共享内存传递
+        processStages=[st for st in args.process_stages.split(",") if st],
+        warmupFrame=warmup_frame,
+        warmupRuns=args.warmup_runs,
+        asyncInit=True,
+        withMeta=True,  # 火焰区域记录带上帧号和采集时间
+    )
+else:
+    pool = rknnPoolExecutor(
+        rknnModel=model_rknn_path,  # 传递模型路径
+        TPEs=TPEs,
+        func=regionFunc,  # 我们在 func_unet.py 中定义的回调函数
+        maxInflight=max_inflight,
+        dropPolicy=args.drop_policy,
+        backend=backend,
+        ordered=not args.unordered,
+        deadline=args.deadline_ms / 1000 if args.deadline_ms > 0 else None,
+        warmupFrame=warmup_frame,
+        warmupRuns=args.warmup_runs,
+        asyncInit=True,
+        withMeta=True,  # 火焰区域记录带上帧号和采集时间
+    )
 
 # 初始化 VideoWriter
 # 对于拼接后的视频，宽度会加倍
@@ -105,15 +310,22 @@ output_frame_width = frame_width  # 如果myFunc返回的是与原图同尺寸
 # output_frame_width = frame_width * 2 # 因为 myFunc 中 hstack 了两个图像
 output_frame_height = frame_height
 
-# 预先填充处理队列，以利用异步处理，先进行几帧的处理，等get的时候可以直接获取
-print("Pre-filling the queue...")
-for i in range(TPEs + 1):  # +1 确保至少有一个结果可以立即get
-    ret, frame = cap.read()
-    if not ret:
-        print("Warning: Video ended before pre-filling queue completely.")
-        break
-    pool.put(frame)  # 将原始帧放入队列，myFunc会处理它
-print(f"Pre-filled {i+1 if ret else i} frames.")
+# 等待所有实例加载并预热完成后才开始读取视频帧
+pool.waitReady()
+startup = pool.stats()["startup"]
+print(f"RKNN Pool initialized and warmed up in {startup['total']:.2f}s.")
+for ctx in startup["contexts"]:
+    print(
+        f"  context {ctx['index']}: load {ctx['load']:.2f}s, warmup {ctx['warmup']:.2f}s"
+    )
+
+if args.scene_gate:
+    # 画面几乎不变时不提交推理, 把上一次的掩码叠加到当前帧上
+    pool = GatedPool(pool, SceneGate(args.gate_threshold, args.gate_refresh), reuse_mask)
+
+# 采集线程按视频帧率读取并提交帧, 主循环只取结果; 推理跟不上时由处理池的准入控制丢帧,
+# 而不是让采集跟着推理变慢、帧在摄像头缓冲区里越积越多
+capture = CaptureThread(cap, pool, fps if args.realtime and fps > 0 else None).start()
 
 
 frames_processed_count = 0
@@ -128,31 +340,19 @@ display_fps = 0.0
 print("开始视频处理循环...")
 try:
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        # 从处理池获取一个已经处理完成的结果
+        # get() 是阻塞的, 视频读完且所有帧都处理完后返回 flag=False
+        result, flag = capture.get()
+        if not flag:
             break
 
-        # 关键修改：在提交前创建一个帧的副本！
-        frame_copy = frame.copy()
-        pool.put(frame_copy)
-
-        # 3. 从处理池获取一个已经处理完成的结果
-        # get() 是阻塞的, 它会等待直到 myFunc 返回一个结果
-        result = pool.get()
-
-        # 检查从线程池获取的结果是否有效
-        if result is None:
-            print("从处理池收到一个 None 结果，跳过此帧。")
-            continue
-
-        # 假设 myFunc 返回 (处理后的图像, 标志位)
-        processed_frame_for_output, flag = result
+        # regionFunc 返回 (处理后的图像, 掩码, (火焰区域, 多边形顶点))
+        processed_frame_for_output, _, fire_regions = result
 
-        # 如果处理失败，可以选择跳过或显示原始帧
-        if not flag:
+        # 如果处理失败, 跳过这一帧 (原始帧在采集线程中, 已交给处理池)
+        if processed_frame_for_output is None:
             print("警告: 帧处理失败。")
-            # 如果处理失败，我们依然可以显示原始输入帧以避免画面卡顿
-            processed_frame_for_output = frame_copy
+            continue
 
         # ==================== 核心修改：嵌入实时显示逻辑 ====================
 
@@ -163,6 +363,25 @@ try:
             display_fps = fps_frame_count / (time.time() - fps_start_time)
             fps_frame_count = 0
             fps_start_time = time.time()
+            print(
+                f"FPS {display_fps:.2f}, "
+                f"{display_fps * frame_width * frame_height / 1e6:.1f} MP/s"
+            )
+            if fire_regions is not None and len(fire_regions[0]):
+                regions = fire_regions[0]
+                print(
+                    f"火焰区域: {len(regions)} 个, 总面积 {regions['area'].sum():.0f} px, "
+                    f"最大区域质心 ({regions['centroid'][0][0]:.0f}, {regions['centroid'][0][1]:.0f})"
+                )
+            pool_stats = pool.stats()
+            if "gate" in pool_stats:
+                print(f"场景门控: {pool_stats['gate']}")
+            print(f"发送: {sender.stats()}, 元数据: {publisher.stats()}")
+            if controller is not None:
+                print(f"码率控制: {controller.stats()}")
+            if pool_stats["dropped"]:
+                print(f"准入控制已丢弃 {pool_stats['dropped']} 帧: {pool_stats}")
+                print(f"采集: {capture.stats()}")
 
         # --- 在处理后的图像上绘制信息 ---
         # 获取处理后图像的实际尺寸，因为myFunc可能改变了它
@@ -191,14 +410,19 @@ try:
         )
         # ==================== 核心修改：发送图像而不是显示 ====================
 
-        # 将图像编码为JPEG格式，以减少传输数据量
-        # 95 是质量参数 (0-100)，越高图像质量越好，数据量越大
-        _, buffer = cv2.imencode(
-            ".jpg", processed_frame_for_output, [cv2.IMWRITE_JPEG_QUALITY, 95]
+        # raw: 帧头 + 原始像素零拷贝发送, 本机消费者无需解码;
+        # jpeg: 编码后发送, 以减少远程链路的传输数据量 (--jpeg_quality 越高图像质量越好, 数据量越大)
+        # 元数据先于视频发布, 消息头与视频帧使用同一个帧号和时间戳; 处理失败的帧按 0 个区域发布。
+        # 区域记录中的 frame_id / timestamp 保持为实际推理的那一帧 (场景门控复用时与输出帧不同), 不在这里改写
+        now = time.time()
+        regions, vertices = fire_regions if fire_regions is not None else (None, None)
+        publisher.publishRegions(
+            regions, vertices, frames_processed_count, now, (frame_height, frame_width)
         )
-
-        # ZMQ 发送编码后的数据
-        socket.send(buffer)
+        sender.send(processed_frame_for_output, frames_processed_count, now)
+        frames_processed_count += 1
+        if controller is not None:
+            controller.step(sender)
 
         # 你可以加一个小的延时来控制发送帧率，如果需要的话
         # time.sleep(0.01)
@@ -208,11 +432,17 @@ except KeyboardInterrupt:
     print("检测到 Ctrl+C，正在关闭程序...")
 finally:
     # --- 释放资源 ---
+    print("正在停止采集线程...")
+    capture.stop(timeout=5)
     print("正在等待所有处理任务完成...")
     pool.release()
     print("正在释放摄像头...")
     cap.release()
     print("正在关闭ZMQ...")
+    sender.close()
+    if controller is not None:
+        feedback_socket.close()
+    meta_socket.close()
     socket.close()
     context.term()
     print("程序已成功关闭。")
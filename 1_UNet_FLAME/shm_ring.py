@@ -0,0 +1,220 @@
+# shm_ring.py
+# worker_process -> qt_consumer 的共享内存帧环形缓冲区, 代替 mp.Queue (每帧一次 pickle + 两次拷贝)。
+# 写端把帧拷进固定大小的槽位, 读端直接在共享内存上构造数组 / QImage, 不经过 pickle。
+# 单写者, 任意读者, 不加锁: 每个槽位有序号, 写入期间序号置 -1, 写完再发布到 latest;
+# 读者用完槽位后再核对一次序号 (seqlock), 被写端覆盖的帧丢弃并计入 overrun。
+# 只依赖 numpy 和 multiprocessing, UI 进程可以安全导入 (不引入 cv2 / zmq)。
+from multiprocessing import shared_memory
+
+import time
+
+import numpy as np
+
+MAGIC = 0x46524E47  # "FRNG"
+# 控制块: 数据块的代数 (帧超出槽位大小时写端重新分配数据块), 槽位数 / 大小, 最新发布的帧序号,
+# 读端最近取走的帧序号 (写端据此判断 UI 是否已准备好接收下一帧)
+CONTROL_DTYPE = np.dtype([
+    ("magic", np.int64),
+    ("generation", np.int64),
+    ("slots", np.int64),
+    ("slotBytes", np.int64),
+    ("latest", np.int64),
+    ("consumed", np.int64),
+])
+SLOT_DTYPE = np.dtype([
+    ("seq", np.int64),
+    ("shape", np.int64, (3,)),
+    ("frame_id", np.int64),
+    ("timestamp", np.float64),
+])
+DEFAULT_SLOTS = 4
+DEFAULT_SLOT_BYTES = 1920 * 1080 * 3
+
+
+def _dataName(name, generation):
+    return f"{name}_{generation}"
+
+
+def _controlViews(shm, slots=None):
+    control = np.ndarray((), CONTROL_DTYPE, buffer=shm.buf)
+    if slots is not None:
+        control["slots"] = slots
+    meta = np.ndarray(
+        (int(control["slots"]),), SLOT_DTYPE, buffer=shm.buf, offset=CONTROL_DTYPE.itemsize
+    )
+    return control, meta
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # 调用方仍持有该块上的数组, 映射随数组一起释放
+        pass
+
+
+class FrameRingWriter():
+    """
+    创建名为 name 的环形缓冲区, slots 个槽位, 每个槽位 slotBytes 字节 (按需增长)。
+    分辨率变化时只要帧不超过槽位大小就直接写入 (每个槽位记录自己的形状);
+    超过时分配一个更大的数据块并递增 generation, 读端检测到后重新映射。
+    """
+
+    def __init__(self, name, slots=DEFAULT_SLOTS, slotBytes=DEFAULT_SLOT_BYTES):
+        self.name = name
+        self.control = shared_memory.SharedMemory(
+            name=name, create=True, size=CONTROL_DTYPE.itemsize + slots * SLOT_DTYPE.itemsize
+        )
+        self.header, self.meta = _controlViews(self.control, slots)
+        self.header["latest"] = -1
+        self.header["consumed"] = -1
+        self.data = None
+        self._allocate(slotBytes)
+        self.seq = -1
+        # 最后写 magic, 读端看到它才认为缓冲区已初始化
+        self.header["magic"] = MAGIC
+
+    def _allocate(self, slotBytes):
+        generation = int(self.header["generation"]) + (self.data is not None)
+        data = shared_memory.SharedMemory(
+            name=_dataName(self.name, generation), create=True, size=self.slots * slotBytes
+        )
+        # 旧数据块的所有槽位作废, 读端按新的 generation 重新映射
+        self.meta["seq"] = -1
+        self.header["slotBytes"] = slotBytes
+        self.header["generation"] = generation
+        if self.data is not None:
+            self.data.close()
+            self.data.unlink()
+        self.data = data
+        self.slotBytes = slotBytes
+
+    @property
+    def slots(self):
+        return len(self.meta)
+
+    def readerReady(self):
+        """读端已经取走了最新发布的帧 (或还没有写过帧); 只有一个读端时有意义。"""
+        return int(self.header["consumed"]) >= self.seq
+
+    def write(self, frame, frameId=-1, timestamp=0.0):
+        """把 uint8 帧 (H, W) 或 (H, W, C) 拷进下一个槽位并发布为最新帧。"""
+        if frame.nbytes > self.slotBytes:
+            self._allocate(frame.nbytes)
+        seq = self.seq + 1
+        slot = self.meta[seq % self.slots]
+        slot["seq"] = -1  # 写入中, 读端看到后放弃这个槽位
+        view = np.ndarray(frame.shape, np.uint8, buffer=self.data.buf,
+                          offset=seq % self.slots * self.slotBytes)
+        view[...] = frame
+        shape = frame.shape + (1,) * (3 - frame.ndim)
+        slot["shape"] = shape
+        slot["frame_id"] = frameId
+        slot["timestamp"] = timestamp
+        slot["seq"] = seq
+        self.header["latest"] = seq
+        self.seq = seq
+        return seq
+
+    def close(self):
+        """关闭并删除共享内存 (写端拥有缓冲区的生命周期)。"""
+        for shm in (self.data, self.control):
+            _close(shm)
+            shm.unlink()
+
+
+class FrameRingReader():
+    """
+    映射写端创建的环形缓冲区; 写端尚未创建时抛出 FileNotFoundError, 调用方稍后重试。
+    用法:
+        frame, info = reader.latest()   # 没有新帧时 frame 为 None
+        ... 使用 frame (共享内存上的只读视图, 例如拷贝成 QImage) ...
+        if reader.verify(info): 使用结果, 否则这一帧在使用期间已被覆盖, 丢弃
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.control = self._attach(name)
+        self.header, self.meta = _controlViews(self.control)
+        if int(self.header["magic"]) != MAGIC:
+            _close(self.control)
+            raise FileNotFoundError(f"共享内存 {name} 尚未初始化")
+        self.generation = None
+        self.data = None
+        self.lastSeq = -1
+        self.lastAge = 0.0
+        self.received = 0
+        self.skipped = 0
+        self.overrun = 0
+
+    @staticmethod
+    def _attach(name):
+        # 读端不删除共享内存; 读写两端由同一个父进程启动时共用一个 resource_tracker,
+        # 写端 unlink 时注销, 写端异常退出时由 resource_tracker 清理
+        return shared_memory.SharedMemory(name=name)
+
+    def _remap(self, generation):
+        if self.data is not None:
+            _close(self.data)
+        self.data = self._attach(_dataName(self.name, generation))
+        self.generation = generation
+
+    def latest(self):
+        """
+        返回 (最新帧的只读视图, dict(seq, frame_id, timestamp));
+        没有比上次更新的帧时返回 (None, None)。
+        """
+        seq = int(self.header["latest"])
+        if seq < 0 or seq == self.lastSeq:
+            return None, None
+        generation = int(self.header["generation"])
+        if generation != self.generation:
+            try:
+                self._remap(generation)
+            except FileNotFoundError:
+                # 写端正在替换数据块
+                return None, None
+        slot = self.meta[seq % len(self.meta)]
+        shape = tuple(int(n) for n in slot["shape"])
+        info = {"seq": seq, "frame_id": int(slot["frame_id"]), "timestamp": float(slot["timestamp"])}
+        if int(slot["seq"]) != seq or int(self.header["generation"]) != generation:
+            self.overrun += 1
+            return None, None
+        frame = np.ndarray(shape, np.uint8, buffer=self.data.buf,
+                           offset=seq % len(self.meta) * int(self.header["slotBytes"]))
+        frame.flags.writeable = False
+        if self.lastSeq >= 0 and seq > self.lastSeq + 1:
+            # 读得比写得慢, 中间的帧被跳过
+            self.skipped += seq - self.lastSeq - 1
+        self.lastSeq = seq
+        self.header["consumed"] = seq
+        if info["timestamp"] > 0:
+            self.lastAge = time.time() - info["timestamp"]
+        self.received += 1
+        return frame, info
+
+    def verify(self, info):
+        """latest() 返回的帧在使用期间没有被覆盖时返回 True。"""
+        seq = info["seq"]
+        ok = int(self.meta[seq % len(self.meta)]["seq"]) == seq
+        if not ok:
+            self.overrun += 1
+        return ok
+
+    def stats(self):
+        """
+        skipped: 因读得慢而跳过的帧数; overrun: 读取过程中被写端覆盖而丢弃的帧数;
+        lag: 缓冲区中还没读到的帧数; ageMs: 最近一帧从生产者发送到被读取经过的时间。
+        """
+        return {
+            "received": self.received,
+            "skipped": self.skipped,
+            "overrun": self.overrun,
+            "lag": int(self.header["latest"]) - self.lastSeq,
+            "ageMs": self.lastAge * 1000,
+        }
+
+    def close(self):
+        for shm in (self.data, self.control):
+            if shm is not None:
+                _close(shm)
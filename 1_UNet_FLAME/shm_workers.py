@@ -0,0 +1,153 @@
+# shm_workers.py
+# 在子进程中运行前处理 / 后处理阶段, 绕开 GIL, 利用 RK3588 的全部 CPU 核心。
+# 帧和张量放在预先分配的共享内存槽位中, 进程间只 pickle 很小的 (偏移, 形状, dtype) 描述;
+# 推理仍然在持有 RKNNLite 实例的主进程中执行。
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from queue import Queue
+
+import numpy as np
+
+_ALIGN = 64
+
+
+class _ShmArray():
+    """槽位内一个数组的描述, 代替数组本身在进程间传递。"""
+
+    __slots__ = ("offset", "shape", "dtype", "strides")
+
+    def __init__(self, offset, shape, dtype, strides):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+        self.strides = strides
+
+    def __getstate__(self):
+        return (self.offset, self.shape, self.dtype, self.strides)
+
+    def __setstate__(self, state):
+        self.offset, self.shape, self.dtype, self.strides = state
+
+
+class _Slot():
+    """一块共享内存, 同一时刻只属于一个在途帧; used 为按帧递增的分配位置。"""
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.base = np.frombuffer(shm.buf, np.uint8)
+        self.addr = self.base.ctypes.data
+        self.used = 0
+
+    def contains(self, arr):
+        addr = arr.__array_interface__["data"][0]
+        return self.addr <= addr and addr + arr.nbytes <= self.addr + self.base.size
+
+
+def _pack(obj, slot):
+    # 递归地把 tuple / list 中的数组换成 _ShmArray; 已在槽位内的数组不再拷贝
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        if slot.contains(obj):
+            offset = obj.__array_interface__["data"][0] - slot.addr
+            return _ShmArray(offset, obj.shape, obj.dtype, obj.strides)
+        offset = (slot.used + _ALIGN - 1) // _ALIGN * _ALIGN
+        if offset + obj.nbytes > slot.base.size:
+            raise MemoryError(
+                f"共享内存槽位不足: 需要 {offset + obj.nbytes} 字节, "
+                f"槽位大小 {slot.base.size}, 请增大 slotBytes"
+            )
+        view = np.ndarray(obj.shape, obj.dtype, buffer=slot.shm.buf, offset=offset)
+        view[...] = obj
+        slot.used = offset + obj.nbytes
+        return _ShmArray(offset, obj.shape, obj.dtype, view.strides)
+    if isinstance(obj, tuple):
+        return tuple(_pack(o, slot) for o in obj)
+    if isinstance(obj, list):
+        return [_pack(o, slot) for o in obj]
+    return obj
+
+
+def _unpack(obj, slot):
+    if isinstance(obj, _ShmArray):
+        return np.ndarray(
+            obj.shape,
+            np.dtype(obj.dtype),
+            buffer=slot.shm.buf,
+            offset=obj.offset,
+            strides=obj.strides,
+        )
+    if isinstance(obj, tuple):
+        return tuple(_unpack(o, slot) for o in obj)
+    if isinstance(obj, list):
+        return [_unpack(o, slot) for o in obj]
+    return obj
+
+
+def detach(obj, slot):
+    """把仍指向槽位的数组拷贝出来, 之后槽位即可被下一帧复用。"""
+    if isinstance(obj, np.ndarray) and obj.dtype != object and slot.contains(obj):
+        return obj.copy()
+    if isinstance(obj, tuple):
+        return tuple(detach(o, slot) for o in obj)
+    if isinstance(obj, list):
+        return [detach(o, slot) for o in obj]
+    return obj
+
+
+# 子进程内按名字缓存已附加的槽位, 每个槽位只 attach 一次。
+# 槽位由主进程创建和 unlink, 子进程只负责 attach / close。
+_childSlots = {}
+
+
+def _runStage(fn, name, used, packed):
+    slot = _childSlots.get(name)
+    if slot is None:
+        slot = _childSlots[name] = _Slot(shared_memory.SharedMemory(name=name))
+    slot.used = used
+    result = fn(_unpack(packed, slot))
+    return _pack(result, slot), slot.used
+
+
+class ProcessStageRunner():
+    """
+    processes: 子进程数; slots / slotBytes: 共享内存槽位的数量和每个槽位的字节数。
+    槽位全部被在途帧占用时 acquire() 会阻塞, 起到反压作用。
+    """
+
+    def __init__(self, processes, slots=8, slotBytes=64 << 20):
+        # 先创建槽位: 这会启动 resource_tracker, 之后 fork 出的子进程共用它,
+        # 子进程 attach 时不会各自启动 tracker 并在退出时误删槽位
+        self.slots = [
+            _Slot(shared_memory.SharedMemory(create=True, size=slotBytes))
+            for _ in range(slots)
+        ]
+        # 使用 fork: 生产者脚本的顶层代码没有 __main__ 保护, spawn 会在子进程里重新执行它。
+        # 应在启动任何线程、初始化 NPU 之前创建
+        self.pool = mp.get_context("fork").Pool(processes)
+        self.free = Queue()
+        for slot in self.slots:
+            self.free.put(slot)
+
+    def acquire(self):
+        return self.free.get()
+
+    def releaseSlot(self, slot):
+        slot.used = 0
+        self.free.put(slot)
+
+    def call(self, fn, slot, data):
+        """在子进程中执行 fn(data), data 与返回值中的数组都经由 slot 传递。"""
+        packed = _pack(data, slot)
+        packedResult, slot.used = self.pool.apply(
+            _runStage, (fn, slot.shm.name, slot.used, packed))
+        return _unpack(packedResult, slot)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        for slot in self.slots:
+            slot.base = None
+            try:
+                slot.shm.close()
+            except BufferError:
+                pass  # 仍有数组视图引用该槽位, 交给进程退出时回收映射
+            slot.shm.unlink()
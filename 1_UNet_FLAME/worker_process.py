@@ -1,100 +1,149 @@
 # worker_process.py (已修正)
 
 import cv2
+import os
+import signal
+import sys
 import time
 import zmq
 import numpy as np
 
-# 导入 Process 和 Queue
-from multiprocessing import Process, Queue
+# 导入 Process
+from multiprocessing import Process
 
+from frame_transport import recvFrame, configureLatency, LatestFrameMailbox
+from shm_ring import FrameRingWriter, FrameRingReader
+from rate_control import sendFeedback, FEEDBACK_PORT
 
-def worker_loop(frame_queue):
+# 低延迟模式: ZMQ 接收队列只保留 LATENCY_HWM 条消息, 积压的帧只留最新一条,
+# 等 UI 取走上一帧后才解码并写入; 生产者端也要打开 (UNet: --latency_mode 1, YOLO: LATENCY_MODE)
+LATENCY_MODE = True
+# 队列深度 / 帧龄统计的输出间隔 (秒), 输出的是最近一个回传周期内的统计
+STATS_INTERVAL = 5.0
+# 低延迟模式下向生产者回传帧龄 / 丢帧率的间隔 (秒), 供 rate_control.RateController 调整码率
+FEEDBACK_INTERVAL = 0.5
+
+
+def worker_loop(ring_name, latency_mode=LATENCY_MODE):
     """
     这个函数在独立的子进程中运行。
-    :param frame_queue: 一个 multiprocessing.Queue，用于将图像发回主UI进程。
+    :param ring_name: 共享内存环形缓冲区的名字, 本进程创建它并把收到的帧写进去,
+                      主UI进程用 shm_ring.FrameRingReader 按同一个名字映射读取, 帧不经过 pickle。
+    :param latency_mode: 见 LATENCY_MODE; False 时每收到一帧就解码写入。
     """
+    # terminate() 发送 SIGTERM, 转为正常退出, 保证下面的 finally 删除共享内存
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    ring = FrameRingWriter(ring_name)
     # --- ZMQ 客户端设置 ---
     context = zmq.Context()
     socket = context.socket(zmq.SUB)
+    if latency_mode:
+        configureLatency(socket)
     # 重要：连接到 sender 绑定的地址
     socket.connect("tcp://localhost:5454")
     socket.setsockopt_string(zmq.SUBSCRIBE, "")
     print("[Worker Process] ZMQ client connected and listening.")
+    mailbox = None
+    if latency_mode:
+        mailbox = LatestFrameMailbox(socket)
+        # 回传通道: 生产者没有打开码率控制时没有人接收, 反馈被直接丢弃
+        feedback = context.socket(zmq.PUB)
+        configureLatency(feedback)
+        feedback.connect(f"tcp://localhost:{FEEDBACK_PORT}")
+    last_report = last_feedback = time.time()
 
     # --- 主循环 ---
-    while True:
-        try:
-            encoded_frame = socket.recv()
-            np_arr = np.frombuffer(encoded_frame, np.uint8)
-            bgr_frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-            if bgr_frame is not None:
-                # 为了防止队列无限增长，可以检查队列大小
-                if frame_queue.qsize() < 50:  # 队列里最多只缓存10帧
-                    frame_queue.put(bgr_frame)
+    try:
+        while True:
+            try:
+                if mailbox is None:
+                    # raw 帧直接引用 ZMQ 消息内存, 不需要解码; jpeg 帧在这里解码
+                    bgr_frame, header = recvFrame(socket)
                 else:
-                    # 如果队列满了，可以打印一个警告，或者 просто忽略这一帧
-                    # print("[Worker Process] Queue is full, dropping frame.")
-                    pass
-
-        except zmq.ZMQError as e:
-            # 当上下文终止时，recv 会抛出异常，这是正常的退出方式
-            if e.errno == zmq.ETERM:
-                print("[Worker Process] Context terminated, exiting loop.")
+                    if time.time() - last_feedback >= FEEDBACK_INTERVAL:
+                        last_feedback = time.time()
+                        link = mailbox.stats(reset=True)
+                        # 丢帧率: 链路上丢掉的帧和收到后来不及显示被覆盖的帧, 占生产者发出帧数的比例
+                        sent = link["received"] + link["lost"]
+                        drop_rate = (link["superseded"] + link["lost"]) / sent if sent else 0.0
+                        sendFeedback(feedback, link["avgAgeMs"], drop_rate, link["received"])
+                        if time.time() - last_report >= STATS_INTERVAL:
+                            last_report = time.time()
+                            print(f"[Worker Process] Link stats: {link}")
+                    # 最多等 5 ms; UI 还没取走上一帧时只接收不解码, 新到的帧覆盖旧帧
+                    if not mailbox.poll(5) or not ring.readerReady():
+                        continue
+                    bgr_frame, header = mailbox.take()
+
+                if bgr_frame is not None:
+                    # 写入环形缓冲区的下一个槽位; UI 读得慢时旧帧直接被覆盖, 不会无限堆积
+                    ring.write(bgr_frame, header["frame_id"], header["timestamp"])
+
+            except zmq.ZMQError as e:
+                # 当上下文终止时，recv 会抛出异常，这是正常的退出方式
+                if e.errno == zmq.ETERM:
+                    print("[Worker Process] Context terminated, exiting loop.")
+                    break
+                else:
+                    raise  # 重新抛出其他 ZMQ 异常
+            except Exception as e:
+                print(f"[Worker Process] Error: {e}")
                 break
-            else:
-                raise  # 重新抛出其他 ZMQ 异常
-        except Exception as e:
-            print(f"[Worker Process] Error: {e}")
-            break
-
-    print("[Worker Process] Stopping.")
-    socket.close()
-    context.term()
+    finally:
+        print("[Worker Process] Stopping.")
+        ring.close()
+        if mailbox is not None:
+            feedback.close()
+        socket.close()
+        context.term()
 
 
 if __name__ == "__main__":
     print("[Main Process] Starting...")
 
-    # 1. 创建一个跨进程共享的队列
-    frame_queue = Queue(maxsize=10)
+    # 1. 共享内存环形缓冲区的名字, 由工作进程创建
+    ring_name = f"fire_frames_{os.getpid()}"
 
-    # 2. 创建一个子进程，让它运行 worker_loop 函数，并把队列传给它
+    # 2. 创建一个子进程，让它运行 worker_loop 函数，并把缓冲区名字传给它
     #    target 是要运行的函数
     #    args 是一个元组，包含要传递给 target 函数的参数
-    worker_process = Process(target=worker_loop, args=(frame_queue,))
+    worker_process = Process(target=worker_loop, args=(ring_name,))
     worker_process.daemon = True  # 设置为守护进程，这样主进程退出时它会自动结束
     worker_process.start()  # 启动子进程
 
     print("[Main Process] Worker process started. Waiting for frames...")
 
-    # 3. 主进程现在可以自由地从队列中读取数据并显示
-    while True:
-        try:
-            # 从队列中获取图像，如果队列为空，会阻塞等待
-            # 设置一个超时，防止永久阻塞
-            frame = frame_queue.get(timeout=1)
-
+    # 3. 主进程现在可以自由地从共享内存中读取最新帧并显示
+    reader = None
+    while worker_process.is_alive():
+        if reader is None:
+            try:
+                reader = FrameRingReader(ring_name)
+            except FileNotFoundError:
+                # 工作进程还没有创建缓冲区
+                time.sleep(0.1)
+                continue
+
+        frame, info = reader.latest()
+        if frame is not None:
             cv2.imshow("Worker Frame", frame)
+            if not reader.verify(info):
+                print(f"[Main Process] Frame overwritten while reading: {reader.stats()}")
 
-            # 按 'q' 键退出循环
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                print("[Main Process] 'q' pressed, shutting down.")
-                break
-
-        except Exception as e:
-            # 如果队列在超时时间内一直是空的，会抛出 Empty 异常
-            # 我们可以利用这个机会检查子进程是否还在运行
-            if not worker_process.is_alive():
-                print("[Main Process] Worker process has died. Exiting.")
-                break
-            # 如果不是因为空队列，可以打印 "waiting..."
-            # print("[Main Process] Waiting for frame...")
+        # 按 'q' 键退出循环
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            print("[Main Process] 'q' pressed, shutting down.")
+            break
+    else:
+        print("[Main Process] Worker process has died. Exiting.")
 
     # 4. 清理资源
     print("[Main Process] Cleaning up...")
+    if reader is not None:
+        reader.close()
     if worker_process.is_alive():
-        worker_process.terminate()  # 强制终止子进程
+        worker_process.terminate()  # 子进程收到 SIGTERM 后删除共享内存并退出
+        worker_process.join()
     cv2.destroyAllWindows()
     print("[Main Process] Done.")
@@ -22,7 +22,7 @@ try:
         raise FileNotFoundError(f"无法读取图片，请检查路径: {IMAGE_PATH}")
 
     # 将图像编码为 JPEG 格式。
-    # worker_process.py 使用 cv2.imdecode，所以我们必须发送编码后的数据。
+    # 不带帧头的单段消息被 frame_transport.recvFrame 当作 JPEG 解码。
     # 95 是 JPEG 的质量参数 (0-100)
     is_success, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])
     if not is_success:
@@ -0,0 +1,322 @@
+# benchmark.py
+# 离板性能基准: 用 Mock 推理后端驱动 rknnPoolExecutor + func.myFunc,
+# 在 x86 / CI 上测量线程池吞吐和后处理耗时。--min_fps 可用于 CI 回归门禁。
+import argparse
+import functools
+import gc
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from rknnpool import rknnPoolExecutor, rknnPipelineExecutor, DROP_OLDEST
+from scene_gate import SceneGate, GatedPool
+from capture_thread import CaptureThread
+from frame_transport import FrameSender, ParallelFrameSender, JPEG
+from rknn_backend import MockBackend, yolov8MockOutputs, quantizeAffine
+from func import myFunc, PIPELINE_STAGES, decode_dense, decode_sparse, decode_quantized
+from func import IMG_SIZE, INPUT_ARENA, letterbox, letterbox_rgb_into
+
+parser = argparse.ArgumentParser(description="Off-board benchmark for the YOLO pipeline.")
+parser.add_argument("--frames", type=int, default=300, help="Frames to push through the pool")
+parser.add_argument("--tpes", type=int, default=3, help="Number of pool threads / contexts")
+parser.add_argument("--latency", type=float, default=0.03, help="Mock inference latency (s)")
+parser.add_argument("--width", type=int, default=1920)
+parser.add_argument("--height", type=int, default=1080)
+parser.add_argument("--pipeline", action="store_true", help="Benchmark rknnPipelineExecutor")
+parser.add_argument(
+    "--process_stages", type=str, default="", help="Pipeline stages to run in worker processes"
+)
+parser.add_argument(
+    "--encode_workers", type=int, default=2, help="Threads for the parallel JPEG encode benchmark"
+)
+parser.add_argument("--warmup_runs", type=int, default=1, help="Warm-up runs per context")
+parser.add_argument("--min_fps", type=float, default=0.0, help="Exit with 1 if pool FPS is lower")
+args = parser.parse_args()
+
+
+def synthetic_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+
+
+def alloc_profile(fn, *a, repeats=200):
+    # 每次调用的耗时、临时内存峰值 (tracemalloc) 和期间触发的 0 代 GC 次数
+    fn(*a)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(*a)
+    elapsed = (time.perf_counter() - start) / repeats
+    collections = gc.get_stats()[0]["collections"]
+    tracemalloc.start()
+    peak = 0
+    for _ in range(repeats):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(*a)
+        peak += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return elapsed, peak / repeats, gc.get_stats()[0]["collections"] - collections
+
+
+def print_alloc(name, profile):
+    elapsed, peak, collections = profile
+    print(f"  {name:8s}: {elapsed * 1000:6.2f} ms, peak {peak / 1024:8.1f} KiB/frame, gen0 GC {collections}")
+
+
+def bench_preprocess(frame):
+    # 原有的 cvtColor + letterbox + expand_dims 与写入复用缓冲区的 letterbox_rgb_into 对比
+    def copying(img):
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img, _, _ = letterbox(img, (IMG_SIZE, IMG_SIZE))
+        return np.expand_dims(img, 0)
+
+    def arena(img):
+        buf, _, _ = letterbox_rgb_into(img, (IMG_SIZE, IMG_SIZE))
+        INPUT_ARENA.release(buf)
+
+    print_alloc("copying", alloc_profile(copying, frame))
+    print_alloc("arena", alloc_profile(arena, frame))
+
+
+def bench_postprocess(frame, repeats=50):
+    # 零延迟后端: 只统计 myFunc 中预处理 + 后处理 + 绘制的 CPU 耗时
+    backend = MockBackend(preset="yolov8")
+    backend.load(None)
+    myFunc(backend, frame.copy())
+    start = time.perf_counter()
+    for _ in range(repeats):
+        myFunc(backend, frame.copy())
+    return (time.perf_counter() - start) / repeats
+
+
+def time_call(fn, *a, repeats=20):
+    fn(*a)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn(*a)
+    return (time.perf_counter() - start) / repeats, result
+
+
+def bench_decode():
+    # 空画面 / 稀疏 / 密集三种情况下, 全量解码与稀疏解码的耗时和结果一致性
+    for name, hits in (("empty", 0), ("sparse", 4), ("dense", 2000)):
+        outputs = yolov8MockOutputs(np.random.default_rng(1), hits=hits)
+        t_dense, dense = time_call(decode_dense, outputs)
+        t_sparse, sparse = time_call(decode_sparse, outputs)
+        same = (
+            np.array_equal(dense[1], sparse[1])
+            and np.array_equal(dense[2], sparse[2])
+            and np.allclose(dense[0], sparse[0], atol=1e-3)
+        )
+        print(
+            f"  decode {name:6s} ({len(dense[0]):4d} boxes): dense {t_dense * 1000:7.2f} ms, "
+            f"sparse {t_sparse * 1000:7.2f} ms, x{t_dense / max(t_sparse, 1e-9):.0f}, "
+            f"identical={same}"
+        )
+        if not same:
+            print("FAIL: sparse decode differs from dense decode")
+            exit(1)
+
+        # int8 输出: 与 float 路径处理反量化后的同一组输出比较
+        quantized = [quantizeAffine(out) for out in outputs]
+        q_outputs = [q for q, _ in quantized]
+        q_params = [params for _, params in quantized]
+        dequant = [(q.astype(np.float32) - zp) * scale for q, (zp, scale) in quantized]
+        ref = decode_sparse(dequant)
+        t_quant, quant = time_call(decode_quantized, q_outputs, q_params)
+        same = (
+            np.array_equal(ref[1], quant[1])
+            and np.allclose(ref[2], quant[2])
+            and np.allclose(ref[0], quant[0], atol=1e-3)
+        )
+        print(f"  decode {name:6s} int8 ({len(quant[0]):4d} boxes): {t_quant * 1000:7.2f} ms, match={same}")
+        if not same:
+            print("FAIL: quantized decode differs from float decode")
+            exit(1)
+
+
+class _NullSocket():
+    # 只计时编码, 不经过 ZMQ
+    def send_multipart(self, parts, flags=0, copy=True, track=False):
+        pass
+
+
+def bench_encode(frame, repeats=60):
+    # 主循环中串行编码 vs 编码阶段 (ParallelFrameSender) 的输出帧率
+    results = {}
+    for workers in (0, args.encode_workers):
+        sender = FrameSender(_NullSocket(), JPEG, 95)
+        if workers:
+            sender = ParallelFrameSender(sender, workers)
+        start = time.perf_counter()
+        for i in range(repeats):
+            sender.send(frame, i)
+        sender.close()
+        results[workers] = repeats / (time.perf_counter() - start)
+    return results
+
+
+def check_gate_drops(frames=150, scene=2):
+    # 场景门控 + 会丢帧的池 (1 个实例, maxInflight=2, drop_oldest, 取结果的节奏不规则):
+    # 输出必须按帧顺序, 复用帧只能用到它之前最近一次输出的推理结果。帧号写在左上角像素里
+    def index(img):
+        return int(img[0, 0, 0]) | int(img[0, 0, 1]) << 8
+
+    def infer(rknn_lite, job):
+        img, seq, timestamp = job
+        time.sleep(0.002 * (seq % 3 + 1))
+        return "infer", index(img)
+
+    pool = GatedPool(
+        rknnPoolExecutor(
+            rknnModel="mock", TPEs=1, func=infer, maxInflight=2, dropPolicy=DROP_OLDEST,
+            backend=functools.partial(MockBackend, preset="yolov8"), withMeta=True,
+        ),
+        SceneGate(),
+        lambda img, last: ("reuse", index(img), last[1]),
+    )
+    base = synthetic_frame()[:180, :320]
+    outputs = []
+    for i in range(frames):
+        img = np.roll(base, 40 * (i // scene), axis=1)
+        img[0, 0, :2] = (i & 0xFF, i >> 8)
+        pool.put(img)
+        for _ in range((0, 2, 1, 0, 1)[i % 5]):
+            result, flag = pool.get()
+            if flag:
+                outputs.append(result)
+    while True:
+        result, flag = pool.get()
+        if not flag:
+            break
+        outputs.append(result)
+    stats = pool.stats()
+    pool.release()
+    last = None
+    for prev, out in zip([None] + outputs, outputs):
+        if prev is not None and out[1] <= prev[1]:
+            return False, stats
+        if out[0] == "infer":
+            last = out[1]
+        elif out[2] != last:
+            return False, stats
+    return True, stats
+
+
+class _FrameSource():
+    # 模拟实时相机: read() 立即返回一帧, 由 CaptureThread 按帧率节流
+    def __init__(self, frame, count):
+        self.frame = frame
+        self.left = count
+
+    def read(self):
+        if self.left <= 0:
+            return False, None
+        self.left -= 1
+        return True, self.frame.copy()
+
+
+def bench_admission(frame, frames=120):
+    # 采集线程以 2 倍于推理能力的帧率提交 (与生产者相同的 maxInflight = 2 * TPEs, drop_oldest):
+    # 准入控制必须丢帧, 且从采集到取出结果的延迟保持有界
+    pool = rknnPoolExecutor(
+        rknnModel="mock",
+        TPEs=args.tpes,
+        func=lambda rknn_lite, job: (rknn_lite.inference([job[0]]), job[2])[1],
+        maxInflight=args.tpes * 2,
+        dropPolicy=DROP_OLDEST,
+        backend=functools.partial(MockBackend, preset="yolov8", latency=args.latency),
+        withMeta=True,
+    )
+    source = _FrameSource(frame[:64, :64], frames)
+    capture = CaptureThread(source, pool, 2 * args.tpes / args.latency).start()
+    latencies = []
+    while True:
+        timestamp, flag = capture.get()
+        if not flag:
+            break
+        latencies.append(time.time() - timestamp)
+    stats = pool.stats()
+    pool.release()
+    return stats["dropped"], len(latencies), max(latencies)
+
+
+def bench_pool(frame):
+    backend = functools.partial(MockBackend, preset="yolov8", latency=args.latency)
+    if args.pipeline:
+        pool = rknnPipelineExecutor(
+            rknnModel="mock",
+            TPEs=args.tpes,
+            stages=PIPELINE_STAGES,
+            backend=backend,
+            processStages=[st for st in args.process_stages.split(",") if st],
+            warmupFrame=frame,
+            warmupRuns=args.warmup_runs,
+            withMeta=True,
+        )
+    else:
+        pool = rknnPoolExecutor(
+            rknnModel="mock",
+            TPEs=args.tpes,
+            func=myFunc,
+            backend=backend,
+            warmupFrame=frame,
+            warmupRuns=args.warmup_runs,
+        )
+    for _ in range(args.tpes + 1):
+        pool.put(frame.copy())
+    start = time.perf_counter()
+    for _ in range(args.frames):
+        pool.put(frame.copy())
+        pool.get()
+    elapsed = time.perf_counter() - start
+    while pool.get()[1]:
+        pass
+    stats = pool.stats()
+    pool.release()
+    return args.frames / elapsed, stats
+
+
+frame = synthetic_frame()
+print("Preprocess allocation:")
+bench_preprocess(frame)
+print("Postprocess decode:")
+bench_decode()
+cpu_ms = bench_postprocess(frame) * 1000
+print(f"myFunc CPU time per frame:\t{cpu_ms:.2f} ms")
+encode_fps = bench_encode(frame)
+print(
+    f"JPEG encode:\t\t\t{encode_fps[0]:.1f} FPS inline, "
+    f"{encode_fps[args.encode_workers]:.1f} FPS with {args.encode_workers} encode threads"
+)
+ok, gate_stats = check_gate_drops()
+print(
+    f"Scene gate with drop_oldest:\t{gate_stats['gate']['skipped']} reused, "
+    f"{gate_stats['dropped']} dropped, {gate_stats['gate']['poolSkipped']} skipped"
+)
+if not ok:
+    print("FAIL: GatedPool emits frames out of order or reuses a later result")
+    exit(1)
+dropped, admitted, max_latency = bench_admission(frame)
+# 在途帧最多 2 * TPEs, 即最多排队两轮推理, 加上正在进行的一轮
+latency_bound = 3 * args.latency * 1.5
+print(
+    f"Admission (capture at 2x capacity):\t{dropped} dropped, {admitted} processed, "
+    f"max latency {max_latency * 1000:.0f} ms (bound {latency_bound * 1000:.0f} ms)"
+)
+if not dropped or max_latency > latency_bound:
+    print("FAIL: admission control does not bound latency when capture outruns inference")
+    exit(1)
+fps, stats = bench_pool(frame)
+print(f"Pool startup:\t\t\t{stats['startup']['total'] * 1000:.1f} ms (parallel load + warm-up)")
+print(f"Pool throughput:\t\t{fps:.2f} FPS (TPEs={args.tpes}, latency={args.latency}s)")
+for u in stats["utilization"]:
+    print(f"  context {u['index']} core{u['core']}: {u['tasks']} tasks, busy {u['busy']:.0%}")
+for st in stats.get("stages", []):
+    print(f"  stage {st['name']}: occupancy {st['occupancy']:.0%}, avg {st['avgMs']:.1f} ms")
+
+if fps < args.min_fps:
+    print(f"FAIL: {fps:.2f} FPS < --min_fps {args.min_fps}")
+    exit(1)
@@ -0,0 +1,82 @@
+# capture_thread.py
+# 采集线程: 在独立线程中按采集速率读取视频源并提交给处理池, 主线程只负责取结果。
+# 原来的主循环每读一帧就阻塞在 pool.get() 上, 采集速度被推理拖慢, 积压发生在摄像头驱动的缓冲区里,
+# 处理池的准入控制 (maxInflight / dropPolicy) 永远不会触发。采集独立出来之后, 推理跟不上时
+# 新帧在 pool.put() 中按 dropPolicy 丢弃或阻塞, 在途帧数和延迟才真正有上限。
+import threading
+import time
+
+
+class CaptureThread():
+    """
+    后台线程循环 cap.read(), 用 pool.put(frame, 采集时间) 提交; 主线程用 get() 取结果。
+    pool 的 put / get 会在两个线程中并发调用 (rknnPoolExecutor / rknnPipelineExecutor / GatedPool 均支持)。
+    fps: 读取视频文件时按该帧率节流, 模拟实时相机 (文件读取不受帧率限制, 不节流时几乎所有帧都会被丢弃);
+         None 或 0 表示不节流 (实时相机, 或者用 block 策略逐帧处理文件)。
+    """
+
+    def __init__(self, cap, pool, fps=None):
+        self.cap = cap
+        self.pool = pool
+        self.fps = fps
+        self.captured = 0
+        self.rejected = 0  # pool.put() 返回 False (被准入控制丢弃) 的帧
+        self.stopping = threading.Event()
+        self.finished = threading.Event()
+        self.wake = threading.Event()  # 每提交一帧置位, get() 在处理池暂时为空时等待它
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        interval = 1.0 / self.fps if self.fps else 0.0
+        nextTime = time.perf_counter()
+        try:
+            while not self.stopping.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                self.captured += 1
+                # cap.read() 每次都返回新分配的帧, 直接把所有权交给处理池
+                if not self.pool.put(frame, time.time()):
+                    self.rejected += 1
+                self.wake.set()
+                if interval:
+                    nextTime += interval
+                    delay = nextTime - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        # 读取本身已经落后, 不追帧
+                        nextTime = time.perf_counter()
+        finally:
+            self.finished.set()
+            self.wake.set()
+
+    def get(self):
+        """
+        取下一个结果, 返回值同 pool.get(); 处理池暂时为空时等待采集线程提交新帧,
+        视频源读完 (或已 stop) 且所有结果都已取出后返回 (None, False)。
+        """
+        while True:
+            self.wake.clear()
+            # 先读 finished 再取结果: 此时仍取不到说明所有已提交的帧都处理完了
+            finished = self.finished.is_set()
+            result, flag = self.pool.get()
+            if flag or finished:
+                return result, flag
+            self.wake.wait(0.1)
+
+    def stop(self, timeout=None):
+        """停止读取并等待采集线程退出 (释放 cap 和处理池之前调用)。"""
+        self.stopping.set()
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            "captured": self.captured,
+            "rejected": self.rejected,
+            "finished": self.finished.is_set(),
+        }
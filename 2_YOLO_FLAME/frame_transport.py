@@ -0,0 +1,363 @@
+# frame_transport.py
+# 生产者 -> 消费者的帧传输格式: 每帧一条两段的 ZMQ multipart 消息 [帧头, 数据]。
+# 帧头是定长的二进制结构 (编码方式 / dtype / 形状 / 帧号 / 时间戳), 数据段为:
+#   "raw":  帧的原始像素, 发送时不拷贝 (copy=False), 接收端用 np.frombuffer 直接引用消息内存, 无编解码;
+#   "jpeg": JPEG 码流, 用于带宽受限的远程链路。
+# 本机进程之间用 raw 可以省掉每帧一次 imencode 和一次 imdecode。
+# 只依赖 numpy; cv2 只在 jpeg 模式下才导入, zmq 只在 LatestFrameMailbox 中导入, socket 由调用方创建。
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+RAW = "raw"
+JPEG = "jpeg"
+ENCODINGS = (RAW, JPEG)
+
+# 魔数, 编码方式, 维数, dtype (numpy dtype.str, 如 "|u1"), 形状 (最多 3 维), 帧号, 时间戳
+HEADER = struct.Struct("<2sBB4s3Iqd")
+MAGIC = b"FT"
+# 低延迟模式下 PUB / SUB 两端的高水位 (消息数): 超出后 PUB 直接丢弃新消息, 不在队列里积压
+LATENCY_HWM = 2
+
+
+def jpegEncoder(backend="auto"):
+    """
+    返回 encode(frame, quality) -> JPEG 码流 (buffer) 的函数。
+    backend: "opencv"; "turbojpeg" (PyTurboJPEG, 直接调用 libjpeg-turbo, 比 cv2.imencode 快);
+    "auto" 在装有 PyTurboJPEG 时用 turbojpeg, 否则用 opencv。
+    """
+    if backend in ("auto", "turbojpeg"):
+        try:
+            from turbojpeg import TurboJPEG
+
+            turbo = TurboJPEG()
+            return lambda frame, quality: turbo.encode(frame, quality=quality)
+        except (ImportError, OSError, RuntimeError):
+            # 没有安装 PyTurboJPEG 或找不到 libturbojpeg
+            if backend == "turbojpeg":
+                raise
+    elif backend != "opencv":
+        raise ValueError(f"未知的 JPEG 编码后端: {backend}, 可选: ('auto', 'opencv', 'turbojpeg')")
+    import cv2
+
+    return lambda frame, quality: cv2.imencode(
+        ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality]
+    )[1]
+
+
+def configureLatency(socket, hwm=LATENCY_HWM):
+    """
+    低延迟模式: 限制 socket 的发送 / 接收队列长度, 关闭时不等待未发送的消息。须在 bind / connect 之前调用。
+    ZMQ_CONFLATE 不支持 multipart 消息, 所以接收端用 LatestFrameMailbox 实现"只保留最新一帧"。
+    """
+    import zmq
+
+    socket.setsockopt(zmq.SNDHWM, hwm)
+    socket.setsockopt(zmq.RCVHWM, hwm)
+    socket.setsockopt(zmq.LINGER, 0)
+
+
+def packHeader(encoding, dtype, shape, frameId=-1, timestamp=0.0):
+    ndim = len(shape)
+    shape = tuple(shape) + (0,) * (3 - ndim)
+    return HEADER.pack(
+        MAGIC, ENCODINGS.index(encoding), ndim, np.dtype(dtype).str.encode(), *shape,
+        frameId, timestamp,
+    )
+
+
+def unpackHeader(data):
+    """返回 dict(encoding, dtype, shape, frame_id, timestamp); 不是本模块的帧头时抛出 ValueError。"""
+    if len(data) != HEADER.size:
+        raise ValueError(f"帧头长度错误: {len(data)} != {HEADER.size}")
+    magic, encoding, ndim, dtype, h, w, c, frameId, timestamp = HEADER.unpack(data)
+    if magic != MAGIC or encoding >= len(ENCODINGS):
+        raise ValueError("不是 frame_transport 的帧头")
+    return {
+        "encoding": ENCODINGS[encoding],
+        "dtype": np.dtype(dtype.rstrip(b"\0").decode()),
+        "shape": (h, w, c)[:ndim],
+        "frame_id": frameId,
+        "timestamp": timestamp,
+    }
+
+
+class FrameSender():
+    """
+    按 encoding 发送帧。raw 模式零拷贝发送, 在 ZMQ 真正发送完之前帧缓冲区不能被改写,
+    所以对每个 raw 帧跟踪发送状态, 发送完成后才调用 release(frame) 归还 (例如 OUTPUT_ARENA.release);
+    没有 release 时由 ZMQ 持有引用直到发送完成, 调用方不能再修改已发送的帧。
+    jpeg 模式编码后帧立即可以复用, 直接调用 release。
+    quality / scale 可以在运行中修改 (见 rate_control.RateController); scale < 1 时先缩小再发送,
+    帧头中的形状为缩小后的形状。
+    jpegBackend: 见 jpegEncoder。
+    """
+
+    def __init__(self, socket, encoding=RAW, quality=95, release=None, scale=1.0,
+                 jpegBackend="auto"):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"未知的帧编码: {encoding}, 可选: {ENCODINGS}")
+        self.socket = socket
+        self.encoding = encoding
+        self.quality = quality
+        self.release = release
+        self.scale = scale
+        self.encodeJpeg = jpegEncoder(jpegBackend) if encoding == JPEG else None
+        self.pending = deque()  # (MessageTracker, frame), 按发送顺序
+        self.sent = 0
+        self.bytes = 0
+
+    def send(self, frame, frameId=-1, timestamp=0.0, flags=0):
+        self.transmit(self.encode(frame, frameId, timestamp), flags)
+
+    def encode(self, frame, frameId=-1, timestamp=0.0):
+        """
+        缩放 + 编码, 返回 (帧头, 数据, 发送完成后需要归还的帧或 None), 交给 transmit 发送。
+        不访问 socket, 可以在工作线程中并行调用 (见 ParallelFrameSender)。
+        """
+        release = self.release
+        quality, scale = self.quality, self.scale
+        if scale != 1.0:
+            import cv2
+
+            scaled = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            # 缩小后的帧是新数组, 原帧立即归还
+            if release is not None:
+                release(frame)
+            frame, release = scaled, None
+        if self.encoding == JPEG:
+            payload = self.encodeJpeg(frame, quality)
+            header = packHeader(JPEG, frame.dtype, frame.shape, frameId, timestamp)
+            if release is not None:
+                release(frame)
+            return header, payload, None
+        payload = np.ascontiguousarray(frame)
+        header = packHeader(RAW, payload.dtype, payload.shape, frameId, timestamp)
+        return header, payload, frame if release is not None else None
+
+    def transmit(self, message, flags=0):
+        """发送 encode 的结果; 只能在持有 socket 的线程中调用。"""
+        header, payload, tracked = message
+        if self.encoding == JPEG:
+            self.socket.send_multipart([header, payload], flags=flags)
+        else:
+            tracker = self.socket.send_multipart(
+                [header, payload], flags=flags, copy=False, track=tracked is not None
+            )
+            if tracked is not None:
+                self.pending.append((tracker, tracked))
+        self.sent += 1
+        size = payload.nbytes if isinstance(payload, np.ndarray) else len(payload)
+        self.bytes += size + HEADER.size
+        self.reclaim()
+
+    def reclaim(self, wait=False):
+        """归还已发送完成的帧; wait=True 时等待所有在途帧发送完 (退出前调用)。"""
+        while self.pending:
+            tracker, frame = self.pending[0]
+            if not tracker.done:
+                if not wait:
+                    break
+                tracker.wait()
+            self.pending.popleft()
+            self.release(frame)
+
+    def close(self):
+        """等待所有在途帧发送完 (退出前调用)。"""
+        self.reclaim(wait=True)
+
+    def stats(self):
+        return {
+            "encoding": self.encoding,
+            "sent": self.sent,
+            "bytesPerFrame": self.bytes / self.sent if self.sent else 0.0,
+            "pending": len(self.pending),
+        }
+
+
+class ParallelFrameSender():
+    """
+    编码阶段: 包装 FrameSender, 缩放 / JPEG 编码在 workers 个线程中并行执行 (cv2 和 libjpeg-turbo
+    编码时都释放 GIL), 与采集和推理重叠; 发送仍在调用 send 的线程中进行 (ZMQ socket 不是线程安全的),
+    并且严格按提交顺序。每次 send 顺带发出已经编码完成的帧, 在途帧超过 maxPending 时等待最早的一帧。
+    接口与 FrameSender 相同, quality / scale / bytes 直接读写被包装的 FrameSender。
+    """
+
+    def __init__(self, sender, workers=2, maxPending=None):
+        self.sender = sender
+        self.workers = workers
+        self.maxPending = workers * 2 if maxPending is None else maxPending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode")
+        self.queue = deque()  # 按提交顺序排列的编码 Future
+        self.lock = threading.Lock()
+        self.encoded = 0
+        self.encodeTime = 0.0
+        self.startTime = time.time()
+
+    quality = property(lambda self: self.sender.quality,
+                       lambda self, value: setattr(self.sender, "quality", value))
+    scale = property(lambda self: self.sender.scale,
+                     lambda self, value: setattr(self.sender, "scale", value))
+    bytes = property(lambda self: self.sender.bytes)
+    sent = property(lambda self: self.sender.sent)
+
+    def _encode(self, frame, frameId, timestamp):
+        start = time.perf_counter()
+        message = self.sender.encode(frame, frameId, timestamp)
+        with self.lock:
+            self.encoded += 1
+            self.encodeTime += time.perf_counter() - start
+        return message
+
+    def send(self, frame, frameId=-1, timestamp=0.0):
+        """提交一帧编码; 提交后调用方不能再修改 frame。"""
+        self.queue.append(self.executor.submit(self._encode, frame, frameId, timestamp))
+        self.flush()
+
+    def flush(self, wait=False):
+        """按顺序发送已编码完成的帧; wait=True 时发送全部在途帧。"""
+        while self.queue:
+            head = self.queue[0]
+            if not (wait or head.done() or len(self.queue) > self.maxPending):
+                break
+            self.queue.popleft()
+            self.sender.transmit(head.result())
+
+    def reclaim(self, wait=False):
+        if wait:
+            self.flush(wait=True)
+        self.sender.reclaim(wait)
+
+    def close(self):
+        """发送全部在途帧并停止编码线程。"""
+        self.reclaim(wait=True)
+        self.executor.shutdown()
+
+    def stats(self):
+        """
+        在 FrameSender.stats 之外给出编码阶段的统计: encodeFps 为实际编码帧率,
+        encodeMs 为单帧编码耗时, capacityFps 为所有编码线程满负荷时能达到的帧率。
+        """
+        stats = self.sender.stats()
+        with self.lock:
+            stats["encodeFps"] = self.encoded / max(time.time() - self.startTime, 1e-9)
+            stats["encodeMs"] = self.encodeTime / self.encoded * 1000 if self.encoded else 0.0
+        stats["capacityFps"] = self.workers * 1000 / stats["encodeMs"] if stats["encodeMs"] else 0.0
+        stats["queued"] = len(self.queue)
+        return stats
+
+
+def recvFrame(socket, flags=0):
+    """
+    接收一帧, 返回 (帧, 帧头 dict)。raw 帧是直接引用 ZMQ 消息内存的只读数组, 需要修改时先拷贝。
+    兼容旧格式: 只有一段的消息视为不带帧头的 JPEG (例如 zmq_sender.py 发送的图片)。
+    解码失败时帧为 None。
+    """
+    return decodeFrame(socket.recv_multipart(flags=flags, copy=False))
+
+
+def decodeFrame(parts):
+    """把 recv_multipart(copy=False) 收到的消息解析为 (帧, 帧头 dict), 见 recvFrame。"""
+    if len(parts) == 1:
+        header = {"encoding": JPEG, "dtype": np.dtype(np.uint8), "shape": None,
+                  "frame_id": -1, "timestamp": 0.0}
+        payload = parts[0]
+    else:
+        header = unpackHeader(parts[0].bytes)
+        payload = parts[1]
+    if header["encoding"] == RAW:
+        frame = np.frombuffer(payload.buffer, dtype=header["dtype"]).reshape(header["shape"])
+        return frame, header
+    return decodeJpeg(payload.buffer), header
+
+
+def decodeJpeg(buffer):
+    import cv2
+
+    return cv2.imdecode(np.frombuffer(buffer, np.uint8), cv2.IMREAD_COLOR)
+
+
+class LatestFrameMailbox():
+    """
+    只保留最新一帧的接收端: poll 把 socket 中已到达的消息全部取出, 只留最后一条 (不解码),
+    take 时才解码。接收方暂时不需要帧时 (例如 UI 还没取走上一帧) 不调用 take,
+    期间到达的帧互相覆盖, 被覆盖的帧不付出任何解码开销。
+    统计: depth 为每次 poll 取出的消息数 (即 socket 中积压的帧数), age 为帧从发送到被取走的时间,
+    lost 为按帧号间隔推算的、在链路上 (发送端高水位 / 网络) 丢掉的帧数。
+    """
+
+    def __init__(self, socket):
+        import zmq
+
+        self._again = zmq.Again
+        self._noblock = zmq.NOBLOCK
+        self.poller = zmq.Poller()
+        self.poller.register(socket, zmq.POLLIN)
+        self.socket = socket
+        self.pending = None
+        self.received = 0
+        self.taken = 0
+        self.superseded = 0
+        self.lost = 0
+        self.lastFrameId = -1
+        self.sinceTake = 0  # 上次 take 之后收到的消息数
+        self.maxDepth = 0
+        self.ageSum = 0.0
+        self.maxAge = 0.0
+
+    def poll(self, timeout=None):
+        """等待最多 timeout 毫秒, 返回当前是否有待取的帧。"""
+        if self.poller.poll(timeout):
+            depth = 0
+            while True:
+                try:
+                    parts = self.socket.recv_multipart(flags=self._noblock, copy=False)
+                except self._again:
+                    break
+                depth += 1
+                self.sinceTake += 1
+                if self.pending is not None:
+                    self.superseded += 1
+                self.pending = parts
+            self.received += depth
+            self.maxDepth = max(self.maxDepth, depth)
+        return self.pending is not None
+
+    def take(self):
+        """解码并返回最新一帧 (帧, 帧头 dict), 没有待取的帧时返回 (None, None)。"""
+        if self.pending is None:
+            return None, None
+        frame, header = decodeFrame(self.pending)
+        self.pending = None
+        self.taken += 1
+        frameId = header["frame_id"]
+        if frameId > self.lastFrameId >= 0:
+            # 帧号间隔中, 收到后被覆盖的帧之外的部分是在链路上丢掉的帧
+            self.lost += max(frameId - self.lastFrameId - self.sinceTake, 0)
+        self.lastFrameId = frameId
+        self.sinceTake = 0
+        if header["timestamp"] > 0:
+            age = time.time() - header["timestamp"]
+            self.ageSum += age
+            self.maxAge = max(self.maxAge, age)
+        return frame, header
+
+    def stats(self, reset=False):
+        """reset=True 时返回后清零所有计数, 得到按周期 (例如每秒) 的统计。"""
+        stats = {
+            "received": self.received,
+            "taken": self.taken,
+            "superseded": self.superseded,
+            "lost": self.lost,
+            "maxDepth": self.maxDepth,
+            "avgAgeMs": self.ageSum / self.taken * 1000 if self.taken else 0.0,
+            "maxAgeMs": self.maxAge * 1000,
+        }
+        if reset:
+            self.received = self.taken = self.superseded = self.lost = self.maxDepth = 0
+            self.ageSum = self.maxAge = 0.0
+        return stats
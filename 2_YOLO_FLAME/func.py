@@ -2,7 +2,19 @@
 import cv2
 import numpy as np
 
+from input_arena import InputArena
+
 OBJ_THRESH, NMS_THRESH, IMG_SIZE = 0.25, 0.45, 640
+# NMS 前按分数保留的最大候选框数, 以及每帧最多输出的检测框数
+MAX_NMS_CANDIDATES, MAX_DETECTIONS = 1024, 300
+# 候选框不超过该数量时一次性算出 IoU 矩阵, 否则逐个保留框计算一行 IoU
+IOU_MATRIX_MAX = 256
+# True: 先按类别分数过滤再对候选格子做 DFL 解码; False: 原始的全量解码
+SPARSE_DECODE = True
+# True: 后端支持时直接取 int8 输出, 在量化域做阈值过滤, 只反量化通过的格子
+QUANTIZED_OUTPUTS = True
+# 模型输入缓冲区: stage_preprocess 写入, stage_infer 推理结束后归还
+INPUT_ARENA = InputArena()
 
 CLASSES = ("fire", "bicycle", "car", "motorbike ", "aeroplane ", "bus ", "train", "truck ", "boat", "traffic light",
            "fire hydrant", "stop sign ", "parking meter", "bench", "bird", "cat", "dog ", "horse ", "sheep", "cow", "elephant",
@@ -63,6 +75,48 @@ def nms_boxes(boxes, scores):
     keep = np.array(keep)
     return keep
 
+def nms_boxes_batched(boxes, scores, classes):
+    """Suppress non-maximal boxes of all classes in one pass.
+    # Returns
+        keep: ndarray, index of effective boxes, sorted by score.
+    """
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = scores.argsort()[::-1][:MAX_NMS_CANDIDATES]
+    b = boxes[order]
+    # 类别偏移: 把不同类别的框平移到互不重叠的区域, 一次 NMS 等价于逐类 NMS
+    span = b.max() - b.min() + 1
+    b = b + (classes[order] * span)[:, None]
+    x1, y1, x2, y2 = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    n = len(order)
+
+    def iou(i, j):
+        # 与 nms_boxes 相同的重叠计算 (含 0.00001 的修正项)
+        w1 = np.maximum(0.0, np.minimum(x2[i], x2[j]) - np.maximum(x1[i], x1[j]) + 0.00001)
+        h1 = np.maximum(0.0, np.minimum(y2[i], y2[j]) - np.maximum(y1[i], y1[j]) + 0.00001)
+        inter = w1 * h1
+        return inter / (areas[i] + areas[j] - inter)
+
+    suppress = None
+    if n <= IOU_MATRIX_MAX:
+        idx = np.arange(n)
+        suppress = iou(idx[:, None], idx[None, :]) > NMS_THRESH
+
+    keep = []
+    removed = np.zeros(n, dtype=bool)
+    for i in range(n):
+        if removed[i]:
+            continue
+        keep.append(i)
+        if len(keep) >= MAX_DETECTIONS:
+            break
+        if suppress is not None:
+            removed |= suppress[i]
+        else:
+            removed[i + 1:] |= iou(i, slice(i + 1, None)) > NMS_THRESH
+    return order[np.array(keep, dtype=np.int64)]
+
 # def dfl(position):
 #     # Distribution Focal Loss (DFL)
 #     import torch
@@ -105,22 +159,43 @@ def dfl(position):
     return y
     
 
+# (IMG_SIZE, grid_h, grid_w) -> (anchor, stride), 在第一次见到该输出形状时建立
+_anchor_cache = {}
+
+
+def anchor_table(grid_h, grid_w):
+    """
+    返回缓存的 (anchor, stride):
+    anchor 为 (1, 2, grid_h, grid_w) 的格子中心坐标 (col + 0.5, row + 0.5),
+    stride 为 (1, 2, 1, 1) 的步长。按形状缓存, 切换到 320 / 1280 模型无需改动。
+    """
+    key = (IMG_SIZE, grid_h, grid_w)
+    table = _anchor_cache.get(key)
+    if table is None:
+        col, row = np.meshgrid(np.arange(0, grid_w), np.arange(0, grid_h))
+        col = col.reshape(1, 1, grid_h, grid_w)
+        row = row.reshape(1, 1, grid_h, grid_w)
+        anchor = np.concatenate((col, row), axis=1) + 0.5
+        stride = np.array([IMG_SIZE//grid_h, IMG_SIZE//grid_w]).reshape(1,2,1,1)
+        anchor.flags.writeable = False
+        stride.flags.writeable = False
+        table = _anchor_cache[key] = (anchor, stride)
+    return table
+
+
 def box_process(position):
     grid_h, grid_w = position.shape[2:4]
-    col, row = np.meshgrid(np.arange(0, grid_w), np.arange(0, grid_h))
-    col = col.reshape(1, 1, grid_h, grid_w)
-    row = row.reshape(1, 1, grid_h, grid_w)
-    grid = np.concatenate((col, row), axis=1)
-    stride = np.array([IMG_SIZE//grid_h, IMG_SIZE//grid_w]).reshape(1,2,1,1)
+    anchor, stride = anchor_table(grid_h, grid_w)
 
     position = dfl(position)
-    box_xy  = grid +0.5 -position[:,0:2,:,:]
-    box_xy2 = grid +0.5 +position[:,2:4,:,:]
+    box_xy  = anchor -position[:,0:2,:,:]
+    box_xy2 = anchor +position[:,2:4,:,:]
     xyxy = np.concatenate((box_xy*stride, box_xy2*stride), axis=1)
 
     return xyxy
 
-def yolov8_post_process(input_data):
+def decode_dense(input_data):
+    """原始解码路径: 对所有格子做 DFL 后再按阈值过滤, 保留用于对比和基准测试。"""
     boxes, scores, classes_conf = [], [], []
     defualt_branch=3
     pair_per_branch = len(input_data)//defualt_branch
@@ -144,30 +219,144 @@ def yolov8_post_process(input_data):
     scores = np.concatenate(scores)
 
     # filter according to threshold
-    boxes, classes, scores = filter_boxes(boxes, scores, classes_conf)
-
-    # nms
-    nboxes, nclasses, nscores = [], [], []
-    for c in set(classes):
-        inds = np.where(classes == c)
-        b = boxes[inds]
-        c = classes[inds]
-        s = scores[inds]
-        keep = nms_boxes(b, s)
-
-        if len(keep) != 0:
-            nboxes.append(b[keep])
-            nclasses.append(c[keep])
-            nscores.append(s[keep])
-
-    if not nclasses and not nscores:
-        return None, None, None
+    return filter_boxes(boxes, scores, classes_conf)
 
-    boxes = np.concatenate(nboxes)
-    classes = np.concatenate(nclasses)
-    scores = np.concatenate(nscores)
 
-    return boxes, classes, scores
+def decode_cells(position, cells, grid_h, grid_w, quant=None):
+    """
+    只对 cells (按行展开的格子下标) 做 DFL 并解码为 xyxy, 结果与 box_process 对应行一致。
+    quant: position 为 int8 时的 (zero_point, scale), 只反量化取出的 cells。
+    """
+    mc = position.shape[1] // 4
+    y = position.reshape(4, mc, -1)[:, :, cells]  # (4, mc, k)
+    if quant is not None:
+        zp, scale = quant
+        y = (y.astype(np.float32) - zp) * np.float32(scale)
+    e_y = np.exp(y - np.max(y, axis=1, keepdims=True))
+    y = e_y / np.sum(e_y, axis=1, keepdims=True)
+    dist = (y * np.arange(mc).reshape(1, mc, 1)).sum(1)  # (4, k)
+
+    anchor, stride = anchor_table(grid_h, grid_w)
+    col, row = anchor.reshape(2, -1)[:, cells]
+    # 与 box_process 一致: x 方向乘 stride[0], y 方向乘 stride[1]
+    stride_x, stride_y = stride.ravel()
+    return np.stack((
+        (col - dist[0]) * stride_x,
+        (row - dist[1]) * stride_y,
+        (col + dist[2]) * stride_x,
+        (row + dist[3]) * stride_y,
+    ), axis=1)
+
+
+def decode_sparse(input_data):
+    """
+    先按类别分数过滤, 只对通过 OBJ_THRESH 的格子做 DFL 解码。
+    输出 (boxes, classes, scores) 与 decode_dense 顺序相同, classes / scores 完全一致,
+    boxes 仅有 1e-4 像素量级的浮点舍入差异 (exp 的向量化实现与数组长度有关)。
+    """
+    boxes, classes, scores = [], [], []
+    defualt_branch=3
+    pair_per_branch = len(input_data)//defualt_branch
+    for i in range(defualt_branch):
+        position = input_data[pair_per_branch*i]
+        class_conf = input_data[pair_per_branch*i+1]
+        ch, grid_h, grid_w = class_conf.shape[1:4]
+        conf = class_conf.reshape(ch, -1)  # (类别数, 格子数)
+
+        class_max_score = np.max(conf, axis=0)
+        cells = np.flatnonzero(class_max_score >= OBJ_THRESH)
+        if cells.size == 0:
+            continue
+        boxes.append(decode_cells(position, cells, grid_h, grid_w))
+        classes.append(np.argmax(conf[:, cells], axis=0))
+        scores.append(class_max_score[cells])
+
+    if not boxes:
+        return np.zeros((0, 4)), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    return np.concatenate(boxes), np.concatenate(classes), np.concatenate(scores)
+
+
+def decode_quantized(input_data, quant):
+    """
+    int8 输出的稀疏解码, quant 为每个输出的 (zero_point, scale)。
+    OBJ_THRESH 换算成 int8 阈值后直接在量化域比较; 量化是单调的,
+    类别 argmax 不受影响, 只有通过阈值的格子才会被反量化。
+    结果与 decode_sparse 处理反量化后的 float 输出一致 (阈值边界上有一个量化步长的误差)。
+    """
+    boxes, classes, scores = [], [], []
+    defualt_branch=3
+    pair_per_branch = len(input_data)//defualt_branch
+    for i in range(defualt_branch):
+        position = input_data[pair_per_branch*i]
+        class_conf = input_data[pair_per_branch*i+1]
+        zp, scale = quant[pair_per_branch*i+1]
+        ch, grid_h, grid_w = class_conf.shape[1:4]
+        conf = class_conf.reshape(ch, -1)  # (类别数, 格子数), int8
+
+        q_thresh = int(np.ceil(zp + OBJ_THRESH / scale))
+        if q_thresh > 127:
+            continue
+        class_max_q = np.max(conf, axis=0)
+        cells = np.flatnonzero(class_max_q >= q_thresh)
+        if cells.size == 0:
+            continue
+        boxes.append(decode_cells(position, cells, grid_h, grid_w, quant[pair_per_branch*i]))
+        classes.append(np.argmax(conf[:, cells], axis=0))
+        scores.append((class_max_q[cells].astype(np.float32) - zp) * np.float32(scale))
+
+    if not boxes:
+        return np.zeros((0, 4)), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    return np.concatenate(boxes), np.concatenate(classes), np.concatenate(scores)
+
+
+def yolov8_post_process(input_data, quant=None):
+    # quant 不为 None 时 input_data 为 int8 输出
+    if quant is not None:
+        boxes, classes, scores = decode_quantized(input_data, quant)
+    # 森林画面大多为空, 稀疏解码只对少量候选格子做 DFL
+    elif SPARSE_DECODE:
+        boxes, classes, scores = decode_sparse(input_data)
+    else:
+        boxes, classes, scores = decode_dense(input_data)
+
+    # nms: 所有类别一次完成
+    keep = nms_boxes_batched(boxes, scores, classes)
+    if len(keep) == 0:
+        return None, None, None
+
+    return boxes[keep], classes[keep], scores[keep]
+
+# 结构化检测结果, 每行一个框; box 为原图坐标系下的 (x1, y1, x2, y2)
+DETECTION_DTYPE = np.dtype([
+    ("box", np.float32, (4,)),
+    ("class", np.int32),
+    ("score", np.float32),
+    ("frame_id", np.int64),
+    ("timestamp", np.float64),
+])
+
+
+def to_detections(boxes, classes, scores, ratio, padding, frame_id=-1, timestamp=0.0):
+    """把 letterbox 坐标系下的检测框映射回原图, 打包成 DETECTION_DTYPE 记录数组 (无检测时长度为 0)。"""
+    dets = np.zeros(0 if boxes is None else len(boxes), dtype=DETECTION_DTYPE)
+    if len(dets):
+        dets["box"][:, 0::2] = (boxes[:, 0::2] - padding[0]) / ratio[0]
+        dets["box"][:, 1::2] = (boxes[:, 1::2] - padding[1]) / ratio[1]
+        dets["class"] = classes
+        dets["score"] = scores
+    dets["frame_id"] = frame_id
+    dets["timestamp"] = timestamp
+    return dets
+
+
+def draw_detections(image, dets):
+    """在原图上绘制 to_detections 的结果, 与 draw 的画法相同。"""
+    for (x1, y1, x2, y2), cl, score in zip(dets["box"], dets["class"], dets["score"]):
+        cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), (255, 0, 0), 2)
+        cv2.putText(image, '{0} {1:.2f}'.format(CLASSES[cl], score),
+                    (int(x1), int(y1) - 6),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.6, (0, 0, 255), 2)
 
 def draw(image, boxes, scores, classes, ratio, padding):
     for box, score, cl in zip(boxes, scores, classes):
@@ -212,21 +401,106 @@ def letterbox(im, new_shape=(640, 640), color=(0, 0, 0)):
     #return im
     return im, ratio, (left, top)
 
-def myFunc(rknn_lite, IMG):
-    IMG2 = cv2.cvtColor(IMG, cv2.COLOR_BGR2RGB)
-    # 等比例缩放
-    IMG2, ratio, padding = letterbox(IMG2)
+def letterbox_rgb_into(im, new_shape=(640, 640), color=(0, 0, 0)):
+    """
+    结果与 cvtColor(BGR2RGB) + letterbox + expand_dims 相同, 但直接写入 INPUT_ARENA 中
+    复用的 (1, h, w, 3) 缓冲区: 先缩放到图像区域, 再原地交换通道, 边框只在分配缓冲区时填充一次。
+    color 为 RGB 顺序。返回 (缓冲区, ratio, padding), 用完后调用 INPUT_ARENA.release 归还。
+    """
+    shape = im.shape[:2]  # current shape [height, width]
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    dw, dh = (new_shape[1] - new_unpad[0]) / 2, (new_shape[0] - new_unpad[1]) / 2
+    top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+
+    buf = INPUT_ARENA.acquire(
+        ("letterbox", shape, new_shape, color), (1, new_shape[0], new_shape[1], 3), color)
+    roi = buf[0, top:top + new_unpad[1], left:left + new_unpad[0]]
+    if shape[::-1] != new_unpad:  # resize
+        cv2.resize(im, new_unpad, dst=roi, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(roi, cv2.COLOR_BGR2RGB, dst=roi)
+    else:
+        cv2.cvtColor(im, cv2.COLOR_BGR2RGB, dst=roi)
+    return buf, (r, r), (left, top)
+
+# 以下阶段函数既被 myFunc / detectFunc 串行调用, 也可以交给 rknnpool.rknnPipelineExecutor
+# 分别用独立的线程运行, 使 NPU 推理与 CPU 前后处理重叠。
+# 第一个阶段的输入为 (IMG, frame_id, timestamp), 即线程池 withMeta=True 时提交的内容
+def stage_preprocess(job):
+    IMG, frame_id, timestamp = job
+    # 等比例缩放 + BGR->RGB, 直接写入复用的 NHWC 输入缓冲区 (缩放到 IMG_SIZE, 与 anchor_table 的缓存键一致)
+    IMG2, ratio, padding = letterbox_rgb_into(IMG, (IMG_SIZE, IMG_SIZE))
     # 强制放缩
     # IMG2 = cv2.resize(IMG, (IMG_SIZE, IMG_SIZE))
-    IMG2 = np.expand_dims(IMG2, 0)
-    
-    outputs = rknn_lite.inference(inputs=[IMG2],data_format=['nhwc'])
+    return IMG, IMG2, ratio, padding, (frame_id, timestamp)
+
+
+def stage_infer(rknn_lite, job):
+    IMG, IMG2, ratio, padding, meta = job
+    quant = None
+    if QUANTIZED_OUTPUTS and rknn_lite.quantized_outputs:
+        outputs, quant = rknn_lite.inference_quantized(inputs=[IMG2],data_format=['nhwc'])
+    else:
+        outputs = rknn_lite.inference(inputs=[IMG2],data_format=['nhwc'])
+    # 推理已完成, 输入缓冲区可以给下一帧使用
+    INPUT_ARENA.release(IMG2)
+    return IMG, outputs, quant, ratio, padding, meta
+
+
+def stage_postprocess(job):
+    IMG, outputs, quant, ratio, padding, meta = job
+    boxes, classes, scores = yolov8_post_process(outputs, quant)
+    return IMG, to_detections(boxes, classes, scores, ratio, padding, *meta)
+
+
+def stage_render(job):
+    IMG, dets = job
+    draw_detections(IMG, dets)
+    return IMG, dets
+
+
+# (阶段名, 阶段函数, 是否需要 RKNNLite 实例)
+DETECT_STAGES = (
+    ("preprocess", stage_preprocess, False),
+    ("infer", stage_infer, True),
+    ("postprocess", stage_postprocess, False),
+)
+# 绘制是可选的最后一个阶段, 只需要检测结果的消费者使用 DETECT_STAGES
+PIPELINE_STAGES = DETECT_STAGES + (
+    ("render", stage_render, False),
+)
+
+
+def detectFunc(rknn_lite, job):
+    """job 为 (IMG, frame_id, timestamp), 返回 (IMG, 检测结果记录数组), 不修改 IMG。"""
+    job = stage_preprocess(job)
+    job = stage_infer(rknn_lite, job)
 
     #print("oups1",len(outputs))
     #print("oups2",outputs[0].shape)
 
-    boxes, classes, scores = yolov8_post_process(outputs)
+    return stage_postprocess(job)
 
-    if boxes is not None:
-        draw(IMG, boxes, scores, classes, ratio, padding)
-    return IMG
+
+def renderFunc(rknn_lite, job):
+    """detectFunc 之后把检测框画到 IMG 上, 返回 (IMG, 检测结果记录数组)。"""
+    return stage_render(detectFunc(rknn_lite, job))
+
+
+def reuse_detections(IMG, result, render=True):
+    """
+    场景门控跳过推理时沿用上一帧的检测结果, 返回值格式与 detectFunc / renderFunc 相同。
+    frame_id / timestamp 仍是实际推理的那一帧, 消费者可据此判断结果的新旧。
+    """
+    dets = result[1]
+    if render:
+        draw_detections(IMG, dets)
+    return IMG, dets
+
+
+def myFunc(rknn_lite, IMG):
+    # 原有接口: 只返回绘制后的图像
+    return renderFunc(rknn_lite, (IMG, -1, 0.0))[0]
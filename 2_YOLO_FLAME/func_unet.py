@@ -2,11 +2,56 @@
 import cv2
 import numpy as np
 
+from input_arena import InputArena
+
 IMG_SIZE = (256, 256)  # UNet模型期望的输入尺寸
+# 模型输入缓冲区: stage_preprocess 写入, stage_infer 推理结束后归还
+INPUT_ARENA = InputArena()
+# 渲染输出缓冲区: stage_render 写入, 消费者编码 / 显示完成后调用 OUTPUT_ARENA.release 归还
+OUTPUT_ARENA = InputArena()
 
 # 可视化方式选择 (通过取消注释选择一种)
 VISUALIZATION_MODE = "OVERLAY"  # 可选: "SIDE_BY_SIDE", "OVERLAY", "MASK_ONLY"
-import numpy as np
+# 需要显示灰度概率图的可视化方式; 其他方式只需要二值掩码, 可以跳过 sigmoid
+PROBABILITY_MODES = ("SIDE_BY_SIDE", "MASK_ONLY")
+# 0-255 概率图中大于该值的像素视为火焰区域
+MASK_THRESH = 128
+# 等价的 logit 阈值: uint8(sigmoid(x) * 255) > MASK_THRESH  <=>  x >= ln((T + 1) / (254 - T)), 约为 0
+LOGIT_THRESH = np.log((MASK_THRESH + 1) / (254 - MASK_THRESH))
+# True: 后端支持时直接取 int8 输出, 用 256 项查找表得到掩码
+QUANTIZED_OUTPUTS = True
+# OVERLAY 的叠加颜色 (BGR) 和透明度; 连通域超过 MAX_OVERLAY_ROIS 个时合并为一个外接矩形
+OVERLAY_COLOR = (0, 255, 0)
+OVERLAY_ALPHA = 0.4
+MAX_OVERLAY_ROIS = 32
+
+# 分块模式: 把高分辨率帧切成相互重叠的 TILE_SIZE 方块分别推理, 再按重叠区域加权拼回原分辨率,
+# 避免 4K 航拍画面整体缩到 256x256 后丢失远处的小火线。
+# TILE_SIZE 须等于模型输入尺寸; 方块数超过 MAX_TILES 时先把整帧等比例缩小;
+# TILE_BATCH 为模型导出时的 batch 大小, 每次推理送入这么多个方块
+TILED_MODE = False
+TILE_SIZE = 256
+TILE_OVERLAP = 32
+MAX_TILES = 24
+TILE_BATCH = 1
+
+# 火焰区域矢量化: 面积小于 MIN_REGION_PIXELS (掩码像素) 的连通域视为噪声丢弃,
+# 最多输出面积最大的 MAX_REGIONS 个区域; 轮廓用 approxPolyDP 简化, 误差 POLYGON_EPSILON 个掩码像素
+MIN_REGION_PIXELS = 4
+MAX_REGIONS = 64
+POLYGON_EPSILON = 1.0
+# 每个火焰区域一条记录, 坐标均为原图像素; area 为原图像素面积 (由掩码像素数按缩放比例换算),
+# 多边形顶点存放在单独的 (N, 2) float32 数组中, 本区域的顶点为 vertices[vertex_start:vertex_start + vertex_count]
+FIRE_REGION_DTYPE = np.dtype([
+    ("bbox", np.float32, (4,)),
+    ("centroid", np.float32, (2,)),
+    ("area", np.float32),
+    ("pixels", np.int32),
+    ("vertex_start", np.int32),
+    ("vertex_count", np.int32),
+    ("frame_id", np.int64),
+    ("timestamp", np.float64),
+])
 
 
 def sigmoid_numpy(x):
@@ -20,29 +65,72 @@ def sigmoid_numpy(x):
 def preprocess_frame_for_unet(frame, target_size):
     """
     为UNet模型预处理视频帧。
-    返回: NHWC格式的图像数据 (通常是uint8或float32，取决于模型)
+    返回: NHWC格式的 uint8 图像数据, 写在 INPUT_ARENA 复用的缓冲区中,
+    推理结束后调用 INPUT_ARENA.release 归还。
     """
-    img_resized = cv2.resize(frame, target_size)  # shape: (height, width, 3)
+    width, height = target_size
+    img_nhwc = INPUT_ARENA.acquire(("unet", target_size), (1, height, width, 3))
+    img_resized = img_nhwc[0]  # shape: (height, width, 3)
+    cv2.resize(frame, target_size, dst=img_resized)
 
     # 颜色通道: 检查您的模型是否期望RGB。OpenCV读取的是BGR。
-    # 如果模型期望RGB:
-    img_resized = cv2.cvtColor(
-        img_resized, cv2.COLOR_BGR2RGB
-    )  # shape: (height, width, 3)
+    # 如果模型期望RGB: (原地转换, 不分配新数组)
+    cv2.cvtColor(img_resized, cv2.COLOR_BGR2RGB, dst=img_resized)
 
     # 数据类型和归一化:
     # RKNN模型通常在转换时配置了均值和标准差，可直接输入uint8。
-    # 假设模型期望 uint8 HWC (BGR 或 RGB 取决于上面)
-    img_processed_hwc = img_resized.astype(np.uint8)  # shape: (height, width, 3)
-
-    # 增加batch维度，变为 NHWC，模型输入为 (1, height, width, 3)
-    img_nhwc = np.expand_dims(img_processed_hwc, axis=0)  # shape: (1, height, width, 3)
+    # 缓冲区本身就是 (1, height, width, 3) 的 uint8, 无需 astype / expand_dims
     # # 确保是NHWC格式
     # img_nchw = img_nhwc.transpose(0, 3, 1, 2) # shape: (1, 3, height, width)
     return img_nhwc
 
 
-def postprocess_unet_output(raw_output_tensor, original_frame_shape):
+# (zero_point, scale, binary) -> 256 项查找表
+_lut_cache = {}
+
+
+def quantized_lut(zp, scale, binary=False):
+    """
+    int8 输出按 uint8 看待时的查找表: 下标 u 对应量化值 int8(u),
+    值为 uint8(sigmoid((q - zp) * scale) * 255); binary 时再按 MASK_THRESH 二值化为 0 / 255。
+    """
+    key = (zp, float(scale), binary)
+    lut = _lut_cache.get(key)
+    if lut is None:
+        q = np.arange(256, dtype=np.uint8).view(np.int8).astype(np.float32)
+        lut = (sigmoid_numpy((q - zp) * np.float32(scale)) * 255).astype(np.uint8)
+        if binary:
+            lut = np.where(lut > MASK_THRESH, np.uint8(255), np.uint8(0))
+        lut = _lut_cache[key] = lut
+    return lut
+
+
+def segmentation_to_mask(segmentation_map, quant=None, binary=False):
+    """把 (H, W) 的 logits (或 int8 量化输出) 转换为 0-255 的 uint8 概率图, binary 时为 0 / 255 掩码。"""
+    if quant is not None:
+        mask = cv2.LUT(
+            np.ascontiguousarray(segmentation_map).view(np.uint8), quantized_lut(*quant, binary)
+        )
+    elif binary:
+        # 直接在 logit 上比较, 不计算 sigmoid
+        mask = np.multiply(
+            segmentation_map >= LOGIT_THRESH, np.uint8(255), dtype=np.uint8
+        )
+    else:
+        # 增加一个sigmoid
+        segmentation_map = sigmoid_numpy(segmentation_map)
+        # 将概率图转换为 0-255 的 uint8 图像
+        mask = (segmentation_map * 255).astype(np.uint8)
+    return mask
+
+
+def postprocess_unet_output(raw_output_tensor, original_frame_shape, quant=None, binary=False,
+                            upscale=True):
+    """
+    quant: raw_output_tensor 为 int8 时的 (zero_point, scale), 用查找表代替 sigmoid。
+    binary: 只需要二值掩码 (0 / 255) 时为 True, float 输出直接在 logit 上阈值化。
+    upscale: False 时返回模型分辨率的掩码, 由调用方只放大需要的区域 (见 blend_mask_rois)。
+    """
 
     # 假设输出是 (1, 1, H, W) (NCHW, 单通道概率图或logits)
     # 或 (1, H, W, 1) (NHWC)
@@ -70,10 +158,11 @@ def postprocess_unet_output(raw_output_tensor, original_frame_shape):
             print(f"Squeeze失败: {e}")
             return None
 
-    # 增加一个sigmoid
-    segmentation_map = sigmoid_numpy(segmentation_map)
-    # 将概率图转换为 0-255 的 uint8 图像
-    output_mask_uint8_model_size = (segmentation_map * 255).astype(np.uint8)
+    # 在模型分辨率上生成 0-255 掩码, 之后只放大一次
+    output_mask_uint8_model_size = segmentation_to_mask(segmentation_map, quant, binary)
+
+    if not upscale:
+        return output_mask_uint8_model_size
 
     # 将清理后的掩码调整回原始视频帧的尺寸
     output_mask_resized = cv2.resize(
@@ -85,46 +174,296 @@ def postprocess_unet_output(raw_output_tensor, original_frame_shape):
     return output_mask_resized
 
 
-# <--- 1. 修改 myFunc 的函数签名，增加 lock 参数
-def myFunc(rknn_lite_instance, original_frame):
+def _tile_starts(length, tile, n):
+    # n 个方块均匀覆盖 [0, length), 首尾方块贴边
+    if n == 1:
+        return [0]
+    return [round(i * (length - tile) / (n - 1)) for i in range(n)]
+
+
+def tile_layout(frame_shape, tile=None, overlap=None, max_tiles=None):
     """
-    在rknnPoolExecutor中运行的回调函数。
-    rknn_lite_instance: 由线程池提供的一个RKNNLite对象。
-    original_frame: 从视频捕获的原始帧。
-    lock: 用于同步推理调用的线程锁。
-    返回: 处理后的帧 (NumPy array) 或 None。
-    Original frame shape: (480, 640, 3)
+    计算分块方案, 返回 (scale, 缩放后尺寸 (h, w), 填充后尺寸 (h, w), 方块左上角列表)。
+    相邻方块至少重叠 overlap 像素; 方块数超过 max_tiles 时逐步缩小整帧直到满足。
+    tile <= 0 或 overlap 不在 [0, tile) 内时抛出 ValueError。
     """
-    if original_frame is None:
-        return None
+    tile = tile or TILE_SIZE
+    overlap = TILE_OVERLAP if overlap is None else overlap
+    max_tiles = max_tiles or MAX_TILES
+    if tile <= 0:
+        raise ValueError(f"方块大小必须 > 0: {tile}")
+    if not 0 <= overlap < tile:
+        raise ValueError(f"方块重叠必须在 [0, {tile}) 内: {overlap}")
+    step = tile - overlap
+    h, w = frame_shape[:2]
+    scale = 1.0
+    while True:
+        sh, sw = max(1, round(h * scale)), max(1, round(w * scale))
+        ph, pw = max(sh, tile), max(sw, tile)
+        ny = -(-(ph - tile) // step) + 1
+        nx = -(-(pw - tile) // step) + 1
+        if ny * nx <= max_tiles:
+            break
+        scale *= min(0.95, (max_tiles / (ny * nx)) ** 0.5)
+    positions = [
+        (y, x)
+        for y in _tile_starts(ph, tile, ny)
+        for x in _tile_starts(pw, tile, nx)
+    ]
+    return scale, (sh, sw), (ph, pw), positions
+
+
+# (tile, overlap) -> 拼接权重, 重叠区内从边缘到内部线性上升
+_window_cache = {}
+
+
+def tile_window(tile, overlap):
+    key = (tile, overlap)
+    window = _window_cache.get(key)
+    if window is None:
+        ramp = np.ones(tile, dtype=np.float32)
+        if overlap > 0:
+            ramp = np.minimum(np.arange(1, tile + 1, dtype=np.float32), overlap) / overlap
+            ramp = np.minimum(ramp, ramp[::-1])
+        window = _window_cache[key] = np.outer(ramp, ramp)
+    return window
+
+
+def preprocess_tiles(frame):
+    """
+    把帧切成 TILE_SIZE 方块, BGR->RGB 后按 TILE_BATCH 个一组写入 INPUT_ARENA 的 NHWC 缓冲区。
+    返回 (layout, batches), layout 见 tile_layout; 最后一组不满时多余的位置内容无意义。
+    """
+    layout = tile_layout(frame.shape)
+    scale, (sh, sw), (ph, pw), positions = layout
+    if scale != 1.0:
+        frame = cv2.resize(frame, (sw, sh), interpolation=cv2.INTER_AREA)
+    if (ph, pw) != (sh, sw):
+        frame = cv2.copyMakeBorder(frame, 0, ph - sh, 0, pw - sw, cv2.BORDER_CONSTANT, value=0)
+    batches = []
+    for start in range(0, len(positions), TILE_BATCH):
+        batch = INPUT_ARENA.acquire(("tiles", TILE_BATCH, TILE_SIZE), (TILE_BATCH, TILE_SIZE, TILE_SIZE, 3))
+        for k, (y, x) in enumerate(positions[start:start + TILE_BATCH]):
+            cv2.cvtColor(frame[y:y + TILE_SIZE, x:x + TILE_SIZE], cv2.COLOR_BGR2RGB, dst=batch[k])
+        batches.append(batch)
+    return layout, batches
+
+
+def infer_tiles(rknn_lite_instance, batches, count):
+    """逐组推理, 返回 count 个 (TILE_SIZE, TILE_SIZE) 的 float32 logits; int8 输出只反量化方块本身。"""
+    tiles = []
+    for batch in batches:
+        if QUANTIZED_OUTPUTS and rknn_lite_instance.quantized_outputs:
+            outputs, quants = rknn_lite_instance.inference_quantized(inputs=[batch])
+            zp, scale = quants[0]
+            logits = (outputs[0].astype(np.float32) - zp) * np.float32(scale)
+        else:
+            logits = np.asarray(rknn_lite_instance.inference(inputs=[batch])[0], dtype=np.float32)
+        INPUT_ARENA.release(batch)
+        tiles.extend(logits.reshape(-1, TILE_SIZE, TILE_SIZE)[:TILE_BATCH])
+    return tiles[:count]
+
+
+def stitch_tiles(tiles, layout, original_frame_shape, binary=False):
+    """按 tile_window 加权平均重叠区域的 logits, 拼回原图分辨率后转换为掩码 (同 segmentation_to_mask)。"""
+    scale, (sh, sw), (ph, pw), positions = layout
+    acc = np.zeros((ph, pw), dtype=np.float32)
+    weight = np.zeros((ph, pw), dtype=np.float32)
+    window = tile_window(TILE_SIZE, TILE_OVERLAP)
+    for (y, x), logits in zip(positions, tiles):
+        acc[y:y + TILE_SIZE, x:x + TILE_SIZE] += logits * window
+        weight[y:y + TILE_SIZE, x:x + TILE_SIZE] += window
+    logits = acc[:sh, :sw]
+    logits /= weight[:sh, :sw]
+    h, w = original_frame_shape[:2]
+    if (sh, sw) != (h, w):
+        # 缩小过的帧: 在 logits 上双线性放大, 比放大掩码更平滑
+        logits = cv2.resize(logits, (w, h), interpolation=cv2.INTER_LINEAR)
+    return segmentation_to_mask(logits, binary=binary)
+
+
+# (源尺寸, 目标尺寸) -> 目标像素对应的源像素下标, 与 cv2.resize(INTER_NEAREST) 的取样方式一致
+_nearest_cache = {}
+
+
+def nearest_index(src, dst):
+    key = (src, dst)
+    index = _nearest_cache.get(key)
+    if index is None:
+        index = np.floor(np.arange(dst) * (1.0 / (dst / src))).astype(np.intp)
+        index = _nearest_cache[key] = np.minimum(index, src - 1)
+    return index
+
+
+# (帧尺寸, 颜色) -> 纯色图, 叠加时按 ROI 取切片
+_color_planes = {}
+
+
+def color_plane(shape, color):
+    key = (shape, color)
+    plane = _color_planes.get(key)
+    if plane is None:
+        plane = np.empty(shape, dtype=np.uint8)
+        plane[:] = color
+        plane.flags.writeable = False
+        plane = _color_planes[key] = plane
+    return plane
+
+
+def blend_mask_rois(frame, mask, color=OVERLAY_COLOR, alpha=OVERLAY_ALPHA):
+    """
+    把模型分辨率的掩码 (> MASK_THRESH 为目标) 以半透明颜色就地叠加到 frame 上。
+    在小掩码上找连通域, 只把每个连通域的外接矩形按最近邻放大到原图并混合,
+    耗时与火焰面积成正比; 掩码为空时 frame 原样返回。
+    目标像素的结果与 cv2.addWeighted(frame, 1 - alpha, 颜色图, alpha, 0) 相同, 其他像素保持不变。
+    """
+    binary = (mask > MASK_THRESH).view(np.uint8)
+    if not cv2.countNonZero(binary):
+        return frame
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    if n - 1 > MAX_OVERLAY_ROIS:
+        # 连通域太多时逐个处理反而更慢, 合并为一个矩形
+        x0, y0 = stats[1:, 0].min(), stats[1:, 1].min()
+        x1 = (stats[1:, 0] + stats[1:, 2]).max()
+        y1 = (stats[1:, 1] + stats[1:, 3]).max()
+        labels = binary
+        rois = [(1, x0, y0, x1, y1)]
+    else:
+        rois = [(i, x, y, x + w, y + h) for i, (x, y, w, h, _) in enumerate(stats[1:], 1)]
+
+    xs = nearest_index(mask.shape[1], frame.shape[1])
+    ys = nearest_index(mask.shape[0], frame.shape[0])
+    paint = color_plane(frame.shape, color)
+    for label, x0, y0, x1, y1 in rois:
+        # 源矩形 [x0, x1) 在原图上对应的列范围
+        X0, X1 = np.searchsorted(xs, (x0, x1))
+        Y0, Y1 = np.searchsorted(ys, (y0, y1))
+        hit = labels[np.ix_(ys[Y0:Y1], xs[X0:X1])] == label
+        region = frame[Y0:Y1, X0:X1]
+        blended = cv2.addWeighted(region, 1 - alpha, paint[Y0:Y1, X0:X1], alpha, 0)
+        np.copyto(region, blended, where=hit[..., None])
+    return frame
+
+
+def extract_fire_regions(mask, frame_shape, frame_id=-1, timestamp=0.0):
+    """
+    把掩码 (> MASK_THRESH 为火焰, 可以是模型分辨率或原图分辨率) 转换为矢量化的火焰区域。
+    在掩码分辨率上做连通域分析, 每个区域输出外接矩形 / 质心 / 面积和外轮廓多边形 (不含内部空洞),
+    结果按面积从大到小排列, 只包含坐标而不包含像素, 可以每帧发送给下游做地理定位和告警。
+    返回: (FIRE_REGION_DTYPE 记录数组, (N, 2) float32 顶点数组), 没有火焰时两者长度均为 0。
+    """
+    binary = (mask > MASK_THRESH).view(np.uint8)
+    vertices = np.zeros((0, 2), dtype=np.float32)
+    if not cv2.countNonZero(binary):
+        regions = np.zeros(0, dtype=FIRE_REGION_DTYPE)
+        return regions, vertices
 
-    # 防御性拷贝，确保后续操作在本线程的私有数据上进行
-    original_frame_copy = original_frame.copy()
+    n, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    keep = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= MIN_REGION_PIXELS) + 1
+    keep = keep[np.argsort(-stats[keep, cv2.CC_STAT_AREA], kind="stable")][:MAX_REGIONS]
+    if keep.size == 0:
+        # 只有小于 MIN_REGION_PIXELS 的噪点
+        return np.zeros(0, dtype=FIRE_REGION_DTYPE), vertices
+
+    # 掩码像素 -> 原图像素的缩放比例 (与 blend_mask_rois 的最近邻放大一致)
+    sx = frame_shape[1] / mask.shape[1]
+    sy = frame_shape[0] / mask.shape[0]
+    regions = np.zeros(len(keep), dtype=FIRE_REGION_DTYPE)
+    x, y, w, h, pixels = stats[keep].T
+    regions["bbox"] = np.stack([x * sx, y * sy, (x + w) * sx, (y + h) * sy], axis=1)
+    # 像素 (i, j) 覆盖原图 [i, i + 1) * s, 所以像素坐标先加 0.5 再缩放
+    regions["centroid"] = (centroids[keep] + 0.5) * (sx, sy)
+    regions["area"] = pixels * (sx * sy)
+    regions["pixels"] = pixels
+    regions["frame_id"] = frame_id
+    regions["timestamp"] = timestamp
+
+    polygons = []
+    start = 0
+    for k, label in enumerate(keep):
+        # 只在该区域的外接矩形内找轮廓, 耗时与区域大小成正比
+        roi = (labels[y[k]:y[k] + h[k], x[k]:x[k] + w[k]] == label).view(np.uint8)
+        contours, _ = cv2.findContours(
+            roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x[k]), int(y[k]))
+        )
+        polygon = cv2.approxPolyDP(max(contours, key=len), POLYGON_EPSILON, True)
+        polygons.append(polygon.reshape(-1, 2))
+        regions["vertex_start"][k] = start
+        regions["vertex_count"][k] = len(polygons[-1])
+        start += len(polygons[-1])
+    vertices = ((np.concatenate(polygons) + 0.5) * (sx, sy)).astype(np.float32)
+    return regions, vertices
+
+
+# 以下四个阶段函数既被 myFunc 串行调用, 也可以交给 rknnpool.rknnPipelineExecutor
+# 分别用独立的线程运行, 推理实例只在 stage_infer 期间被占用
+# 帧的所有权: 提交给线程池的帧归线程池所有, 提交方之后不再修改它;
+# 前处理 / 后处理只读 (设为只读视图防止误写), 渲染把结果写入 OUTPUT_ARENA 复用的输出帧,
+# 因此每帧只有渲染时的一次整帧拷贝, 且不分配新的整帧缓冲区 (整帧写入都经过 np.copyto / cv2 的 dst,
+# benchmark.py 据此统计拷贝次数)。渲染放在子进程中时 (rknnPipelineExecutor 的 processStages),
+# 结果要从共享内存槽位拷出 (shm_workers.detach), 每帧多一次整帧分配和拷贝。
+def stage_preprocess(original_frame):
+    original_frame.flags.writeable = False
 
     # 1. 预处理帧 (这部分可以在锁外并行执行)
-    input_data_nhwc = preprocess_frame_for_unet(original_frame_copy, IMG_SIZE)
-    # 2. 模型推理 (这是关键的临界区)
-    # <--- 2. 使用 with 语句来自动获取和释放锁
-    # 在这个 'with' 代码块内，一次只有一个线程可以执行
-    # 这可以防止多个线程同时调用 inference() 导致硬件冲突
-    outputs = rknn_lite_instance.inference(inputs=[input_data_nhwc])
+    if TILED_MODE:
+        # 分块模式: input 为 (layout, batches)
+        return original_frame, preprocess_tiles(original_frame)
+    input_data_nhwc = preprocess_frame_for_unet(original_frame, IMG_SIZE)
+    return original_frame, input_data_nhwc
+
+
+def stage_infer(rknn_lite_instance, job):
+    original_frame, input_data_nhwc = job
+    # 2. 模型推理
+    if TILED_MODE:
+        # 分块模式: outputs 为 (layout, 各方块 logits), 已反量化
+        layout, batches = input_data_nhwc
+        tiles = infer_tiles(rknn_lite_instance, batches, len(layout[3]))
+        return original_frame, (layout, tiles), None
+    quant = None
+    if QUANTIZED_OUTPUTS and rknn_lite_instance.quantized_outputs:
+        outputs, quants = rknn_lite_instance.inference_quantized(inputs=[input_data_nhwc])
+        quant = quants[0]
+    else:
+        outputs = rknn_lite_instance.inference(inputs=[input_data_nhwc])
+    INPUT_ARENA.release(input_data_nhwc)
+    return original_frame, outputs, quant
 
-    # 锁在 'with' 块结束时自动释放，其他等待的线程可以进入
 
+def stage_postprocess(job, upscale=True):
+    """upscale=False: SIDE_BY_SIDE / MASK_ONLY 也返回模型分辨率的掩码, 由调用方放大。"""
+    original_frame, outputs, quant = job
     if not outputs:
         print("---------------------------------模型推理没有输出。")
-        return None
+        return original_frame, None
 
     # 3. 后处理模型输出 (这部分也可以在锁外并行执行)
+    # OVERLAY 只用到模型分辨率的二值掩码, 不需要概率图, 放大留给 stage_render 按区域进行
+    overlay = VISUALIZATION_MODE not in PROBABILITY_MODES
+    if TILED_MODE:
+        # 分块模式直接得到原图分辨率的掩码
+        layout, tiles = outputs
+        return original_frame, stitch_tiles(tiles, layout, original_frame.shape, binary=overlay)
     processed_mask = postprocess_unet_output(
-        outputs[0], original_frame_copy.shape
-    )  # Processed mask shape: (480, 640)
+        outputs[0],
+        original_frame.shape,
+        quant,
+        binary=overlay,
+        upscale=upscale and not overlay,
+    )  # Processed mask shape: (480, 640), OVERLAY 时为模型分辨率
     # #打印processed_mask的最大值和最小值
     # print(f"Processed mask min: {np.min(processed_mask)}, max: {np.max(processed_mask)}")
     # #打印processed_mask的形状
     # print(f"Processed mask shape: {processed_mask.shape}")
     if processed_mask is None:
         print("---------------------------------后处理掩码失败。")
+    return original_frame, processed_mask
+
+
+def stage_render(job):
+    original_frame, processed_mask = job
+    if processed_mask is None:
         return None
 
     h, w, _ = original_frame.shape
@@ -132,36 +471,142 @@ def myFunc(rknn_lite_instance, original_frame):
 
     # --------------------------------------------------------
     if VISUALIZATION_MODE == "SIDE_BY_SIDE":
-        # 方式 A: 左右拼接
-        mask_bgr_display = cv2.cvtColor(processed_mask, cv2.COLOR_GRAY2BGR)
+        # 方式 A: 左右拼接, 直接写入 (h, 2w) 的输出帧
+        output_display_frame = OUTPUT_ARENA.acquire(("side_by_side", h, w), (h, 2 * w, 3))
+        np.copyto(output_display_frame[:, :w], original_frame)
         # 确保尺寸一致 (postprocess_unet_output 已经处理了)
-        if mask_bgr_display.shape[0] != h or mask_bgr_display.shape[1] != w:
-            mask_bgr_display = cv2.resize(mask_bgr_display, (w, h))
-        output_display_frame = np.hstack((original_frame, mask_bgr_display))
+        if processed_mask.shape[0] != h or processed_mask.shape[1] != w:
+            processed_mask = cv2.resize(processed_mask, (w, h))
+        cv2.cvtColor(processed_mask, cv2.COLOR_GRAY2BGR, dst=output_display_frame[:, w:])
     # --------------------------------------------------------
     elif VISUALIZATION_MODE == "OVERLAY":
         # 方式 B: 将掩码叠加到原始帧上
-        # original_frame_bgr = cv2.cvtColor(original_frame, cv2.COLOR_GRAY2BGR)
-        # 创建一个简单的叠加效果：比如将分割出的区域在原图上用半透明红色标出
-        # 注意：这种叠加方式对于灰度掩码可能效果不直观，
-        # 你可能需要先对 processed_mask 进行阈值化得到二值掩码
-        # color_overlay = original_frame.copy() # 不需要，addWeighted会创建新图
-        color_mask_viz = np.zeros_like(original_frame)
-        # 假设分割目标是较亮区域
-        color_mask_viz[processed_mask > 128] = [0, 255, 0]  # BGR红色 (目标区域)
-        # 你也可以让非目标区域是原始图像，目标区域是彩色掩码
-        # color_mask_viz[processed_mask <= 128] = [0, 255, 0] # BGR绿色 (背景区域)
-        alpha = 0.4  # 掩码的透明度
-        beta = 1 - alpha  # 原始帧的透明度
-        output_display_frame = cv2.addWeighted(
-            original_frame, beta, color_mask_viz, alpha, 0
-        )
+        # 用半透明绿色标出分割区域, 只处理掩码连通域所在的矩形;
+        # 没有火焰时输出帧就是原始帧的拷贝, 非目标区域保持原始亮度
+        output_display_frame = OUTPUT_ARENA.acquire(("frame", h, w), (h, w, 3))
+        np.copyto(output_display_frame, original_frame)
+        blend_mask_rois(output_display_frame, processed_mask)
     # --------------------------------------------------------
     elif VISUALIZATION_MODE == "MASK_ONLY":
         # 方式 C: 只输出掩码 (转为BGR以便VideoWriter处理)
-        output_display_frame = cv2.cvtColor(processed_mask, cv2.COLOR_GRAY2BGR)
         # 确保尺寸与原始帧一致，如果VideoWriter期望固定尺寸
-        if output_display_frame.shape[0] != h or output_display_frame.shape[1] != w:
-            output_display_frame = cv2.resize(output_display_frame, (w, h))
+        if processed_mask.shape[0] != h or processed_mask.shape[1] != w:
+            processed_mask = cv2.resize(processed_mask, (w, h))
+        output_display_frame = OUTPUT_ARENA.acquire(("frame", h, w), (h, w, 3))
+        cv2.cvtColor(processed_mask, cv2.COLOR_GRAY2BGR, dst=output_display_frame)
     # --------------------------------------------------------
     return output_display_frame  # 返回组合后的帧
+
+
+# (阶段名, 阶段函数, 是否需要 RKNNLite 实例)
+PIPELINE_STAGES = (
+    ("preprocess", stage_preprocess, False),
+    ("infer", stage_infer, True),
+    ("postprocess", stage_postprocess, False),
+    ("render", stage_render, False),
+)
+
+
+def stage_render_keep_mask(job):
+    """同 stage_render, 但返回 (处理后的帧, 掩码), 掩码留给场景门控复用。"""
+    return stage_render(job), job[1]
+
+
+# 与 PIPELINE_STAGES 相同, 结果为 (处理后的帧, 掩码)
+SEGMENT_STAGES = PIPELINE_STAGES[:-1] + (
+    ("render", stage_render_keep_mask, False),
+)
+
+
+def stage_preprocess_meta(job):
+    """
+    同 stage_preprocess, 输入为 (原始帧, frame_id, timestamp), 即线程池 withMeta=True 时提交的内容;
+    帧号和采集时间附在结果末尾, 随各阶段传给 stage_postprocess_regions。
+    """
+    original_frame, frame_id, timestamp = job
+    return stage_preprocess(original_frame) + ((frame_id, timestamp),)
+
+
+def stage_infer_meta(rknn_lite_instance, job):
+    """同 stage_infer, 末尾的 (frame_id, timestamp) 原样传递。"""
+    return stage_infer(rknn_lite_instance, job[:-1]) + job[-1:]
+
+
+def stage_postprocess_regions(job):
+    """
+    同 stage_postprocess, 另外从掩码中提取火焰区域 (带上实际推理的这一帧的帧号和采集时间),
+    返回 (原始帧, 掩码, (regions, vertices))。
+    """
+    frame_id, timestamp = job[-1]
+    # 轮廓在模型分辨率的掩码上提取 (坐标按 frame_shape 换算回原图), 即使渲染需要原图分辨率的掩码;
+    # 分块模式的掩码由各方块拼接而成, 本身就是原图分辨率
+    original_frame, processed_mask = stage_postprocess(job[:-1], upscale=False)
+    if processed_mask is None:
+        return original_frame, None, None
+    regions = extract_fire_regions(processed_mask, original_frame.shape, frame_id, timestamp)
+    h, w = original_frame.shape[:2]
+    if VISUALIZATION_MODE in PROBABILITY_MODES and processed_mask.shape != (h, w):
+        # 与 postprocess_unet_output 的放大方式相同
+        processed_mask = cv2.resize(processed_mask, (w, h), interpolation=cv2.INTER_NEAREST)
+    return original_frame, processed_mask, regions
+
+
+def stage_render_keep_regions(job):
+    """同 stage_render, 返回 (处理后的帧, 掩码, (regions, vertices))。"""
+    original_frame, processed_mask, regions = job
+    return stage_render((original_frame, processed_mask)), processed_mask, regions
+
+
+# 结果为 (处理后的帧, 掩码, (regions, vertices)), 见 extract_fire_regions;
+# 第一个阶段的输入为 (原始帧, frame_id, timestamp), 线程池须使用 withMeta=True
+REGION_STAGES = (
+    ("preprocess", stage_preprocess_meta, False),
+    ("infer", stage_infer_meta, True),
+    ("postprocess", stage_postprocess_regions, False),
+    ("render", stage_render_keep_regions, False),
+)
+
+
+def segmentFunc(rknn_lite_instance, original_frame):
+    """同 myFunc, 但返回 (处理后的帧, 掩码), 见 reuse_mask。"""
+    job = stage_preprocess(original_frame)
+    job = stage_infer(rknn_lite_instance, job)
+    job = stage_postprocess(job)
+    return stage_render_keep_mask(job)
+
+
+def regionFunc(rknn_lite_instance, job):
+    """
+    同 segmentFunc, 结果中另外带上火焰区域, 见 REGION_STAGES。
+    job 为 (原始帧, frame_id, timestamp), 线程池须使用 withMeta=True。
+    """
+    job = stage_preprocess_meta(job)
+    job = stage_infer_meta(rknn_lite_instance, job)
+    job = stage_postprocess_regions(job)
+    return stage_render_keep_regions(job)
+
+
+def reuse_mask(original_frame, result):
+    """
+    场景门控跳过推理时, 把上一帧 segmentFunc / regionFunc 结果中的掩码渲染到当前帧上,
+    返回值格式与原结果相同 (火焰区域同样沿用上一帧)。
+    """
+    processed_mask = result[1]
+    return (stage_render((original_frame, processed_mask)), processed_mask) + tuple(result[2:])
+
+
+def myFunc(rknn_lite_instance, original_frame):
+    """
+    在rknnPoolExecutor中运行的回调函数。
+    rknn_lite_instance: 由线程池提供的一个RKNNLite对象。
+    original_frame: 从视频捕获的原始帧, 交给 myFunc 后变为只读, 调用方不应再修改。
+    返回: 处理后的帧 (NumPy array, 来自 OUTPUT_ARENA, 用完后可归还复用) 或 None。
+    Original frame shape: (480, 640, 3)
+    """
+    if original_frame is None:
+        return None
+
+    job = stage_preprocess(original_frame)
+    job = stage_infer(rknn_lite_instance, job)
+    job = stage_postprocess(job)
+    return stage_render(job)
@@ -1,11 +1,14 @@
 # main_ui.py
 import sys
 import os
+import time
 import numpy as np
 from pathlib import Path
 import multiprocessing as mp
 
 # ==================== 绝对不能有 import cv2 或 import zmq ====================
+# shm_ring 只依赖 numpy 和 multiprocessing
+from shm_ring import FrameRingReader
 
 from PySide6.QtCore import QObject, Signal, Slot, QThread, QTimer, QUrl, Qt
 from PySide6.QtGui import QGuiApplication, QImage
@@ -31,20 +34,23 @@ class LiveImageProvider(QQuickImageProvider):
             self.imageChanged.emit()
 
 
-# --- 帧读取器 (从 multiprocessing.Queue 读取) ---
+# --- 帧读取器 (从共享内存环形缓冲区读取) ---
 class FrameReader(QObject):
     frameReady = Signal(QImage)
 
-    def __init__(self, frame_queue, parent=None):
+    def __init__(self, ring_name, parent=None):
         super().__init__(parent)
-        self.queue = frame_queue
+        self.ring_name = ring_name
+        self.ring = None
         self.running = False
+        self.last_report = time.time()
+        self.reported = {"skipped": 0, "overrun": 0}
 
     @Slot()
     def start(self):
         self.running = True
         self.timer = QTimer()
-        self.timer.timeout.connect(self.read_frame_from_queue)
+        self.timer.timeout.connect(self.read_frame_from_ring)
         self.timer.start(16)  # ~60 FPS
         print("[UI Process] FrameReader started.")
 
@@ -53,13 +59,24 @@ class FrameReader(QObject):
         self.running = False
         if self.timer:
             self.timer.stop()
+        if self.ring is not None:
+            self.ring.close()
 
-    def read_frame_from_queue(self):
-        if not self.running or self.queue.empty():
+    def read_frame_from_ring(self):
+        if not self.running:
+            return
+        if self.ring is None:
+            try:
+                self.ring = FrameRingReader(self.ring_name)
+            except FileNotFoundError:
+                # 工作进程还没有创建缓冲区, 下次定时器触发时再试
+                return
+
+        # 取最新的一帧: 共享内存上的 Numpy 只读视图 (BGR格式), 没有新帧时为 None
+        bgr_frame, info = self.ring.latest()
+        if bgr_frame is None:
+            self.report_lag()
             return
-
-        # 从队列获取 Numpy 数组 (BGR格式)
-        bgr_frame = self.queue.get()
         # 先打印图像信息，确保我们拿到的是正确的格式
         print(
             f"[UI Process] Received frame: shape={bgr_frame.shape}, dtype={bgr_frame.dtype}"
@@ -75,7 +92,22 @@ class FrameReader(QObject):
         h, w, ch = bgr_frame.shape
         if ch == 3:  # BGR
             qt_image = QImage(bgr_frame.data, w, h, w * ch, QImage.Format.Format_BGR888)
-            self.frameReady.emit(qt_image.copy())
+            # copy() 是这一帧唯一的一次拷贝: 从共享内存拷进 Qt 自己的内存;
+            # 拷贝期间槽位被工作进程覆盖时, 这一帧可能不完整, 丢弃
+            qt_image = qt_image.copy()
+            if self.ring.verify(info):
+                self.frameReady.emit(qt_image)
+        self.report_lag()
+
+    def report_lag(self):
+        # 每秒最多报告一次 UI 读得比工作进程写得慢 (跳帧) 或读取中被覆盖的情况
+        if time.time() - self.last_report < 1.0:
+            return
+        self.last_report = time.time()
+        stats = self.ring.stats()
+        if stats["skipped"] > self.reported["skipped"] or stats["overrun"] > self.reported["overrun"]:
+            print(f"[UI Process] Reader is falling behind: {stats}")
+            self.reported = {"skipped": stats["skipped"], "overrun": stats["overrun"]}
 
 
 if __name__ == "__main__":
@@ -89,20 +121,20 @@ if __name__ == "__main__":
     app = QGuiApplication(sys.argv)
     engine = QQmlApplicationEngine()
 
-    # 1. 创建进程间通信队列
-    frame_queue = mp.Queue(maxsize=50)
+    # 1. 共享内存环形缓冲区的名字, 由工作进程创建, 本进程只映射读取
+    ring_name = f"fire_frames_{os.getpid()}"
 
     # 2. 延迟导入并启动工作进程
-    def start_worker_process(queue):
+    def start_worker_process(ring_name):
         from worker_process import worker_loop  # 只有在这里才 import
 
-        process = mp.Process(target=worker_loop, args=(queue,))
+        process = mp.Process(target=worker_loop, args=(ring_name,))
         process.daemon = True
         process.start()
         print(f"[UI Process] Worker process started with PID: {process.pid}")
         return process
 
-    worker_process = start_worker_process(frame_queue)
+    worker_process = start_worker_process(ring_name)
 
     # 3. 设置UI部分
     image_provider = LiveImageProvider()
@@ -111,7 +143,7 @@ if __name__ == "__main__":
 
     # 4. 创建并启动帧读取线程
     reader_thread = QThread()
-    frame_reader = FrameReader(frame_queue)
+    frame_reader = FrameReader(ring_name)
     frame_reader.moveToThread(reader_thread)
     reader_thread.started.connect(frame_reader.start)
     frame_reader.frameReady.connect(
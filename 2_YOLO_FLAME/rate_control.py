@@ -0,0 +1,145 @@
+# rate_control.py
+# 自适应码率控制: 根据实测发送码率和订阅端经回传通道反馈的帧龄 / 丢帧率,
+# 调整 FrameSender 的 JPEG 质量和输出缩放比例, 使图传链路 (例如无人机数传电台) 不被塞满。
+# 回传通道: 订阅端 (worker_process) 用 PUB 连接到生产者的 FEEDBACK_ADDRESS 端口定期发送反馈,
+# 生产者用 SUB 绑定该端口; PUB/SUB 在对端不在线时直接丢消息, 两端都不会阻塞。
+import struct
+import time
+
+FEEDBACK_PORT = 5455
+# 魔数, 平均帧龄 (ms), 丢帧率 (0-1), 统计窗口内收到的帧数
+FEEDBACK = struct.Struct("<2sddI")
+FEEDBACK_MAGIC = b"FB"
+
+
+def sendFeedback(socket, ageMs, dropRate, received):
+    """订阅端调用: 发送一条反馈, 对端不在线或发送队列已满时直接丢弃。"""
+    import zmq
+
+    try:
+        socket.send(FEEDBACK.pack(FEEDBACK_MAGIC, ageMs, dropRate, received), zmq.NOBLOCK)
+    except zmq.Again:
+        pass
+
+
+def unpackFeedback(data):
+    """返回 dict(ageMs, dropRate, received); 格式不对时返回 None。"""
+    if len(data) != FEEDBACK.size:
+        return None
+    magic, ageMs, dropRate, received = FEEDBACK.unpack(data)
+    if magic != FEEDBACK_MAGIC:
+        return None
+    return {"ageMs": ageMs, "dropRate": dropRate, "received": received}
+
+
+class RateController():
+    """
+    每隔 interval 秒评估一次链路状态并调整工作点 (JPEG 质量, 缩放比例):
+    - 拥塞 (码率超过 targetKbps, 或帧龄超过 targetLatencyMs, 或丢帧率超过 maxDropRate):
+      质量降低 decreaseStep; 质量已到 minQuality 时缩放降一档, 质量回到中间值;
+    - 各项指标都低于目标的 headroom 倍: 质量提高 increaseStep; 质量已到 maxQuality 时缩放升一档;
+    - 其他情况保持不变 (滞回区间, 避免来回振荡)。
+    targetKbps / targetLatencyMs 为 None 时不参与判断; 超过 feedbackTimeout 秒没有收到反馈时,
+    帧龄和丢帧率视为未知, 只按码率控制。帧龄用生产者的发送时间戳计算, 跨机器时两端时钟需要同步。
+    """
+
+    def __init__(self, targetKbps=None, targetLatencyMs=None, maxDropRate=0.1,
+                 minQuality=40, maxQuality=95, scales=(1.0, 0.75, 0.5),
+                 decreaseStep=10, increaseStep=5, headroom=0.7, interval=0.5,
+                 feedbackSocket=None, feedbackTimeout=2.0):
+        self.targetKbps = targetKbps
+        self.targetLatencyMs = targetLatencyMs
+        self.maxDropRate = maxDropRate
+        self.minQuality = minQuality
+        self.maxQuality = maxQuality
+        self.scales = scales
+        self.decreaseStep = decreaseStep
+        self.increaseStep = increaseStep
+        self.headroom = headroom
+        self.interval = interval
+        self.feedbackSocket = feedbackSocket
+        self.feedbackTimeout = feedbackTimeout
+
+        self.quality = maxQuality
+        self.scaleIndex = 0
+        self.feedback = None
+        self.feedbackTime = 0.0
+        self.windowStart = time.time()
+        self.windowBytes = 0
+        self.lastBytes = 0
+        self.kbps = 0.0
+        self.decreases = 0
+        self.increases = 0
+
+    @property
+    def scale(self):
+        return self.scales[self.scaleIndex]
+
+    def receiveFeedback(self):
+        """取出回传通道中已到达的反馈, 只保留最新一条。"""
+        if self.feedbackSocket is None:
+            return
+        import zmq
+
+        while True:
+            try:
+                data = self.feedbackSocket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            feedback = unpackFeedback(data)
+            if feedback is not None:
+                self.feedback = feedback
+                self.feedbackTime = time.time()
+
+    def step(self, sender):
+        """每发送一帧后调用: 统计 sender 的发送字节数, 到达评估周期时调整工作点并应用到 sender。"""
+        self.windowBytes += sender.bytes - self.lastBytes
+        self.lastBytes = sender.bytes
+        now = time.time()
+        elapsed = now - self.windowStart
+        if elapsed < self.interval:
+            return
+        self.kbps = self.windowBytes * 8 / 1000 / elapsed
+        self.windowStart, self.windowBytes = now, 0
+        self.receiveFeedback()
+        self.adjust(now)
+        sender.quality = self.quality
+        sender.scale = self.scale
+
+    def adjust(self, now=None):
+        now = time.time() if now is None else now
+        # (实测值, 目标) 列表, 目标为 None 或反馈过期的指标不参与判断
+        metrics = [(self.kbps, self.targetKbps)]
+        if self.feedback is not None and now - self.feedbackTime < self.feedbackTimeout:
+            metrics.append((self.feedback["ageMs"], self.targetLatencyMs))
+            metrics.append((self.feedback["dropRate"], self.maxDropRate))
+        metrics = [(value, target) for value, target in metrics if target is not None]
+
+        if any(value > target for value, target in metrics):
+            self.decreases += 1
+            if self.quality > self.minQuality:
+                self.quality = max(self.minQuality, self.quality - self.decreaseStep)
+            elif self.scaleIndex < len(self.scales) - 1:
+                self.scaleIndex += 1
+                self.quality = (self.minQuality + self.maxQuality) // 2
+        elif all(value < target * self.headroom for value, target in metrics):
+            if self.quality < self.maxQuality:
+                self.increases += 1
+                self.quality = min(self.maxQuality, self.quality + self.increaseStep)
+            elif self.scaleIndex > 0:
+                self.increases += 1
+                self.scaleIndex -= 1
+                self.quality = (self.minQuality + self.maxQuality) // 2
+
+    def stats(self):
+        """当前工作点和最近一个周期的测量值。"""
+        stats = {
+            "quality": self.quality,
+            "scale": self.scale,
+            "kbps": self.kbps,
+            "decreases": self.decreases,
+            "increases": self.increases,
+        }
+        if self.feedback is not None:
+            stats["feedback"] = dict(self.feedback, ageS=time.time() - self.feedbackTime)
+        return stats
@@ -0,0 +1,226 @@
+# rknn_backend.py
+# 推理后端抽象层: rknnpool 只依赖这里的 load / init_runtime / inference / release 接口,
+# 这样在没有 RK3588 的 x86 机器上也可以用 ONNX Runtime 或 Mock 后端跑通整条流水线。
+# 接口与 RKNNLite 保持一致: load / init_runtime 返回 0 表示成功。
+import time
+
+import numpy as np
+
+# core 编号约定 (与 rknnpool.initRKNN 的 id 参数一致):
+# 0/1/2 -> 单个 NPU 核心, -1 -> 三核联合, 其他 -> 由运行时自动选择
+
+
+def quantizeAffine(data):
+    """按张量做非对称 int8 量化, 返回 (int8 数据, (zero_point, scale)), 与 RKNN 的输出量化方式一致。"""
+    lo, hi = min(float(data.min()), 0.0), max(float(data.max()), 0.0)
+    scale = (hi - lo) / 255.0 or 1.0
+    zp = int(round(-128 - lo / scale))
+    q = np.clip(np.round(data / scale) + zp, -128, 127).astype(np.int8)
+    return q, (zp, np.float32(scale))
+
+
+class InferenceBackend:
+    name = "base"
+    # True 表示支持 inference_quantized, 即直接返回 int8 输出和量化参数
+    quantized_outputs = False
+
+    def load(self, model_path):
+        raise NotImplementedError
+
+    def init_runtime(self, core=None):
+        raise NotImplementedError
+
+    def inference(self, inputs, data_format=None):
+        raise NotImplementedError
+
+    def inference_quantized(self, inputs, data_format=None):
+        """返回 (int8 输出列表, [(zero_point, scale), ...]), 反量化由后处理按需完成。"""
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class RKNNLiteBackend(InferenceBackend):
+    """
+    板端 NPU 后端, 对 rknnlite.api.RKNNLite 的薄封装。
+    rknnlite 的 Python 接口总是返回反量化后的 float32 输出, 因此不支持 inference_quantized。
+    """
+
+    name = "rknnlite"
+
+    def __init__(self):
+        # 延迟导入, 保证在没有安装 rknnlite 的机器上也能 import 本模块
+        from rknnlite.api import RKNNLite
+
+        self._api = RKNNLite
+        self.rknn_lite = RKNNLite()
+
+    def load(self, model_path):
+        return self.rknn_lite.load_rknn(model_path)
+
+    def init_runtime(self, core=None):
+        core_masks = {
+            0: self._api.NPU_CORE_0,
+            1: self._api.NPU_CORE_1,
+            2: self._api.NPU_CORE_2,
+            -1: self._api.NPU_CORE_0_1_2,
+        }
+        if core in core_masks:
+            return self.rknn_lite.init_runtime(core_mask=core_masks[core])
+        return self.rknn_lite.init_runtime()
+
+    def inference(self, inputs, data_format=None):
+        if data_format is None:
+            return self.rknn_lite.inference(inputs=inputs)
+        return self.rknn_lite.inference(inputs=inputs, data_format=data_format)
+
+    def release(self):
+        self.rknn_lite.release()
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    CPU 后端, 运行导出 RKNN 之前的 ONNX 模型。
+    RKNN 模型在转换时已内置 mean/std 归一化, ONNX 模型没有, 所以这里把
+    uint8 NHWC 输入转换为 float32 NCHW 并乘以 scale。
+    """
+
+    name = "onnx"
+
+    def __init__(self, scale=1.0 / 255.0, threads=1):
+        import onnxruntime
+
+        self._ort = onnxruntime
+        self.scale = scale
+        self.threads = threads
+        self.model_path = None
+        self.session = None
+
+    def load(self, model_path):
+        self.model_path = model_path
+        return 0
+
+    def init_runtime(self, core=None):
+        # CPU 上没有 NPU 核心的概念, core 参数被忽略
+        options = self._ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        try:
+            self.session = self._ort.InferenceSession(
+                self.model_path, options, providers=["CPUExecutionProvider"]
+            )
+        except Exception as e:
+            print(f"ONNX Runtime 加载模型失败: {e}")
+            return -1
+        return 0
+
+    def inference(self, inputs, data_format=None):
+        feeds = {}
+        for meta, data in zip(self.session.get_inputs(), inputs):
+            data = np.asarray(data)
+            if data.ndim == 4 and (data_format is None or data_format[0] == "nhwc"):
+                data = data.transpose(0, 3, 1, 2)
+            feeds[meta.name] = np.ascontiguousarray(data, dtype=np.float32) * self.scale
+        return self.session.run(None, feeds)
+
+    def release(self):
+        self.session = None
+
+
+def yolov8MockOutputs(rng, grids=(80, 40, 20), num_classes=80, hits=4):
+    # 每个分支输出 (box DFL logits, 类别置信度, score_sum);
+    # 类别置信度大部分低于阈值, 每个分支只放 hits 个高分格子, 接近稀疏的森林航拍画面
+    outputs = []
+    for grid in grids:
+        box = rng.standard_normal((1, 64, grid, grid)).astype(np.float32)
+        cls = (rng.random((1, num_classes, grid, grid)) * 0.1).astype(np.float32)
+        ys = rng.integers(0, grid, hits)
+        xs = rng.integers(0, grid, hits)
+        cls[0, 0, ys, xs] = 0.9
+        outputs += [box, cls, cls.sum(axis=1, keepdims=True)]
+    return outputs
+
+
+def _unetOutputs(rng, size=256, blobs=1):
+    # 分割 logits: 大部分为背景 (负值), 放 blobs 个圆形火焰区域 (正值)
+    logits = (rng.standard_normal((size, size)) * 0.5 - 4).astype(np.float32)
+    ys, xs = np.ogrid[:size, :size]
+    for _ in range(blobs):
+        cy, cx = rng.integers(0, size, 2)
+        logits[(ys - cy) ** 2 + (xs - cx) ** 2 < (size // 16) ** 2] = 4
+    return [logits.reshape(1, 1, size, size)]
+
+
+# 常用模型的合成输出, 供 Mock 后端使用
+MOCK_PRESETS = {
+    "yolov8": yolov8MockOutputs,
+    "unet": _unetOutputs,
+}
+
+
+class MockBackend(InferenceBackend):
+    """
+    确定性的合成张量后端, 用于在 CI / x86 上压测线程池和后处理。
+    preset: MOCK_PRESETS 中的模型名; 或者用 outputShapes 直接给出输出形状 (标准正态分布)。
+    latency: 每次 inference 的模拟耗时 (秒), 用 sleep 实现, 与 NPU 一样会释放 GIL。
+    inference_quantized 返回同一组输出按张量 int8 量化后的结果。
+    """
+
+    name = "mock"
+    quantized_outputs = True
+
+    def __init__(self, preset=None, outputShapes=None, latency=0.0, seed=0):
+        if outputShapes is None and preset not in MOCK_PRESETS:
+            raise ValueError(f"请指定 outputShapes 或 preset, 可选: {tuple(MOCK_PRESETS)}")
+        self.preset = preset
+        self.outputShapes = outputShapes
+        self.latency = latency
+        self.seed = seed
+        self.outputs = None
+        self.qoutputs = None
+        self.qparams = None
+
+    def load(self, model_path):
+        rng = np.random.default_rng(self.seed)
+        if self.outputShapes is None:
+            self.outputs = MOCK_PRESETS[self.preset](rng)
+        else:
+            self.outputs = [
+                rng.standard_normal(tuple(shape)).astype(np.float32)
+                for shape in self.outputShapes
+            ]
+        quantized = [quantizeAffine(out) for out in self.outputs]
+        self.qoutputs = [q for q, _ in quantized]
+        self.qparams = [params for _, params in quantized]
+        for out in self.outputs + self.qoutputs:
+            out.flags.writeable = False  # 所有帧共用同一组输出, 禁止就地修改
+        return 0
+
+    def init_runtime(self, core=None):
+        return 0
+
+    def inference(self, inputs, data_format=None):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return list(self.outputs)
+
+    def inference_quantized(self, inputs, data_format=None):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return list(self.qoutputs), list(self.qparams)
+
+
+BACKENDS = {
+    RKNNLiteBackend.name: RKNNLiteBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+    MockBackend.name: MockBackend,
+}
+
+
+def createBackend(backend="rknnlite"):
+    """backend 可以是 BACKENDS 中的名字, 也可以是返回后端实例的工厂函数。"""
+    if callable(backend):
+        return backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {backend}, 可选: {tuple(BACKENDS)}")
+    return BACKENDS[backend]()
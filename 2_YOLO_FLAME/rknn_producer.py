@@ -1,10 +1,17 @@
 import cv2
+import functools
 import time
 import os
-from rknnpool import rknnPoolExecutor
+import numpy as np
+from rknnpool import rknnPoolExecutor, rknnPipelineExecutor
 
 # 图像处理函数，实际应用过程中需要自行修改
-from func import myFunc
+from func import detectFunc, renderFunc, reuse_detections, DETECT_STAGES, PIPELINE_STAGES
+from scene_gate import SceneGate, GatedPool
+from capture_thread import CaptureThread
+from frame_transport import FrameSender, ParallelFrameSender, configureLatency
+from rate_control import RateController, FEEDBACK_PORT
+from metadata_channel import MetadataPublisher, METADATA_PORT
 
 import zmq
 
@@ -12,16 +19,118 @@ import zmq
 print("Initializing ZeroMQ Publisher...")
 context = zmq.Context()
 socket = context.socket(zmq.PUB)
+# 低延迟模式: 发送队列只保留 LATENCY_HWM 帧, 消费者跟不上时直接丢帧而不是积压 (须在 bind 之前设置)
+LATENCY_MODE = True
+if LATENCY_MODE:
+    configureLatency(socket)
 # 绑定到一个 TCP 端口。'5555' 是一个例子，你可以换成别的
 # 使用 '*' 表示允许任何 IP 连接
 socket.bind("tcp://*:5454")
 print("ZMQ Publisher is ready on tcp://*:5454")
+# 帧传输方式: "raw" 零拷贝发送原始像素 (消费者在本机时无需编解码), "jpeg" 用于远程链路
+TRANSPORT = "raw"
+JPEG_QUALITY = 95
+# 元数据通道: 每帧的检测结果在单独的端口上发布, 不受视频高水位 / 码率控制影响
+meta_socket = context.socket(zmq.PUB)
+meta_socket.bind(f"tcp://*:{METADATA_PORT}")
+publisher = MetadataPublisher(meta_socket)
+print(f"Metadata publisher is ready on tcp://*:{METADATA_PORT}")
+# 编码线程数: 缩放 / JPEG 编码放到独立的线程池中与采集和推理重叠, 按帧顺序发送; 0 表示在主循环中编码
+ENCODE_WORKERS = 2
+sender = FrameSender(socket, TRANSPORT, JPEG_QUALITY)
+if ENCODE_WORKERS > 0:
+    sender = ParallelFrameSender(sender, ENCODE_WORKERS)
+# 自适应码率: 按实测码率和订阅端回传的帧龄 / 丢帧率调整 JPEG 质量和输出缩放, 用于带宽有限的远程链路;
+# TARGET_KBPS / TARGET_LATENCY_MS 为 None 时不按该项控制
+RATE_CONTROL = False
+TARGET_KBPS = 4000
+TARGET_LATENCY_MS = 200
+controller = None
+if RATE_CONTROL:
+    feedback_socket = context.socket(zmq.SUB)
+    feedback_socket.setsockopt_string(zmq.SUBSCRIBE, "")
+    feedback_socket.bind(f"tcp://*:{FEEDBACK_PORT}")
+    controller = RateController(
+        TARGET_KBPS, TARGET_LATENCY_MS, maxQuality=JPEG_QUALITY, feedbackSocket=feedback_socket
+    )
 # --- 结束 ZMQ 初始化 ---
 
 # 指定输出文件夹
 output_folder = "/root/code/rknn3588-yolov8/output/output_videos1"
 os.makedirs(output_folder, exist_ok=True)
 
+modelPath = "./1_rknnModel/yolov8_seg.rknn"
+# 线程数, 增大可提高帧率
+TPEs = 3
+# 在途帧上限与丢帧策略, 推理跟不上采集时丢弃最旧的帧, 保证延迟有界
+MAX_INFLIGHT = TPEs * 2
+DROP_POLICY = "drop_oldest"
+# 读取视频文件时按其帧率节流, 模拟实时相机; False 时尽快读取 (DROP_POLICY 改为 "block" 可逐帧处理)
+REALTIME = True
+# 推理后端: "rknnlite" (板端 NPU), "onnx" (CPU, modelPath 需指向 .onnx),
+# 或离板调试用的 functools.partial(MockBackend, preset="yolov8", latency=0.03)
+BACKEND = "rknnlite"
+# 启动时用合成帧在每个实例上预热推理的次数, 避免首批真实帧承担运行时的延迟初始化
+WARMUP_RUNS = 2
+WARMUP_FRAME = np.zeros((720, 1280, 3), dtype=np.uint8)
+# 输出顺序: ORDERED=False 时只输出最新完成的帧; FRAME_DEADLINE (秒) 不为 None 时
+# 跳过采集后超过该时限仍未处理完的帧, 避免一帧慢推理阻塞后面已完成的帧
+ORDERED = True
+FRAME_DEADLINE = None
+# 流水线模式: 前处理 / 推理 / 后处理 / 绘制各自使用独立线程, NPU 不再等待 CPU
+USE_PIPELINE = False
+# 流水线模式下放到子进程中执行的阶段, 例如 ("preprocess", "postprocess", "render"),
+# 帧和张量通过共享内存传递, 前后处理可以用满 8 个 CPU 核心; 每帧多一次共享内存拷贝和进程间往返,
+# 只在 stats() 中这些阶段的占用率接近 100% 时开启 (见 rknnPipelineExecutor 的说明)
+PROCESS_STAGES = ()
+# False 时不在帧上绘制检测框, 只输出结构化检测结果 (见 func.DETECTION_DTYPE)
+RENDER = True
+# 场景门控: 画面分块亮度变化都不超过 GATE_THRESHOLD (0-255) 时不推理, 沿用上一次的检测结果;
+# 连续沿用 GATE_REFRESH 帧后强制推理一次
+SCENE_GATE = False
+GATE_THRESHOLD = 12
+GATE_REFRESH = 15
+# 初始化rknn池, withMeta=True: 检测结果带上帧号和采集时间
+if USE_PIPELINE:
+    pool = rknnPipelineExecutor(
+        rknnModel=modelPath,
+        TPEs=TPEs,
+        stages=PIPELINE_STAGES if RENDER else DETECT_STAGES,
+        workers={"postprocess": 2},
+        dropPolicy=DROP_POLICY,
+        backend=BACKEND,
+        processStages=PROCESS_STAGES,
+        warmupFrame=WARMUP_FRAME,
+        warmupRuns=WARMUP_RUNS,
+        asyncInit=True,
+        withMeta=True,
+    )
+else:
+    pool = rknnPoolExecutor(
+        rknnModel=modelPath,
+        TPEs=TPEs,
+        func=renderFunc if RENDER else detectFunc,
+        maxInflight=MAX_INFLIGHT,
+        dropPolicy=DROP_POLICY,
+        backend=BACKEND,
+        ordered=ORDERED,
+        deadline=FRAME_DEADLINE,
+        warmupFrame=WARMUP_FRAME,
+        warmupRuns=WARMUP_RUNS,
+        asyncInit=True,
+        withMeta=True,
+    )
+
+# 实例在后台并行加载和预热, 就绪后才打开视频开始读帧
+pool.waitReady()
+print("rknn池就绪, 启动耗时:\t", pool.stats()["startup"])
+if SCENE_GATE:
+    pool = GatedPool(
+        pool,
+        SceneGate(GATE_THRESHOLD, GATE_REFRESH),
+        functools.partial(reuse_detections, render=RENDER),
+    )
+
 cap = cv2.VideoCapture("./test.mp4")
 # cap = cv2.VideoCapture(0)
 # cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
@@ -29,53 +138,47 @@ cap = cv2.VideoCapture("./test.mp4")
 # cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
 # cap.set(cv2.CAP_PROP_FPS, 60)
 
-modelPath = "./1_rknnModel/yolov8_seg.rknn"
-# 线程数, 增大可提高帧率
-TPEs = 3
-# 初始化rknn池
-pool = rknnPoolExecutor(rknnModel=modelPath, TPEs=TPEs, func=myFunc)
-
-# 初始化异步所需要的帧
-if cap.isOpened():
-    for i in range(TPEs + 1):
-        ret, frame = cap.read()
-        if not ret:
-            cap.release()
-            del pool
-            exit(-1)
-        pool.put(frame)
-
 frames, loopTime, initTime = 0, time.time(), time.time()
+# 输出帧号: 每发送一帧加 1, 视频帧头和元数据共用 (sender.sent 在并行编码时落后于已提交的帧)
+frame_id = 0
 
 # 获取视频信息
 width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
 height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 fps = cap.get(cv2.CAP_PROP_FPS)
+if not cap.isOpened():
+    pool.release()
+    exit(-1)
+# 采集线程按视频帧率读取并提交帧, 主循环只取结果; 推理跟不上时由处理池的准入控制丢帧,
+# 而不是让采集跟着推理变慢、帧在摄像头缓冲区里越积越多
+capture = CaptureThread(cap, pool, fps if REALTIME and fps > 0 else None).start()
 
 # # 创建视频写入对象
 # output_path = os.path.join(output_folder, "output_video.mp4")
 # fourcc = cv2.VideoWriter_fourcc(*"mp4v")
 # out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
 
-while cap.isOpened():
+while True:
     frames += 1
-    ret, frame = cap.read()
-    if not ret:
-        break
-    # print(frame.shape)
-    pool.put(frame)
-    processed_frame, flag = pool.get()
+    # 视频读完且所有帧都处理完后返回 flag=False
+    result, flag = capture.get()
     if flag == False:
         break
+    # detections: 结构化记录数组 (box / class / score / frame_id / timestamp), 已映射回原图坐标
+    processed_frame, detections = result
     # print(frame.shape)
     # ==================== 核心修改：发送图像而不是显示 ====================
 
-    # 将图像编码为JPEG格式，以减少传输数据量
-    # 95 是质量参数 (0-100)，越高图像质量越好，数据量越大
-    _, buffer = cv2.imencode(".jpg", processed_frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-
-    # ZMQ 发送编码后的数据
-    socket.send(buffer)
+    # raw: 帧头 + 原始像素零拷贝发送, 发送后不能再修改 processed_frame (每次 cap.read 都是新帧);
+    # jpeg: 编码后发送, JPEG_QUALITY (0-100) 越高图像质量越好，数据量越大
+    # 元数据先于视频发布, 消息头与视频帧使用同一个帧号和时间戳;
+    # 检测记录中的 frame_id / timestamp 保持为实际推理的那一帧 (场景门控复用时与输出帧不同), 不在这里改写
+    now = time.time()
+    publisher.publishDetections(detections, frame_id, now, processed_frame.shape)
+    sender.send(processed_frame, frame_id, now)
+    frame_id += 1
+    if controller is not None:
+        controller.step(sender)
 
     # 你可以加一个小的延时来控制发送帧率，如果需要的话
     # time.sleep(0.01)
@@ -91,9 +194,31 @@ while cap.isOpened():
     if frames % 30 == 0:
         print("30帧平均帧率:\t", 30 / (time.time() - loopTime), "帧")
         loopTime = time.time()
+        pool_stats = pool.stats()
+        print(
+            "NPU实例利用率:\t",
+            ", ".join(
+                f"core{u['core']}={u['busy']:.0%}" for u in pool_stats["utilization"]
+            ),
+        )
+        for st in pool_stats.get("stages", []):
+            print(
+                f"  阶段 {st['name']}: 占用率 {st['occupancy']:.0%}, "
+                f"平均 {st['avgMs']:.1f} ms, 排队 {st['queued']}"
+            )
+        if "gate" in pool_stats:
+            print("场景门控:\t", pool_stats["gate"])
+        print("发送:\t", sender.stats(), "元数据:", publisher.stats())
+        if controller is not None:
+            print("码率控制:\t", controller.stats())
+        if pool_stats["dropped"]:
+            print("准入控制丢帧:\t", pool_stats)
+            print("采集:\t", capture.stats())
 
 print("总平均帧率\t", frames / (time.time() - initTime))
 # 释放cap和rknn线程池
+capture.stop(timeout=5)
 cap.release()
 cv2.destroyAllWindows()
 pool.release()
+sender.close()
@@ -1,60 +1,602 @@
-from queue import Queue
+import threading
+import time
+from collections import deque, namedtuple
+from queue import Empty, Full, Queue
 # import torch
-from rknnlite.api import RKNNLite
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from rknn_backend import createBackend
+from shm_workers import ProcessStageRunner, detach
 
-def initRKNN(rknnModel="./rknnModel/uiunet.rknn", id=0):
-    rknn_lite = RKNNLite()
-    ret = rknn_lite.load_rknn(rknnModel)
+# 队列满时的丢帧策略
+DROP_OLDEST = "drop_oldest"  # 丢弃最旧的、尚未开始推理的帧 (最新帧优先)
+DROP_NEWEST = "drop_newest"  # 丢弃当前新提交的帧
+BLOCK = "block"  # 阻塞 put(), 直到有帧处理完成
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+# getResult() 的返回值: seq 为 put() 的调用序号, timestamp 为采集时间 (time.time())
+FrameResult = namedtuple("FrameResult", ["seq", "timestamp", "result"])
+
+
+class _Pending():
+    __slots__ = ("seq", "timestamp", "fut", "doneTime")
+
+    def __init__(self, seq, timestamp, fut):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.fut = fut
+        self.doneTime = None
+
+
+def initRKNN(rknnModel="./rknnModel/uiunet.rknn", id=0, backend="rknnlite"):
+    # 失败时抛出异常而不是在这里打印: 多个实例在加载线程中并行初始化, 各自打印的输出会交错,
+    # 由 _ContextPool 在全部实例结束后统一输出每个核心的状态
+    rknn_lite = createBackend(backend)
+    ret = rknn_lite.load(rknnModel)
     if ret != 0:
-        print("Load RKNN rknnModel failed")
-        exit(ret)
-    if id == 0:
-        ret = rknn_lite.init_runtime(core_mask=RKNNLite.NPU_CORE_0)
-    elif id == 1:
-        ret = rknn_lite.init_runtime(core_mask=RKNNLite.NPU_CORE_1)
-    elif id == 2:
-        ret = rknn_lite.init_runtime(core_mask=RKNNLite.NPU_CORE_2)
-    elif id == -1:
-        ret = rknn_lite.init_runtime(core_mask=RKNNLite.NPU_CORE_0_1_2)
-    else:
-        ret = rknn_lite.init_runtime()
+        raise RuntimeError(f"Load RKNN rknnModel failed (ret={ret})")
+    ret = rknn_lite.init_runtime(id)
     if ret != 0:
-        print("Init runtime environment failed")
-        exit(ret)
-    print(rknnModel, "\t\tdone")
+        raise RuntimeError(f"Init runtime environment failed (ret={ret})")
     return rknn_lite
 
 
-def initRKNNs(rknnModel="./rknnModel/uiunet.rknn", TPEs=1):
-    rknn_list = []
-    for i in range(TPEs):
-        rknn_list.append(initRKNN(rknnModel, i % 3))
-    return rknn_list
+def coreOf(index):
+    # 第 index 个 RKNNLite 实例绑定的 NPU 核心
+    return index % 3
+
+
+def initRKNNs(rknnModel="./rknnModel/uiunet.rknn", TPEs=1, backend="rknnlite",
+              warmup=None, timings=None):
+    """
+    并行加载并初始化 TPEs 个实例。
+    warmup: 可选, warmup(rknn_lite) 在加载线程中对刚初始化的实例做预热推理,
+            把运行时的延迟初始化开销挪到启动阶段。
+    timings: 可选列表, 每个实例结束后追加其核心、加载和预热耗时 (秒) 以及失败原因 (error, 成功为 None)。
+    所有实例都结束后才返回; 有实例失败时抛出第一个失败实例的异常。
+    """
+    def initOne(i):
+        start = time.perf_counter()
+        timing = {"index": i, "core": coreOf(i), "load": None, "warmup": None, "error": None}
+        try:
+            rknn_lite = initRKNN(rknnModel, coreOf(i), backend)
+            loaded = time.perf_counter()
+            timing["load"] = loaded - start
+            if warmup is not None:
+                warmup(rknn_lite)
+            timing["warmup"] = time.perf_counter() - loaded
+            return rknn_lite
+        except Exception as e:
+            timing["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            if timings is not None:
+                timings.append(timing)
 
+    # 退出 with 时等待全部加载线程结束, 之后 map 的结果才按序号抛出第一个异常
+    with ThreadPoolExecutor(max_workers=TPEs) as loader:
+        results = loader.map(initOne, range(TPEs))
+    return list(results)
 
-class rknnPoolExecutor():
-    def __init__(self, rknnModel, TPEs, func):
+
+class _ContextPool():
+    """
+    两种执行器共用的 RKNNLite 实例管理: 并行加载与预热、就绪信号、空闲实例分配、
+    每个实例的利用率统计。
+    """
+
+    def _initContexts(self, rknnModel, TPEs, backend, warmup, asyncInit):
         self.TPEs = TPEs
-        self.queue = Queue()
-        self.rknnPool = initRKNNs(rknnModel, TPEs)
-        self.pool = ThreadPoolExecutor(max_workers=TPEs)
+        self.rknnPool = []
+        # 空闲实例池: 每帧取第一个空闲的 RKNNLite 实例, 而不是按 num 轮询,
+        # 避免某个核心上的慢帧拖住每第 TPEs 帧
+        self.idle = Queue()
+        self.busyTime = [0.0] * TPEs
+        self.tasksDone = [0] * TPEs
+        self.statLock = threading.Lock()
+        self.startTime = time.perf_counter()
+        self.ready = threading.Event()
+        self.startupError = None
+        self.startupStats = None
+        args = (rknnModel, TPEs, backend, warmup)
+        if asyncInit:
+            # 后台加载, 调用方可以先做其他初始化, 读取视频前再 waitReady()
+            threading.Thread(target=self._startup, args=args, daemon=True).start()
+        else:
+            self._startup(*args)
+            self.waitReady()
+
+    def _startup(self, rknnModel, TPEs, backend, warmup):
+        start = time.perf_counter()
+        timings = []
+        try:
+            self.rknnPool = initRKNNs(rknnModel, TPEs, backend, warmup, timings)
+        except BaseException as e:  # 加载或预热失败, 由 waitReady() 转交给调用方
+            self.startupError = e
+        else:
+            for i in range(TPEs):
+                self.idle.put(i)
+            self.startupStats = {
+                "total": time.perf_counter() - start,
+                "contexts": sorted(timings, key=lambda t: t["index"]),
+            }
+            self.startTime = time.perf_counter()
+        finally:
+            # 所有加载线程都已结束, 一次性输出每个实例的状态, 不会与其他线程的输出交错
+            print("\n".join(
+                f"{rknnModel}\tcore{t['core']}\t\t{'done' if t['error'] is None else t['error']}"
+                for t in sorted(timings, key=lambda t: t["index"])
+            ))
+            self.ready.set()
+
+    def waitReady(self, timeout=None):
+        """等待所有实例加载并预热完成; 超时返回 False, 启动失败时抛出原异常。"""
+        if not self.ready.wait(timeout):
+            return False
+        if self.startupError is not None:
+            raise self.startupError
+        return True
+
+    def _withContext(self, fn, data):
+        idx = self.idle.get()
+        start = time.perf_counter()
+        try:
+            return fn(self.rknnPool[idx], data)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.statLock:
+                self.busyTime[idx] += elapsed
+                self.tasksDone[idx] += 1
+            self.idle.put(idx)
+
+    def utilization(self):
+        """每个 RKNNLite 实例的忙碌时间占比 (自实例就绪起)。"""
+        wall = max(time.perf_counter() - self.startTime, 1e-9)
+        with self.statLock:
+            return [
+                {
+                    "index": i,
+                    "core": coreOf(i),
+                    "tasks": self.tasksDone[i],
+                    "busy": self.busyTime[i] / wall,
+                }
+                for i in range(self.TPEs)
+            ]
+
+    def _releaseContexts(self):
+        self.ready.wait()
+        for rknn_lite in self.rknnPool:
+            rknn_lite.release()
+
+
+class rknnPoolExecutor(_ContextPool):
+    """
+    maxInflight: 已提交但尚未处理完成的帧数上限, None 表示不限制 (原有行为)。
+    dropPolicy: 达到上限时的处理方式, 取值见 DROP_POLICIES。
+    backend: 推理后端名字或工厂函数, 见 rknn_backend.createBackend。
+    ordered: True 时按提交顺序输出; False 时 get() 总是返回最新完成的帧,
+             更旧的结果直接丢弃 (只关心最新检测结果的消费者使用)。
+    deadline: 有序模式下每帧的时限 (秒, 从采集时间算起), 超时仍未完成的帧被跳过,
+              不再阻塞后面已完成的帧; None 表示一直等待 (原有行为)。
+    warmupFrame / warmupRuns: 启动时用该合成帧在每个实例上执行 func 的次数, 预热完成后才就绪。
+    asyncInit: True 时在后台线程中并行加载实例, 构造函数立即返回, 用 waitReady() 等待就绪。
+    withMeta: True 时 func 收到的是 (frame, seq, timestamp), 可用来给结果标上帧号和采集时间;
+              预热帧的 seq 为 -1。
+    """
+
+    def __init__(self, rknnModel, TPEs, func, maxInflight=None, dropPolicy=BLOCK,
+                 backend="rknnlite", ordered=True, deadline=None, warmupFrame=None,
+                 warmupRuns=1, asyncInit=False, withMeta=False):
+        if dropPolicy not in DROP_POLICIES:
+            raise ValueError(f"未知的丢帧策略: {dropPolicy}, 可选: {DROP_POLICIES}")
+        if maxInflight is not None and maxInflight < 1:
+            raise ValueError("maxInflight 必须 >= 1")
+        self.queue = deque()  # 等待 get() 取走的 _Pending, 按提交顺序排列
         self.func = func
+        self.withMeta = withMeta
+        self.warmupFrame = warmupFrame
+        self.warmupRuns = warmupRuns
+        self._initContexts(
+            rknnModel, TPEs, backend,
+            self._warmup if warmupFrame is not None else None, asyncInit)
+        self.pool = ThreadPoolExecutor(max_workers=TPEs)
         self.num = 0
+        self.seq = 0
+        self.maxInflight = maxInflight
+        self.dropPolicy = dropPolicy
+        self.inflight = 0
+        self.droppedOldest = 0
+        self.droppedNewest = 0
+        self.ordered = ordered
+        self.deadline = deadline
+        self.late = 0  # 有序模式下因超过 deadline 被跳过的帧
+        self.superseded = 0  # 无序模式下被更新的结果覆盖的帧
+        # 默认使用 RLock: future.cancel() 会在当前线程内同步调用 _onDone
+        self.cond = threading.Condition()
+
+    def _warmup(self, rknn_lite):
+        for _ in range(self.warmupRuns):
+            data = self.warmupFrame.copy()
+            self.func(rknn_lite, (data, -1, 0.0) if self.withMeta else data)
+
+    def _run(self, frame):
+        return self._withContext(self.func, frame)
+
+    def _onDone(self, item):
+        with self.cond:
+            item.doneTime = time.time()
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    def _dropOldestPending(self):
+        # 只有还在线程池里排队的帧可以取消, 正在推理的帧无法中断
+        for item in self.queue:
+            if item.fut.cancel():
+                self.queue.remove(item)
+                self.droppedOldest += 1
+                return True
+        return False
+
+    def put(self, frame, timestamp=None):
+        """提交一帧, 返回 False 表示该帧因准入控制被丢弃。"""
+        self.waitReady()
+        if timestamp is None:
+            timestamp = time.time()
+        with self.cond:
+            seq = self.seq
+            self.seq += 1
+            if self.maxInflight is not None and self.inflight >= self.maxInflight:
+                if self.dropPolicy == BLOCK:
+                    self.cond.wait_for(lambda: self.inflight < self.maxInflight)
+                elif not (
+                    self.dropPolicy == DROP_OLDEST and self._dropOldestPending()
+                ):
+                    # DROP_OLDEST 时若所有帧都已在推理中, 退化为丢弃新帧
+                    self.droppedNewest += 1
+                    return False
+            self.inflight += 1
+            data = (frame, seq, timestamp) if self.withMeta else frame
+            item = _Pending(seq, timestamp, self.pool.submit(self._run, data))
+            self.queue.append(item)
+            self.num += 1
+            # 在锁内注册回调, 保证 get() 看到的已完成帧都记录了 doneTime
+            item.fut.add_done_callback(lambda fut, item=item: self._onDone(item))
+        return True
+
+    def _isLate(self, item, now):
+        if self.deadline is None:
+            return False
+        finished = item.doneTime if item.doneTime is not None else now
+        return finished - item.timestamp > self.deadline
+
+    def _nextOrdered(self):
+        while self.queue:
+            item = self.queue[0]
+            now = time.time()
+            if item.fut.done() or self._isLate(item, now):
+                self.queue.popleft()
+                if self._isLate(item, now):
+                    # 仍在排队的超时帧直接取消, 正在推理的让它跑完后丢弃
+                    item.fut.cancel()
+                    self.late += 1
+                    continue
+                return item
+            timeout = None
+            if self.deadline is not None:
+                timeout = item.timestamp + self.deadline - now
+            self.cond.wait(timeout)
+        return None
 
-    def put(self, frame):
-        self.queue.put(self.pool.submit(
-            self.func, self.rknnPool[self.num % self.TPEs], frame))
-        self.num += 1
+    def _nextLatest(self):
+        while self.queue:
+            done = [i for i, item in enumerate(self.queue) if item.fut.done()]
+            if not done:
+                self.cond.wait()
+                continue
+            newest = done[-1]
+            for _ in range(newest):
+                # 更旧的帧: 排队中的取消, 正在推理的让它跑完后丢弃
+                self.queue.popleft().fut.cancel()
+            self.superseded += newest
+            return self.queue.popleft()
+        return None
+
+    def getResult(self):
+        """
+        取下一个结果, 返回 FrameResult; 队列中没有帧时返回 None。
+        有序模式按 seq 顺序输出并跳过超时帧, 无序模式输出最新完成的帧。
+        """
+        with self.cond:
+            item = self._nextOrdered() if self.ordered else self._nextLatest()
+        if item is None:
+            return None
+        return FrameResult(item.seq, item.timestamp, item.fut.result())
 
     def get(self):
-        if self.queue.empty():
+        frame = self.getResult()
+        if frame is None:
             return None, False
-        fut = self.queue.get()
-        return fut.result(), True
+        return frame.result, True
+
+    def stats(self):
+        utilization = self.utilization()
+        with self.cond:
+            return {
+                "submitted": self.num,
+                "inflight": self.inflight,
+                "maxInflight": self.maxInflight,
+                "dropPolicy": self.dropPolicy,
+                "droppedOldest": self.droppedOldest,
+                "droppedNewest": self.droppedNewest,
+                "dropped": self.droppedOldest + self.droppedNewest,
+                "ordered": self.ordered,
+                "deadline": self.deadline,
+                "late": self.late,
+                "superseded": self.superseded,
+                "utilization": utilization,
+                "startup": self.startupStats,
+            }
 
     def release(self):
         self.pool.shutdown()
-        for rknn_lite in self.rknnPool:
-            rknn_lite.release()
+        self._releaseContexts()
+
+
+class _Job():
+    __slots__ = ("seq", "timestamp", "data", "error", "slot")
+
+    def __init__(self, seq, timestamp, data):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.data = data
+        self.error = None
+        self.slot = None  # 进程阶段使用的共享内存槽位
+
+
+class Stage():
+    """
+    流水线中的一个阶段。
+    fn: 普通阶段调用 fn(data), 推理阶段 (useContext=True) 调用 fn(rknn_lite, data),
+        返回值作为下一阶段的 data。
+    workers: 该阶段的线程数; queueSize: 该阶段输入队列的容量, 满了会反压上游。
+    inProcess: 为 True 时 fn 在子进程中执行 (见 shm_workers), 不受 GIL 限制。
+    """
+
+    def __init__(self, name, fn, useContext=False, workers=1, queueSize=2,
+                 inProcess=False):
+        self.name = name
+        self.fn = fn
+        self.useContext = useContext
+        self.inProcess = inProcess
+        self.workers = workers
+        self.queue = Queue(maxsize=queueSize)
+        self.threads = []
+        self.busyTime = 0.0
+        self.processed = 0
+
+
+_DROPPED = object()  # 占位: 该 seq 在进入流水线前被丢弃
+
+
+class rknnPipelineExecutor(_ContextPool):
+    """
+    多阶段流水线执行器, 对外接口与 rknnPoolExecutor 相同 (put / get / getResult / stats / release)。
+    stages: (阶段名, 阶段函数, 是否需要 RKNNLite 实例) 的序列, 例如 func.PIPELINE_STAGES。
+    workers / queueSizes: 按阶段名配置线程数和输入队列容量, 推理阶段默认 TPEs 个线程,
+        子进程阶段默认 max(2, 子进程阶段数) 个线程, 其他阶段默认 1 个线程; 容量默认 2。
+    RKNNLite 实例只在推理阶段函数执行期间被占用, 前后处理与 NPU 推理并行。
+    队列满时的丢帧策略同 rknnPoolExecutor (作用于第一个阶段的输入队列)。
+    processStages: 放到子进程中执行的阶段名 (不能是推理阶段), 帧和张量通过共享内存传递;
+        processSlots / slotBytes 为共享内存槽位数和每个槽位的大小。
+        每次调用要把帧拷进共享内存并经过一次进程间往返 (约 1-2 ms), 只有当线程模式下
+        前后处理的阶段占用率接近 100% (受 GIL 限制, 成为瓶颈) 且还有空闲 CPU 核心时才值得开启;
+        阶段本身只需 1-2 ms 或者 CPU 核心数不多于阶段线程数时, 子进程只会更慢。
+    warmupFrame / warmupRuns / asyncInit / withMeta: 同 rknnPoolExecutor,
+        预热时在加载线程中依次执行各阶段; withMeta 作用于第一个阶段的输入。
+    """
+
+    def __init__(self, rknnModel, TPEs, stages, workers=None, queueSizes=None,
+                 dropPolicy=BLOCK, backend="rknnlite", processStages=(),
+                 processSlots=None, slotBytes=64 << 20, warmupFrame=None,
+                 warmupRuns=1, asyncInit=False, withMeta=False):
+        if dropPolicy not in DROP_POLICIES:
+            raise ValueError(f"未知的丢帧策略: {dropPolicy}, 可选: {DROP_POLICIES}")
+        workers = workers or {}
+        queueSizes = queueSizes or {}
+        self.dropPolicy = dropPolicy
+        # 子进程阶段每个线程同一时刻只有一次进程间调用在途, 只有 1 个线程时往返延迟无法与下一帧重叠,
+        # 进程池 (各子进程阶段共享) 也用不满
+        processWorkers = max(2, sum(1 for name, _, _ in stages if name in processStages))
+        self.stages = [
+            Stage(
+                name,
+                fn,
+                useContext,
+                workers.get(
+                    name,
+                    TPEs if useContext else processWorkers if name in processStages else 1,
+                ),
+                queueSizes.get(name, 2),
+                name in processStages,
+            )
+            for name, fn, useContext in stages
+        ]
+        self.runner = None
+        if processStages:
+            if any(stage.useContext and stage.inProcess for stage in self.stages):
+                raise ValueError("推理阶段必须留在持有 RKNNLite 实例的主进程中")
+            # 必须在初始化 NPU 和启动阶段线程之前 fork 子进程
+            self.runner = ProcessStageRunner(
+                processes=sum(st.workers for st in self.stages if st.inProcess),
+                slots=processSlots or 2 * (TPEs + len(self.stages)),
+                slotBytes=slotBytes,
+            )
+        self.withMeta = withMeta
+        self.warmupFrame = warmupFrame
+        self.warmupRuns = warmupRuns
+        self._initContexts(
+            rknnModel, TPEs, backend,
+            self._warmup if warmupFrame is not None else None, asyncInit)
+        self.cond = threading.Condition()
+        self.results = {}  # seq -> 已走完流水线的 _Job 或 _DROPPED
+        self.seq = 0
+        self.nextSeq = 0
+        self.droppedOldest = 0
+        self.droppedNewest = 0
+        self.stageStart = time.perf_counter()
+        for i, stage in enumerate(self.stages):
+            nextStage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            for _ in range(stage.workers):
+                t = threading.Thread(
+                    target=self._stageLoop, args=(stage, nextStage), daemon=True)
+                t.start()
+                stage.threads.append(t)
+
+    def _warmup(self, rknn_lite):
+        # 预热在加载线程中串行执行各阶段, 不经过阶段线程和子进程
+        for _ in range(self.warmupRuns):
+            data = self.warmupFrame.copy()
+            if self.withMeta:
+                data = (data, -1, 0.0)
+            for stage in self.stages:
+                data = stage.fn(rknn_lite, data) if stage.useContext else stage.fn(data)
+
+    def _callStage(self, stage, job):
+        if stage.inProcess:
+            if job.slot is None:
+                job.slot = self.runner.acquire()
+            return self.runner.call(stage.fn, job.slot, job.data)
+        if not stage.useContext:
+            return stage.fn(job.data)
+        return self._withContext(stage.fn, job.data)
+
+    def _stageLoop(self, stage, nextStage):
+        while True:
+            job = stage.queue.get()
+            if job is None:
+                stage.queue.put(None)  # 让同阶段的其他线程也退出
+                return
+            if job.error is None:
+                start = time.perf_counter()
+                try:
+                    job.data = self._callStage(stage, job)
+                except Exception as e:
+                    job.error = e
+                elapsed = time.perf_counter() - start
+                with self.cond:
+                    stage.busyTime += elapsed
+                    stage.processed += 1
+            if nextStage is not None:
+                nextStage.queue.put(job)
+            else:
+                self._finish(job.seq, job)
+
+    def _finish(self, seq, job):
+        if job is not _DROPPED and job.slot is not None:
+            # 结果拷出共享内存后归还槽位
+            job.data = detach(job.data, job.slot)
+            self.runner.releaseSlot(job.slot)
+            job.slot = None
+        with self.cond:
+            self.results[seq] = job
+            self.cond.notify_all()
+
+    def put(self, frame, timestamp=None):
+        """提交一帧, 返回 False 表示该帧因准入控制被丢弃。"""
+        self.waitReady()
+        if timestamp is None:
+            timestamp = time.time()
+        with self.cond:
+            seq = self.seq
+            self.seq += 1
+        job = _Job(seq, timestamp, (frame, seq, timestamp) if self.withMeta else frame)
+        first = self.stages[0].queue
+        if self.dropPolicy == BLOCK:
+            first.put(job)
+            return True
+        while True:
+            try:
+                first.put_nowait(job)
+                return True
+            except Full:
+                pass
+            if self.dropPolicy == DROP_NEWEST:
+                with self.cond:
+                    self.droppedNewest += 1
+                self._finish(seq, _DROPPED)
+                return False
+            try:
+                oldest = first.get_nowait()
+            except Empty:
+                continue
+            with self.cond:
+                self.droppedOldest += 1
+            self._finish(oldest.seq, _DROPPED)
+
+    def getResult(self):
+        """按 seq 顺序取下一个结果, 返回 FrameResult; 流水线中没有帧时返回 None。"""
+        with self.cond:
+            while self.nextSeq < self.seq:
+                job = self.results.pop(self.nextSeq, None)
+                if job is None:
+                    self.cond.wait()
+                    continue
+                self.nextSeq += 1
+                if job is _DROPPED:
+                    continue
+                if job.error is not None:
+                    raise job.error
+                return FrameResult(job.seq, job.timestamp, job.data)
+        return None
+
+    def get(self):
+        frame = self.getResult()
+        if frame is None:
+            return None, False
+        return frame.result, True
+
+    def stageStats(self):
+        """
+        每个阶段的占用率: occupancy = 忙碌时间 / (线程数 * 墙钟时间)。
+        推理阶段接近 100% 说明受限于 NPU, 某个 CPU 阶段接近 100% 说明受限于 CPU,
+        此时应增加该阶段的 workers。
+        """
+        wall = max(time.perf_counter() - self.stageStart, 1e-9)
+        with self.cond:
+            return [
+                {
+                    "name": stage.name,
+                    "workers": stage.workers,
+                    "processed": stage.processed,
+                    "queued": stage.queue.qsize(),
+                    "avgMs": stage.busyTime / stage.processed * 1000
+                    if stage.processed else 0.0,
+                    "occupancy": stage.busyTime / (stage.workers * wall),
+                }
+                for stage in self.stages
+            ]
+
+    def stats(self):
+        utilization = self.utilization()
+        stages = self.stageStats()
+        with self.cond:
+            return {
+                "submitted": self.seq,
+                "dropPolicy": self.dropPolicy,
+                "droppedOldest": self.droppedOldest,
+                "droppedNewest": self.droppedNewest,
+                "dropped": self.droppedOldest + self.droppedNewest,
+                "utilization": utilization,
+                "startup": self.startupStats,
+                "stages": stages,
+            }
+
+    def release(self):
+        # 按阶段顺序放入结束标记: 前一阶段的线程全部退出后, 它的帧都已进入下一阶段
+        for stage in self.stages:
+            stage.queue.put(None)
+            for t in stage.threads:
+                t.join()
+        if self.runner is not None:
+            self.runner.close()
+        self._releaseContexts()